@@ -0,0 +1,129 @@
+"""
+End-to-end throughput benchmarks against the local stand-in server.
+
+Runs the main client paths over real HTTP against a MockFreshdeskServer
+holding a large helpdesk, without network access:
+
+  listing    paging through every ticket summary (tickets/sec)
+  hydration  listing with hydrate=True, one GET per ticket (tickets/sec)
+  bulk       creating tickets through a.bulk (tickets/sec)
+  cache      get_ticket() served from a ResponseCache (calls/sec)
+
+Run from the repository root:
+
+    $ python benchmarks/bench_api.py --pages 200 --latency 0.005
+
+To catch regressions, save the results of a known-good build and compare
+later runs against them; the script exits non-zero if any benchmark lost
+more than --tolerance of its throughput:
+
+    $ python benchmarks/bench_api.py --save baseline.json
+    $ python benchmarks/bench_api.py --compare baseline.json
+"""
+
+import argparse
+import json
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from freshdesk.api import API
+from freshdesk.cache import ResponseCache
+from freshdesk.mockserver import PAGE_SIZE, MockFreshdeskServer
+
+
+def timed(func):
+    """Return how many seconds func() took"""
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def bench_listing(api, tickets):
+    return tickets / timed(lambda: sum(1 for _ in api.tickets.iter_tickets()))
+
+
+def bench_hydration(api, pages, max_workers):
+    count = []
+
+    def hydrate():
+        for page in api.tickets.iter_ticket_pages(hydrate=True, max_workers=max_workers):
+            count.append(len(page))
+            if len(count) == pages:
+                break
+    elapsed = timed(hydrate)
+    return sum(count) / elapsed
+
+
+def bench_bulk(api, count, max_workers):
+    tickets = ({'subject': 'Ticket %d' % i, 'description': 'Created by bench_api', 'email': 'bench@example.com'}
+               for i in range(count))
+    results = []
+    elapsed = timed(lambda: results.append(api.bulk.create_tickets(tickets, max_workers=max_workers)))
+    assert not results[0].failed, results[0]
+    return count / elapsed
+
+
+def bench_cache(api, count):
+    api.tickets.get_ticket(1)
+    return count / timed(lambda: [api.tickets.get_ticket(1) for _ in range(count)])
+
+
+def run(pages=100, latency=0.0, max_workers=8, hydrate_pages=5, bulk=500, cache_calls=5000):
+    """Run every benchmark and return {name: rate}"""
+    tickets = pages * PAGE_SIZE
+    with MockFreshdeskServer(tickets=tickets, latency=latency) as server:
+        api = API(server.domain, api_key='bench', use_https=False)
+        cached = API(server.domain, api_key='bench', use_https=False, cache=ResponseCache(ttl=3600))
+        return {
+            'listing': bench_listing(api, tickets),
+            'hydration': bench_hydration(api, hydrate_pages, max_workers),
+            'bulk': bench_bulk(api, bulk, max_workers),
+            'cache': bench_cache(cached, cache_calls),
+        }
+
+
+def compare(results, baseline, tolerance):
+    """Print each result against the baseline; return the names of the
+    benchmarks that regressed by more than tolerance"""
+    regressed = []
+    for name, rate in sorted(results.items()):
+        before = baseline.get(name)
+        if not before:
+            continue
+        change = rate / before - 1
+        print('{:<10} {:+.1%} against baseline'.format(name, change))
+        if change < -tolerance:
+            regressed.append(name)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--pages', type=int, default=100, help='pages of tickets the server holds')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the server waits per request')
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare the results with this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed fractional slowdown (default 0.2)')
+    args = parser.parse_args()
+
+    results = run(pages=args.pages, latency=args.latency, max_workers=args.max_workers)
+    units = {'cache': 'calls/sec'}
+    for name, rate in sorted(results.items()):
+        print('{:<10} {:>12,.0f} {}'.format(name, rate, units.get(name, 'tickets/sec')))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressed = compare(results, json.load(f), args.tolerance)
+        if regressed:
+            print('Regressed: {}'.format(', '.join(regressed)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Micro-benchmark for the JSON codecs in freshdesk.codec.
+
+Decodes a filter page and a full ticket built from sample_json_data, and
+encodes a ticket creation body, with every codec that is installed. Reports
+MB/sec for decoding and bodies/sec for encoding. Run from the repository root:
+
+    $ python benchmarks/bench_json.py
+"""
+
+import json
+import os.path
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from freshdesk.codec import CODECS, get_codec
+from freshdesk.mockserver import read_fixture
+
+
+def payloads(page_size=30):
+    """The encoded bodies to decode: a filter page of page_size summaries
+    (Freshdesk's page size) and a single ticket with its notes"""
+    page = json.dumps(read_fixture('all_tickets.json') * page_size).encode('utf-8')
+    ticket = json.dumps(read_fixture('ticket_1.json')).encode('utf-8')
+    return [('filter page', page), ('ticket', ticket)]
+
+
+def bench_decode(codec, body, number=2000, repeat=5):
+    """Return the best MB/sec rate of decoding body"""
+    best = min(timeit.repeat(lambda: codec.loads(body), number=number, repeat=repeat))
+    return len(body) * number / best / 1e6
+
+
+def bench_encode(codec, number=20000, repeat=5):
+    """Return the best bodies/sec rate of encoding a ticket creation body"""
+    ticket = read_fixture('ticket_1.json')['helpdesk_ticket']
+    fields = dict((k, ticket[k]) for k in ('subject', 'description', 'priority', 'status', 'requester_id'))
+    body = {'helpdesk_ticket': fields}
+    best = min(timeit.repeat(lambda: codec.dumps(body), number=number, repeat=repeat))
+    return number / best
+
+
+def main():
+    bodies = payloads()
+    for name in sorted(CODECS):
+        try:
+            codec = get_codec(name)
+        except ImportError:
+            print('{}: not installed'.format(name))
+            continue
+        rates = ', '.join('{} {:,.1f} MB/sec'.format(label, bench_decode(codec, body)) for label, body in bodies)
+        print('{}: decode {}; encode {:,.0f}/sec'.format(name, rates, bench_encode(codec)))
+    print('Default codec: {}'.format(get_codec().name))
+
+
+if __name__ == '__main__':
+    main()
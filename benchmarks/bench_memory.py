@@ -0,0 +1,78 @@
+"""
+Memory benchmarks comparing regular models with compact (__slots__) models,
+and decoding a whole filter page with parsing it incrementally.
+
+Builds many Ticket objects from sample_json_data/all_tickets.json and reports
+the memory they hold, and the peak memory of consuming one large page, as
+measured by tracemalloc. Run from the repository root:
+
+    $ python benchmarks/bench_memory.py
+"""
+
+import gc
+import json
+import os.path
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from freshdesk.mockserver import read_fixture
+from freshdesk.models import Ticket
+from freshdesk.streaming import JSONArrayParser
+
+
+def measure(model, payloads):
+    """Return the bytes allocated per object when building model instances"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [model(None, **payload) for payload in payloads]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return (after - before) / float(len(payloads))
+
+
+def peak(consume, body):
+    """Return the peak bytes allocated while consume(body) runs"""
+    gc.collect()
+    tracemalloc.start()
+    consume(body)
+    result = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result
+
+
+def decode_whole(body):
+    for payload in json.loads(body):
+        Ticket(None, **payload)
+
+
+def decode_streamed(body, chunk_size=65536):
+    parser = JSONArrayParser(json.loads)
+    for i in range(0, len(body), chunk_size):
+        for payload in parser.feed(body[i:i + chunk_size]):
+            Ticket(None, **payload)
+    parser.close()
+
+
+def main(count=50000):
+    # Each ticket gets its own payload dict, as it would from a decoded page
+    payloads = [dict(p) for p in read_fixture('all_tickets.json') * count]
+    regular = measure(Ticket, payloads)
+    compact = measure(Ticket.compact(payloads[0]), payloads)
+    print('Ticket:         {:,.0f} bytes/object'.format(regular))
+    print('Compact Ticket: {:,.0f} bytes/object ({:.0%} of regular)'.format(compact, compact / regular))
+
+    body = json.dumps(payloads[:count // 10], default=str).encode('utf-8')
+    del payloads
+    whole = peak(decode_whole, body)
+    streamed = peak(decode_streamed, body)
+    print('Page of {:,.0f} KB, decoded whole: {:,.0f} KB peak'.format(len(body) / 1024.0, whole / 1024.0))
+    print('Page of {:,.0f} KB, streamed:      {:,.0f} KB peak ({:.1%} of whole)'.format(
+        len(body) / 1024.0, streamed / 1024.0, streamed / float(whole)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Micro-benchmark for model hydration.
+
+Builds Ticket objects from the summaries in sample_json_data/all_tickets.json
+and reports objects/sec, next to the rate of the original constructor, which
+checked every key against five model classes. Run from the repository root:
+
+    $ python benchmarks/bench_models.py
+"""
+
+import os.path
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from freshdesk.mockserver import read_fixture
+from dateutil.parser import parse as dateutil_parse
+
+from freshdesk.models import Solution, SolutionCategory, SolutionFolder, Ticket, Topic, parse_timestamp
+
+
+class LegacyTicket(object):
+    """A ticket built the way FreshdeskModel.__init__ used to: each key is
+    checked with hasattr() against five model classes and recorded in a
+    _keys set shared by all instances. Timestamps, which it also parsed up
+    front with dateutil, are left out; they are compared separately."""
+    _keys = set()
+
+    def __init__(self, api, **kwargs):
+        self._api = api
+        for k, v in kwargs.items():
+            if hasattr(Topic, k):
+                k = '_' + k
+            if hasattr(Ticket, k):
+                k = '_' + k
+            if hasattr(SolutionFolder, k):
+                k = '_' + k
+            if hasattr(Solution, k):
+                k = '_' + k
+            if hasattr(SolutionCategory, k):
+                k = '_' + k
+            setattr(self, k, v)
+            self._keys.add(k)
+
+
+def bench_hydration(count=20000, repeat=5):
+    """Return the best objects/sec rates of building count tickets, with
+    Ticket and with LegacyTicket"""
+    payloads = read_fixture('all_tickets.json') * count
+    rates = []
+    for model in (Ticket, LegacyTicket):
+        def hydrate():
+            for payload in payloads:
+                model(None, **payload)
+
+        best = min(timeit.repeat(hydrate, number=1, repeat=repeat))
+        rates.append(len(payloads) / best)
+    return rates
+
+
+def bench_timestamps(count=20000, repeat=5):
+    """Return the parses/sec rate of the ISO-8601 fast path and of dateutil"""
+    timestamps = [t['created_at'] for t in read_fixture('all_tickets.json')] * count
+    rates = []
+    for parse in (parse_timestamp, dateutil_parse):
+        best = min(timeit.repeat(lambda: [parse(t) for t in timestamps], number=1, repeat=repeat))
+        rates.append(len(timestamps) / best)
+    return rates
+
+
+def main():
+    rate, legacy = bench_hydration()
+    print('Ticket hydration: {:,.0f} objects/sec (original constructor: {:,.0f}/sec, {:.1f}x faster)'.format(
+        rate, legacy, rate / legacy))
+    print('Timestamp parsing: {:,.0f}/sec (dateutil: {:,.0f}/sec)'.format(*bench_timestamps()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Transport benchmark against the local stand-in server.
+
+Compares fetching tickets over pooled keep-alive connections with opening a
+new connection for every request, and reports how many bytes compression
+saves. Run from the repository root:
+
+    $ python benchmarks/bench_transport.py
+"""
+
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from freshdesk.api import API
+from freshdesk.mockserver import MockFreshdeskServer
+
+
+def requests_per_second(api, count):
+    start = time.time()
+    for _ in range(count):
+        api.tickets.get_ticket(1)
+    return count / (time.time() - start)
+
+
+def bytes_per_response(api):
+    response = api._send('GET', 'helpdesk/tickets/1.json', stream=True)
+    size = len(response.raw.read(decode_content=False))
+    response.close()
+    return size
+
+
+def main(count=500):
+    with MockFreshdeskServer() as server:
+        pooled = API(server.domain, api_key='bench', use_https=False)
+        reconnecting = API(server.domain, api_key='bench', use_https=False)
+        reconnecting._session.headers['Connection'] = 'close'
+        uncompressed = API(server.domain, api_key='bench', use_https=False, compress=False)
+
+        print('Keep-alive pool:          {:,.0f} requests/sec'.format(requests_per_second(pooled, count)))
+        print('Connection per request:   {:,.0f} requests/sec'.format(requests_per_second(reconnecting, count)))
+        print('Compressed response:      {:,} bytes'.format(bytes_per_response(pooled)))
+        print('Uncompressed response:    {:,} bytes'.format(bytes_per_response(uncompressed)))
+
+
+if __name__ == '__main__':
+    main()
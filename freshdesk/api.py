@@ -1,8 +1,25 @@
-﻿import json
+﻿import os
+import copy
+import os.path
+import threading
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed as futures_completed
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
 from requests.exceptions import HTTPError
 
+from freshdesk.attachments import CHUNK_SIZE, AttachmentStore, MultipartBody, form_fields, safe_filename, write_chunks
+from freshdesk.bulk import BulkAPI, ItemResult
+from freshdesk.codec import get_codec
+from freshdesk.metrics import RequestEvent, endpoint_template, rate_limit_headers
 from freshdesk.models import *
+from freshdesk.ratelimit import RequestScheduler
+from freshdesk.singleflight import SingleFlight
+from freshdesk.streaming import JSONArrayParser
+
+def _partial(**fields):
+    """Returns the fields of a partial update that were actually given"""
+    return dict((k, v) for k, v in fields.items() if v is not None)
 
 class SolutionAPI(object):
     """Provides an interface to solutions on a Freshdesk instance"""
@@ -21,10 +38,24 @@ class SolutionAPI(object):
         url = 'solution/categories/%d.json' % category_id
         return SolutionCategory(self._api, **self._api._get(url)['category'])
 
-    def list_categories(self):
-        """Return a list of all solution categories"""
+    def category_ref(self, category_id):
+        """Return a lazy SolutionCategory that is only fetched when needed.
+        See TicketAPI.ref()."""
+        return SolutionCategory.lazy(self._api, lambda: self.get_category(category_id), id=category_id)
+
+    def get_categories(self, category_ids, max_workers=8, as_completed=False):
+        """Fetch many categories concurrently. See TicketAPI.get_tickets()."""
+        return self._api._fan_out(self.get_category, category_ids, max_workers, as_completed)
+
+    def list_categories(self, deep=False, max_workers=8):
+        """Return a list of all solution categories.
+        Categories are built from the listing itself; pass deep=True to re-fetch
+        each one, using up to max_workers concurrent requests."""
         url = 'solution/categories.json'
-        return [self.get_category(c['category']['id']) for c in self._api._get(url)]
+        categories = [c['category'] for c in self._api._get(url)]
+        if deep:
+            return self._api._map(self.get_category, [c['id'] for c in categories], max_workers)
+        return [SolutionCategory(self._api, **c) for c in categories]
 
     # Folders
 
@@ -44,27 +75,67 @@ class SolutionAPI(object):
         url = "solution/categories/%d/folders/%d.json" % (category_id, folder_id)
         return SolutionFolder(self._api, **self._api._get(url)['folder'])
 
+    def folder_ref(self, category_id, folder_id):
+        """Return a lazy SolutionFolder that is only fetched when needed.
+        See TicketAPI.ref()."""
+        return SolutionFolder.lazy(self._api, lambda: self.get_folder(category_id, folder_id),
+                                   id=folder_id, category_id=category_id)
+
+    def get_folders(self, category_id, folder_ids, max_workers=8, as_completed=False):
+        """Fetch many folders of a category concurrently. See TicketAPI.get_tickets()."""
+        return self._api._fan_out(lambda folder_id: self.get_folder(category_id, folder_id), folder_ids, max_workers, as_completed)
+
     def update_folder(self, category_id, folder_id, name=None, visibility=None, description=None):
-        """Updates a folder
+        """Updates a folder, sending only the fields that are given.
+        To skip fields that have not changed, use SolutionFolder.update() instead.
         :param int visibility: 1: All, 2: Logged in users, 3: Agents only, 4: Company Specific Users
         :param str description: The new folder description
         """
-        folder = self.get_folder(category_id, folder_id)
         url = 'solution/categories/%d/folders/%d.json' % (category_id, folder_id)
-        data = self._api._create_post("solution_folder", name=name or folder.name, visibility=visibility or folder._visibility, description=description or folder.description)
+        data = self._api._create_post("solution_folder", **_partial(name=name, visibility=visibility, description=description))
         return self._api._put(url, data)['folder']
 
-    def list_folders(self, category_id):
-        """Return a list of all solution folders for a given category_id"""
+    def list_folders(self, category_id, deep=False, max_workers=8):
+        """Return a list of all solution folders for a given category_id.
+        Folders are built from the category payload; pass deep=True to re-fetch
+        each one (with its articles), using up to max_workers concurrent requests."""
         url = 'solution/categories/%d.json' % category_id
-        return [self.get_folder(category_id, f['id']) for f in self._api._get(url)['category']['folders']]
+        folders = self._api._get(url)['category']['folders']
+        if deep:
+            return self._api._map(lambda f: self.get_folder(category_id, f['id']), folders, max_workers)
+        return [SolutionFolder(self._api, **dict(f, category_id=category_id)) for f in folders]
+
+    def walk(self, max_workers=8):
+        """Walk the whole knowledge base, yielding a (category, folder, articles)
+        tuple for every folder.
+
+        Uses one request for the category list, one per category whose folders
+        were not embedded in the list, and one per folder whose articles were
+        not embedded; folders are fetched concurrently."""
+        for category in self.list_categories():
+            if not hasattr(category, '_folders'):
+                category = self.get_category(category.id)
+
+            def load(folder, category_id=category.id):
+                if hasattr(folder, '_articles'):
+                    return folder
+                return self.get_folder(category_id, folder.id)
+
+            for folder in self._api._map(load, category.folders, max_workers):
+                yield category, folder, folder.articles
 
     # Articles
 
     def get_article(self, category_id, folder_id, solution_id):
         """Return a solution article for the given ids"""
         url = 'solution/categories/%d/folders/%d/articles/%d.json' % (category_id, folder_id, solution_id)
-        return Solution(self._api, **self._api._get(url)['article'])
+        return Solution(self._api, **dict(self._api._get(url)['article'], category_id=category_id))
+
+    def article_ref(self, category_id, folder_id, solution_id):
+        """Return a lazy Solution that is only fetched when needed.
+        See TicketAPI.ref()."""
+        return Solution.lazy(self._api, lambda: self.get_article(category_id, folder_id, solution_id),
+                             id=solution_id, folder_id=folder_id, category_id=category_id)
 
     def delete_article(self, category_id, folder_id, solution_id):
         """Delete a solution article for the given ids"""
@@ -81,10 +152,10 @@ class SolutionAPI(object):
         return self._api._post(url, data=data)['article']
 
     def update_article(self, category_id, folder_id, solution_id, title=None, description=None, tags=None):
-        """Update a solution article"""
-        article = self.get_article(category_id, folder_id, solution_id)
-        url = '/solution/categories/%d/folders/%d/articles/%d.json' % (category_id, folder_id, solution_id)
-        data = self._api._create_post("solution_article", title=title or article.title, description=description or article.description, tags=tags or article.tags)
+        """Update a solution article, sending only the fields that are given.
+        To skip fields that have not changed, use Solution.update() instead."""
+        url = 'solution/categories/%d/folders/%d/articles/%d.json' % (category_id, folder_id, solution_id)
+        data = self._api._create_post("solution_article", **_partial(title=title, description=description, tags=tags))
         return self._api._put(url, data=data)
 
 class TopicAPI(object):
@@ -97,6 +168,14 @@ class TopicAPI(object):
         url = 'discussions/topics/%d.json' % topic_id
         return Topic(self._api, **self._api._get(url)['topic'])
 
+    def ref(self, topic_id):
+        """Return a lazy Topic that is only fetched when needed. See TicketAPI.ref()."""
+        return Topic.lazy(self._api, lambda: self.get_topic(topic_id), id=topic_id)
+
+    def get_topics(self, topic_ids, max_workers=8, as_completed=False):
+        """Fetch many topics concurrently. See TicketAPI.get_tickets()."""
+        return self._api._fan_out(self.get_topic, topic_ids, max_workers, as_completed)
+
     def delete_topic(self, topic_id):
         """Deletes a topic with the given topic_id, returns JSON response"""
         url = 'discussions/topics/%d.json' % topic_id
@@ -118,7 +197,95 @@ class TicketAPI(object):
         url = 'helpdesk/tickets/%d.json' % ticket_id
         return Ticket(self._api, **self._api._get(url)['helpdesk_ticket'])
 
-    def list_tickets(self, **kwargs):
+    def ref(self, ticket_id):
+        """Return a lazy Ticket, which only has its display_id until any other
+        attribute is read, when it is fetched with get_ticket(). Use it where
+        only the id is needed, e.g. to pass a ticket around or update it.
+        API.resolve() fetches many references concurrently."""
+        return Ticket.lazy(self._api, lambda: self.get_ticket(ticket_id), display_id=ticket_id)
+
+    def get_tickets(self, ticket_ids, max_workers=8, as_completed=False):
+        """Fetch many tickets concurrently, using up to max_workers threads.
+        Returns an ItemResult(key=ticket_id, result, error) per id, so that one
+        failed fetch does not hide the others. Results are returned as a list
+        in input order, or with as_completed=True yielded as they arrive."""
+        return self._api._fan_out(self.get_ticket, ticket_ids, max_workers, as_completed)
+
+    def create_ticket(self, subject, description, email=None, requester_id=None, priority=1, status=2,
+                      attachments=None, **kwargs):
+        """Creates a ticket and returns it as a Ticket instance
+        :param int priority: 1: Low, 2: Medium, 3: High, 4: Urgent
+        :param int status:   2: Open, 3: Pending, 4: Resolved, 5: Closed
+        :param list attachments: files to attach, as paths, seekable binary file
+                                 objects, bytes or (filename, file[, content_type])
+                                 tuples. They are streamed, not read into memory.
+        Any other ticket fields (e.g. cc_email, custom_field) may be given as keyword arguments."""
+        url = 'helpdesk/tickets.json'
+        kwargs.update(_partial(email=email, requester_id=requester_id))
+        if attachments:
+            kwargs.update(subject=subject, description=description, priority=priority, status=status)
+            j = self._api._post_multipart(url, 'helpdesk_ticket', kwargs, attachments)
+        else:
+            data = self._api._create_post("helpdesk_ticket", subject=subject, description=description, priority=priority, status=status, **kwargs)
+            j = self._api._post(url, data=data)
+        return Ticket(self._api, **j['helpdesk_ticket'])
+
+    def add_note(self, ticket_id, body, private=False, attachments=None, **kwargs):
+        """Adds a note to a ticket and returns it as a Comment instance.
+        attachments are given as for create_ticket()."""
+        url = 'helpdesk/tickets/%d/conversations/note.json' % ticket_id
+        kwargs.update(body=body, private=private)
+        if attachments:
+            j = self._api._post_multipart(url, 'helpdesk_note', kwargs, attachments)
+        else:
+            j = self._api._post(url, data=self._api._create_post('helpdesk_note', **kwargs))
+        return Comment(self._api, ticket=self.ref(ticket_id), **j['note'])
+
+    def iter_attachment(self, attachment, chunk_size=CHUNK_SIZE):
+        """Yield the contents of an attachment (an Attachment or its id) in
+        chunks as they are received"""
+        attachment_id = getattr(attachment, 'id', attachment)
+        return self._api._iter_download('helpdesk/attachments/%d' % attachment_id, chunk_size)
+
+    def download_attachment(self, attachment, dest, chunk_size=CHUNK_SIZE):
+        """Stream an attachment (an Attachment or its id) to dest, a path or
+        a binary file object, and return the number of bytes written"""
+        return write_chunks(self.iter_attachment(attachment, chunk_size), dest)
+
+    def download_attachments(self, attachments, directory, max_workers=8, dedup=False):
+        """Download many attachments concurrently into directory, using up to
+        max_workers requests over the shared session. Returns an ItemResult per
+        distinct attachment, keyed by id, whose value is the path written.
+
+        Files are saved as '<id>_<file name>'. With dedup=True they are kept in
+        an AttachmentStore instead: files with identical contents are stored
+        once, and attachments stored by an earlier call are not downloaded again."""
+        attachments = dict((a.id, a) for a in attachments)
+        store = AttachmentStore(directory) if dedup else None
+        if store is None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        def download(attachment_id):
+            attachment = attachments[attachment_id]
+            if store is not None:
+                return store.path(attachment_id) or store.put(
+                    attachment_id, self.iter_attachment(attachment), attachment.content_file_name)
+            path = os.path.join(directory, '%d_%s' % (attachment_id, safe_filename(attachment.content_file_name)))
+            self.download_attachment(attachment, path)
+            return path
+
+        try:
+            return self._api._fan_out(download, attachments, max_workers)
+        finally:
+            if store is not None:
+                store.close()
+
+    def update_ticket(self, ticket_id, **kwargs):
+        """Updates the given fields of a ticket, returns JSON response"""
+        url = 'helpdesk/tickets/%d.json' % ticket_id
+        return self._api._put(url, data=self._api._create_post("helpdesk_ticket", **kwargs))
+
+    def list_tickets(self, hydrate=False, max_workers=8, compact=False, **kwargs):
         """List all tickets, optionally filtered by a view. Specify filters as
         keyword arguments, such as:
 
@@ -126,26 +293,73 @@ class TicketAPI(object):
             (defaults to 'all_tickets')
 
         Multiple filters are AND'd together.
-        """
 
-        filter_name = 'all_tickets'
-        if 'filter_name' in kwargs:
-            filter_name = kwargs['filter_name']
-            del kwargs['filter_name']
+        Tickets are built straight from the filter page payloads, so listing
+        costs one request per page. Summary tickets do not carry notes; pass
+        hydrate=True to re-fetch every ticket in full, using up to max_workers
+        concurrent requests.
 
+        With compact=True, summary tickets are built as __slots__-backed
+        Ticket.compact() instances, which use far less memory for bulk exports.
+        """
+        return list(self.iter_tickets(hydrate=hydrate, max_workers=max_workers, compact=compact, **kwargs))
+
+    def iter_tickets(self, filter_name='all_tickets', hydrate=False, max_workers=8, compact=False, stream=False,
+                     **kwargs):
+        """Like list_tickets(), but yields tickets page by page instead of
+        building the whole list. The next page is fetched in the background
+        while the current one is being consumed.
+
+        With stream=True, each page is parsed incrementally as it is received
+        and its tickets are yielded one by one, so no more than one ticket's
+        JSON is held in memory at a time. Streamed pages are fetched one after
+        the other and bypass the cache. Can't be combined with hydrate."""
+        if stream:
+            if hydrate:
+                raise ValueError('stream=True cannot be combined with hydrate=True')
+            for ticket in self._stream_tickets(filter_name, compact, **kwargs):
+                yield ticket
+            return
+        for page in self.iter_ticket_pages(filter_name, hydrate, max_workers, compact, **kwargs):
+            for ticket in page:
+                yield ticket
+
+    def _stream_tickets(self, filter_name, compact, **kwargs):
         url = 'helpdesk/tickets/filter/%s?format=json' % filter_name
+        model = None if compact else Ticket
         page = 1
-        tickets = []
-
-        # Skip pagination by looping over each page and adding tickets
         while True:
-            this_page = self._api._get(url + '&page=%d' % page, kwargs)
-            if len(this_page) == 0:
+            count = 0
+            for t in self._api._get_stream(url + '&page=%d' % page, kwargs):
+                if model is None:
+                    model = Ticket.compact(t)
+                count += 1
+                yield model(self._api, **t)
+            if count == 0:
                 break
-            tickets += this_page
             page += 1
 
-        return [self.get_ticket(t['display_id']) for t in tickets]
+    def iter_ticket_pages(self, filter_name='all_tickets', hydrate=False, max_workers=8, compact=False, **kwargs):
+        """Like iter_tickets(), but yields each page as a list of tickets"""
+        url = 'helpdesk/tickets/filter/%s?format=json' % filter_name
+
+        def fetch(page):
+            return self._api._get(url + '&page=%d' % page, kwargs)
+
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            page = 1
+            pending = prefetcher.submit(fetch, page)
+            while True:
+                this_page = pending.result()
+                if len(this_page) == 0:
+                    break
+                page += 1
+                pending = prefetcher.submit(fetch, page)
+                if hydrate:
+                    yield self._api._map(self.get_ticket, [t['display_id'] for t in this_page], max_workers)
+                else:
+                    model = Ticket.compact(this_page[0]) if compact else Ticket
+                    yield [model(self._api, **t) for t in this_page]
 
     def list_all_tickets(self):
         """List all tickets, closed or open."""
@@ -168,75 +382,359 @@ class ContactAPI(object):
         url = 'contacts/%s.json' % contact_id
         return Contact(self._api, **self._api._get(url)['user'])
 
-    def create_contact(self, name, email):
+    def ref(self, contact_id):
+        """Return a lazy Contact that is only fetched when needed. See TicketAPI.ref()."""
+        return Contact.lazy(self._api, lambda: self.get_contact(contact_id), id=contact_id)
+
+    def get_contacts(self, contact_ids, max_workers=8, as_completed=False):
+        """Fetch many contacts concurrently. See TicketAPI.get_tickets()."""
+        return self._api._fan_out(self.get_contact, contact_ids, max_workers, as_completed)
+
+    def create_contact(self, name, email, **kwargs):
+        """Creates a contact and returns it as a Contact instance. Other contact
+        fields (e.g. phone, job_title) may be given as keyword arguments."""
         url = 'contacts.json'
-        return Contact(self._api._post(self._api._create_post("user", name=name, email=email))['user'])
+        data = self._api._create_post("user", name=name, email=email, **kwargs)
+        return Contact(self._api, **self._api._post(url, data=data)['user'])
 
 class API(object):
-    def __init__(self, domain, user=None, password=None, api_key=None):
+    def __init__(self, domain, user=None, password=None, api_key=None, rate_limit=None, max_retries=5, backoff_factor=0.5,
+                 cache=None, use_https=True, timeout=(5, 60), pool_connections=DEFAULT_POOLSIZE,
+                 pool_maxsize=DEFAULT_POOLSIZE, compress=True, json_codec=None,
+                 coalesce=True, adapter=None, scheduler=None):
         """Creates a wrapper to perform API actions.
         :param str domain:    the Freshdesk domain (not custom). e.g. company.freshdesk.com
         :param str user:      the username
         :param str password:  password for the username
         :param str api_key:   the API key - NOTE: username and password are ignored if specified
+        :param int rate_limit:       the account's hourly request limit; requests are
+                                     spaced out so it is never exceeded. None disables
+                                     client-side throttling.
+        :param int max_retries:      how often to retry a throttled (429, Retry-After)
+                                     or failed (5xx) request before raising; POSTs are
+                                     not retried after a 5xx, which may have created
+                                     something already
+        :param float backoff_factor: base delay in seconds for exponential backoff
+        :param ResponseCache cache:  caches GET responses (see freshdesk.cache);
+                                     writes through this API invalidate it
+        :param bool use_https:       talk to the helpdesk over HTTPS (the default), avoiding
+                                     a redirect from plain HTTP on every new connection
+        :param timeout:              seconds to wait for the server, as a single number or a
+                                     (connect, read) tuple. None waits forever.
+        :param int pool_connections: the number of hosts to keep connection pools for
+        :param int pool_maxsize:     the number of keep-alive connections per host; grown
+                                     automatically to match max_workers of batch calls
+        :param bool compress:        ask for gzip/deflate compressed responses
+        :param json_codec:           the JSON library to use, by name ('orjson', 'ujson',
+                                     'json') or as a codec object; defaults to the fastest
+                                     one installed (see freshdesk.codec)
+        :param bool coalesce:        let concurrent identical GETs share a single request
+                                     and its response; counted in .coalesce_stats
+        :param HTTPAdapter adapter:  send requests through this adapter, and its connection
+                                     pools, instead of one of the API's own; it is shared,
+                                     so it is never replaced to grow the pool (see APIPool)
+        :param RequestScheduler scheduler: throttle and retry requests with this scheduler
+                                     instead of one built from rate_limit, max_retries and
+                                     backoff_factor
+
+        Time spent throttled is counted in .throttle_stats. Hooks can be
+        registered with add_hook() to observe every request (see freshdesk.metrics).
 
         Instances:
           .tickets:   the Ticket API
           .contacts:  the Contacts API
           .topics:    the Topics API
           .solutions: the Solutions API
+          .bulk:      bulk create/update operations
         """
 
-        self._api_prefix = 'http://{}/'.format(domain.rstrip('/'))
+        self._api_prefix = '{}://{}/'.format('https' if use_https else 'http', domain.rstrip('/'))
         self._session = requests.Session()
         if api_key:
             self._session.auth = (api_key, 'unused_with_api_key')
         else:
             self._session.auth = (user, password)
-        self._session.headers = {'Content-Type': 'application/json'}
+        self._session.headers.update({
+            'Content-Type': 'application/json',
+            'Accept-Encoding': 'gzip, deflate' if compress else 'identity',
+            'Connection': 'keep-alive',
+        })
+        self._timeout = timeout
+        self._scheduler = scheduler or RequestScheduler(rate_limit, max_retries, backoff_factor)
+        self._cache = cache
+        self._codec = get_codec(json_codec)
+        self._hooks = ()
+        self._single_flight = SingleFlight() if coalesce else None
+        # Counts successful writes, so GETs sent after one never share a request sent before it
+        self._writes = 0
+        self._pool_connections = pool_connections
+        self._pool_maxsize = 0
+        self._pool_lock = threading.Lock()
+        self._shared_adapter = adapter is not None
+        if self._shared_adapter:
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+        else:
+            self._ensure_pool(pool_maxsize)
 
         self.tickets = TicketAPI(self)
         self.contacts = ContactAPI(self)
         self.topics = TopicAPI(self)
         self.solutions = SolutionAPI(self)
+        self.bulk = BulkAPI(self)
+
+    @property
+    def throttle_stats(self):
+        """Counters of retries and time spent waiting on rate limits"""
+        return self._scheduler.stats
+
+    @property
+    def coalesce_stats(self):
+        """Counters of GETs sent and of those answered by a concurrent identical GET.
+        Both stay at zero when coalescing is disabled."""
+        if self._single_flight is None:
+            return SingleFlight()
+        return self._single_flight
+
+    def add_hook(self, hook):
+        """Call hook(event) with a freshdesk.metrics.RequestEvent after every
+        request. Hooks run in the thread that sent the request."""
+        self._hooks += (hook,)
+
+    def remove_hook(self, hook):
+        self._hooks = tuple(h for h in self._hooks if h != hook)
+
+    def resolve(self, refs, max_workers=8):
+        """Fetch every lazy reference (see TicketAPI.ref()) that has not been
+        fetched yet, using up to max_workers concurrent requests. Returns the
+        references as a list."""
+        refs = list(refs)
+        self._map(lambda ref: ref.load(), [ref for ref in refs if not ref._loaded], max_workers)
+        return refs
 
     def _create_post(self, post_type="", **kwargs):
         """Internal: Create a post body
         :param str post_type: The type of post to create e.g. 'topic'"""
-        return json.dumps({post_type: kwargs})
+        return self._codec.dumps({post_type: kwargs})
+
+    def _ensure_pool(self, size):
+        """Internal: Grow the session's connection pool to hold at least size
+        connections, so that worker threads don't discard each other's."""
+        if size <= self._pool_maxsize or self._shared_adapter:
+            return
+        with self._pool_lock:
+            if size > self._pool_maxsize:
+                adapter = HTTPAdapter(pool_connections=self._pool_connections, pool_maxsize=size)
+                self._session.mount('http://', adapter)
+                self._session.mount('https://', adapter)
+                self._pool_maxsize = size
+
+    def _map(self, func, items, max_workers=8):
+        """Internal: Call func on each item using a bounded thread pool.
+        Results are returned in input order; the first exception is re-raised."""
+        items = list(items)
+        if max_workers <= 1 or len(items) <= 1:
+            return [func(i) for i in items]
+        self._ensure_pool(max_workers)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+            return list(pool.map(func, items))
+
+    def _fan_out(self, func, keys, max_workers=8, as_completed=False):
+        """Internal: Call func(key) for each key using a bounded thread pool,
+        returning an ItemResult for each. See TicketAPI.get_tickets()."""
+        keys = list(keys)
+        self._ensure_pool(max_workers)
+
+        def call(key):
+            try:
+                return ItemResult(key, func(key), None)
+            except Exception as e:
+                return ItemResult(key, None, e)
+
+        if as_completed:
+            return self._fan_out_completed(call, keys, max_workers)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(keys)))) as pool:
+            return list(pool.map(call, keys))
+
+    def _fan_out_completed(self, call, keys, max_workers):
+        """Internal: Generator half of _fan_out(as_completed=True)"""
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(keys)))) as pool:
+            for future in futures_completed([pool.submit(call, key) for key in keys]):
+                yield future.result()
 
     def _handle_response(self, response):
-        """Internal: Handle any errors
-        
-        #TODO: Needs improvement"""
-        response.raise_for_status()
+        """Internal: Handle any errors and decode the JSON body. An empty body
+        decodes to {}; a malformed one raises HTTPError."""
+        self._check_status(response)
+        j = self._decode(response.content, response)
+        self._check_login(j, response)
+        return j
+
+    def _check_status(self, response):
+        """Internal: Raise HTTPError for throttled and failed responses"""
         if 'Retry-After' in response.headers:
-            raise HTTPError('403 Forbidden: API rate-limit has been reached until {}.' \
-                    'See http://freshdesk.com/api#ratelimit'.format(r.headers['Retry-After']))
+            raise HTTPError('{} API rate-limit has been reached, retry after {}. ' \
+                    'See http://freshdesk.com/api#ratelimit'.format(response.status_code, response.headers['Retry-After']),
+                    response=response)
+        response.raise_for_status()
+
+    def _check_login(self, j, response):
+        """Internal: Freshdesk answers requests with a bad API key with a login prompt"""
+        if isinstance(j, dict) and 'require_login' in j:
+            raise HTTPError('403 Forbidden: API key is incorrect for this domain', response=response)
+
+    def _decode(self, body, response=None):
+        """Internal: Decode a JSON response body with the API's codec"""
+        if not body.strip():
+            return {}
+        try:
+            return self._codec.loads(body)
+        except ValueError as e:
+            raise HTTPError('Malformed JSON in response from {}: {}'.format(
+                response.url if response is not None else 'cache', e), response=response)
+
+    def _send(self, method, url, rewind=None, **kwargs):
+        """Internal: Send a request through the rate-limit scheduler. Returns the raw response.
+        rewind, if given, is called before every attempt to reset a streamed request body."""
+        kwargs.setdefault('timeout', self._timeout)
+
+        def send_request():
+            if rewind is not None:
+                rewind()
+            return self._session.request(method, self._api_prefix + url, **kwargs)
+
+        if not self._hooks:
+            return self._scheduler.send(send_request, method)
+        return self._send_observed(method, url, send_request, kwargs)
+
+    def _send_observed(self, method, url, send, kwargs):
+        """Internal: _send(), reporting a RequestEvent to every hook"""
+        attempts = []
+
+        def send_request():
+            attempts.append(None)
+            return send()
+
+        start = time.perf_counter()
         try:
-            j = response.json()
-            if 'require_login' in j:
-                raise HTTPError('403 Forbidden: API key is incorrect for this domain')
-        except:
-            j = "{}"
+            response = self._scheduler.send(send_request, method)
+        except Exception as e:
+            self._notify(RequestEvent(method, endpoint_template(url), url, None, time.perf_counter() - start,
+                                      0, max(0, len(attempts) - 1), {}, e))
+            raise
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit():
+            size = int(length)
+        else:
+            # Don't read a streamed body here; its size is unknown
+            size = 0 if kwargs.get('stream') else len(response.content)
+        self._notify(RequestEvent(method, endpoint_template(url), url, response.status_code,
+                                  time.perf_counter() - start, size, len(attempts) - 1,
+                                  rate_limit_headers(response.headers), None))
+        return response
+
+    def _notify(self, event):
+        for hook in self._hooks:
+            hook(event)
+
+    def _request(self, method, url, **kwargs):
+        """Internal: Send a request and handle the response. Returns a JSON response.
+        Successful writes invalidate any cached copies of the resource."""
+        j = self._handle_response(self._send(method, url, **kwargs))
+        if method != 'GET':
+            self._writes += 1
+            if self._cache is not None:
+                self._cache.invalidate(url, descendants=method != 'POST')
         return j
 
     def _get(self, url, params={}):
-        """Internal: Wrapper around request.get() to use the API prefix. Returns a JSON response."""
-        response = self._handle_response(self._session.get(self._api_prefix + url, params=params))
-        return response
+        """Internal: Wrapper around request.get() to use the API prefix. Returns a JSON response.
+        Concurrent calls with the same url and params share one request; each gets its own copy
+        of the decoded response. A call never shares a request sent before a write that completed
+        before the call was made."""
+        if self._single_flight is None:
+            return self._fetch(url, params)
+        key = ('GET', url, repr(sorted(params.items())), self._writes)
+        return self._single_flight.do(key, lambda: self._fetch(url, params), copy.deepcopy)
+
+    def _fetch(self, url, params):
+        """Internal: GET url through the cache, if any"""
+        if self._cache is None:
+            return self._request('GET', url, params=params)
+
+        key = self._cache.key(url, params)
+        # Writes made while the request is in flight keep its response out of the cache
+        generation = self._cache.generation
+        entry, fresh = self._cache.lookup(key)
+        if fresh:
+            return self._decode(entry.body)
+        headers = entry.validators() if entry is not None else {}
+        response = self._send('GET', url, params=params, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            self._cache.refresh(key, url, entry, generation)
+            return self._decode(entry.body)
+        j = self._handle_response(response)
+        self._cache.store(key, url, response, generation)
+        return j
+
+    def _get_stream(self, url, params={}, chunk_size=65536):
+        """Internal: GET a JSON array and yield its items as they are
+        received and parsed, without holding the whole body in memory.
+        Streamed requests bypass the cache and request coalescing."""
+        response = self._send('GET', url, params=params, stream=True)
+        try:
+            self._check_status(response)
+            parser = JSONArrayParser(self._codec.loads)
+            chunks = response.iter_content(chunk_size)
+            head = []
+            try:
+                for chunk in chunks:
+                    if not parser.started:
+                        head.append(chunk)
+                    for item in parser.feed(chunk):
+                        yield item
+                parser.close()
+            except ValueError as e:
+                if parser.started:
+                    raise HTTPError('Malformed JSON in response from {}: {}'.format(response.url, e),
+                                    response=response)
+                # Not an array, e.g. an empty body or a login prompt; decode it as a whole
+                j = self._decode(b''.join(head) + b''.join(chunks), response)
+                self._check_login(j, response)
+                if j:
+                    raise HTTPError('Expected a JSON array from {}'.format(response.url), response=response)
+        finally:
+            response.close()
+
+    def _post_multipart(self, url, post_type, fields, files):
+        """Internal: POST fields and files as a streamed multipart/form-data
+        body, the files under post_type[attachments][][resource]. Returns a JSON response."""
+        body = MultipartBody(form_fields(post_type, fields), files, post_type + '[attachments][][resource]')
+        try:
+            return self._request('POST', url, data=body, headers={'Content-Type': body.content_type},
+                                 rewind=body.rewind)
+        finally:
+            body.close()
+
+    def _iter_download(self, url, chunk_size=CHUNK_SIZE):
+        """Internal: GET url and yield its body in chunks as they are received.
+        Redirects to file storage are followed without the API credentials."""
+        response = self._send('GET', url, stream=True)
+        try:
+            self._check_status(response)
+            for chunk in response.iter_content(chunk_size):
+                yield chunk
+        finally:
+            response.close()
 
     def _put(self, url, data={}):
         """Internal: Wrapper around request.put() to use the API prefix. Returns a JSON response"""
-        response = self._handle_response(self._session.put(self._api_prefix + url, data=data))
-        return response
+        return self._request('PUT', url, data=data)
 
     def _post(self, url, data={}):
         """Internal: Wrapper around request.post() to use the API prefix. Returns a JSON response"""
-        response = self._handle_response(self._session.post(self._api_prefix + url, data=data))
-        return response
+        return self._request('POST', url, data=data)
 
     def _delete(self, url):
-        """Internal: Wrapper around request.delete() to use the API prefic. Returns a JSON response"""
-        response = self._handle_response(self._session.delete(self._api_prefix + url))
-        return response
+        """Internal: Wrapper around request.delete() to use the API prefix. Returns a JSON response"""
+        return self._request('DELETE', url)
@@ -0,0 +1,344 @@
+"""
+An asyncio flavour of freshdesk.api, built on aiohttp.
+
+The sub-APIs mirror their blocking counterparts method for method, but every
+call is a coroutine. Models are the same classes as in freshdesk.models; any
+model method that talks to the API (e.g. Topic.update) returns an awaitable.
+
+>>> async with AsyncAPI('company.freshdesk.com', api_key='...') as a:
+...     ticket = await a.tickets.get_ticket(4)
+"""
+
+import asyncio
+import base64
+import os.path
+
+import aiohttp
+from requests.exceptions import HTTPError
+
+from freshdesk.api import _partial
+from freshdesk.attachments import CHUNK_SIZE
+from freshdesk.codec import get_codec
+from freshdesk.models import *
+
+
+class AsyncSolutionAPI(object):
+    """Provides an asynchronous interface to solutions on a Freshdesk instance"""
+    def __init__(self, api):
+        self._api = api
+
+    # Categories
+
+    async def create_category(self, name, description):
+        """Create and return a solution category"""
+        url = 'solution/categories.json'
+        data = self._api._create_post("solution_category", name=name, description=description)
+        return await self._api._post(url, data=data)
+
+    async def get_category(self, category_id):
+        """Return a solution category for a given id"""
+        url = 'solution/categories/%d.json' % category_id
+        return SolutionCategory(self._api, **(await self._api._get(url))['category'])
+
+    async def list_categories(self, deep=False):
+        """Return a list of all solution categories, built from the listing
+        unless deep=True"""
+        url = 'solution/categories.json'
+        categories = [c['category'] for c in await self._api._get(url)]
+        if deep:
+            return await asyncio.gather(*[self.get_category(c['id']) for c in categories])
+        return [SolutionCategory(self._api, **c) for c in categories]
+
+    # Folders
+
+    async def create_folder(self, category_id, name, visibility, description, customer_folder_attributes=[]):
+        """Create and return a solution folder for a given category id"""
+        url = 'solution/categories/%d/folders.json' % category_id
+        data = self._api._create_post("solution_folder", category_id=category_id, name=name, visibility=visibility, description=description, customer_folder_attributes=customer_folder_attributes)
+        return SolutionFolder(self._api, **(await self._api._post(url, data))['folder'])
+
+    async def get_folder(self, category_id, folder_id):
+        """Returns a solution folder for a given category_id and folder_id"""
+        url = 'solution/categories/%d/folders/%d.json' % (category_id, folder_id)
+        return SolutionFolder(self._api, **(await self._api._get(url))['folder'])
+
+    async def update_folder(self, category_id, folder_id, name=None, visibility=None, description=None):
+        """Updates a folder, sending only the fields that are given"""
+        url = 'solution/categories/%d/folders/%d.json' % (category_id, folder_id)
+        data = self._api._create_post("solution_folder", **_partial(name=name, visibility=visibility, description=description))
+        return (await self._api._put(url, data))['folder']
+
+    async def list_folders(self, category_id, deep=False):
+        """Return a list of all solution folders for a given category_id, built
+        from the category payload unless deep=True"""
+        url = 'solution/categories/%d.json' % category_id
+        folders = (await self._api._get(url))['category']['folders']
+        if deep:
+            return await asyncio.gather(*[self.get_folder(category_id, f['id']) for f in folders])
+        return [SolutionFolder(self._api, **dict(f, category_id=category_id)) for f in folders]
+
+    # Articles
+
+    async def get_article(self, category_id, folder_id, solution_id):
+        """Return a solution article for the given ids"""
+        url = 'solution/categories/%d/folders/%d/articles/%d.json' % (category_id, folder_id, solution_id)
+        return Solution(self._api, **dict((await self._api._get(url))['article'], category_id=category_id))
+
+    async def delete_article(self, category_id, folder_id, solution_id):
+        """Delete a solution article for the given ids"""
+        url = 'solution/categories/%d/folders/%d/articles/%d.json' % (category_id, folder_id, solution_id)
+        return await self._api._delete(url)
+
+    async def create_article(self, category_id, folder_id, title, status, art_type, description, tags=[]):
+        """Creates a solution article in the given category and folder"""
+        url = 'solution/categories/%d/folders/%d/articles.json' % (category_id, folder_id)
+        data = self._api._create_post("solution_article", folder_id=folder_id, title=title, status=status, art_type=art_type, description=description)
+        return (await self._api._post(url, data=data))['article']
+
+    async def update_article(self, category_id, folder_id, solution_id, title=None, description=None, tags=None):
+        """Update a solution article, sending only the fields that are given"""
+        url = 'solution/categories/%d/folders/%d/articles/%d.json' % (category_id, folder_id, solution_id)
+        data = self._api._create_post("solution_article", **_partial(title=title, description=description, tags=tags))
+        return await self._api._put(url, data=data)
+
+
+class AsyncTopicAPI(object):
+    """Provides an asynchronous interface to topics on a Freshdesk instance"""
+    def __init__(self, api):
+        self._api = api
+
+    async def get_topic(self, topic_id):
+        """Returns a Topic instance for the given topic_id"""
+        url = 'discussions/topics/%d.json' % topic_id
+        return Topic(self._api, **(await self._api._get(url))['topic'])
+
+    async def delete_topic(self, topic_id):
+        """Deletes a topic with the given topic_id, returns JSON response"""
+        url = 'discussions/topics/%d.json' % topic_id
+        return await self._api._delete(url)
+
+    async def create_topic(self, forum_id, title, body_html, sticky=False, locked=False):
+        """Create a new topic and return the JSON response"""
+        url = 'discussions/topics.json'
+        data = self._api._create_post("topic", forum_id=forum_id, title=title, locked=locked, body_html=body_html)
+        return (await self._api._post(url, data=data))['topic']
+
+
+class AsyncTicketAPI(object):
+    """Provides an asynchronous interface to tickets on a Freshdesk instance"""
+    def __init__(self, api):
+        self._api = api
+
+    async def get_ticket(self, ticket_id):
+        """Fetches the ticket for the given ticket ID"""
+        url = 'helpdesk/tickets/%d.json' % ticket_id
+        return Ticket(self._api, **(await self._api._get(url))['helpdesk_ticket'])
+
+    async def list_tickets(self, hydrate=False, **kwargs):
+        """List all tickets, optionally filtered by a view. See
+        TicketAPI.list_tickets() for the supported filters. Hydration is
+        bounded by the API's max_concurrency."""
+        return [t async for t in self.iter_tickets(hydrate=hydrate, **kwargs)]
+
+    async def iter_tickets(self, filter_name='all_tickets', hydrate=False, **kwargs):
+        """Asynchronously yield tickets page by page, fetching the next page
+        while the current one is being consumed."""
+        url = 'helpdesk/tickets/filter/%s?format=json' % filter_name
+        page = 1
+        pending = asyncio.ensure_future(self._api._get(url + '&page=%d' % page, kwargs))
+        try:
+            while True:
+                this_page = await pending
+                if len(this_page) == 0:
+                    break
+                page += 1
+                pending = asyncio.ensure_future(self._api._get(url + '&page=%d' % page, kwargs))
+                if hydrate:
+                    for ticket in await asyncio.gather(*[self.get_ticket(t['display_id']) for t in this_page]):
+                        yield ticket
+                else:
+                    for t in this_page:
+                        yield Ticket(self._api, **t)
+        finally:
+            pending.cancel()
+
+    async def list_all_tickets(self):
+        """List all tickets, closed or open."""
+        return await self.list_tickets(filter_name='all_tickets')
+
+    async def list_open_tickets(self):
+        """List all new and open tickets."""
+        return await self.list_tickets(filter_name='new_my_open')
+
+    async def list_deleted_tickets(self):
+        """Lists all deleted tickets."""
+        return await self.list_tickets(filter_name='deleted')
+
+    async def iter_attachment(self, attachment, chunk_size=CHUNK_SIZE):
+        """Asynchronously yield the contents of an attachment (an Attachment
+        or its id) in chunks as they are received"""
+        attachment_id = getattr(attachment, 'id', attachment)
+        async for chunk in self._api._iter_download('helpdesk/attachments/%d' % attachment_id, chunk_size):
+            yield chunk
+
+    async def download_attachment(self, attachment, dest, chunk_size=CHUNK_SIZE):
+        """Stream an attachment (an Attachment or its id) to dest, a path or
+        a binary file object, and return the number of bytes written"""
+        if isinstance(dest, str):
+            try:
+                with open(dest, 'wb') as f:
+                    return await self.download_attachment(attachment, f, chunk_size)
+            except BaseException:
+                # Don't leave a partial file behind
+                if os.path.exists(dest):
+                    os.remove(dest)
+                raise
+        written = 0
+        async for chunk in self.iter_attachment(attachment, chunk_size):
+            dest.write(chunk)
+            written += len(chunk)
+        return written
+
+
+class AsyncContactAPI(object):
+    def __init__(self, api):
+        self._api = api
+
+    async def get_contact(self, contact_id):
+        """Get a contact's details by id"""
+        url = 'contacts/%s.json' % contact_id
+        return Contact(self._api, **(await self._api._get(url))['user'])
+
+    async def create_contact(self, name, email):
+        url = 'contacts.json'
+        return Contact(self._api, **(await self._api._post(url, self._api._create_post("user", name=name, email=email)))['user'])
+
+
+class AsyncAPI(object):
+    # Tells models to return awaitables from methods that talk to the API
+    _is_async = True
+
+    def __init__(self, domain, user=None, password=None, api_key=None, max_concurrency=10, use_https=True,
+                 timeout=(5, 60), json_codec=None):
+        """Creates an asyncio wrapper to perform API actions.
+        :param str domain:          the Freshdesk domain (not custom). e.g. company.freshdesk.com
+        :param str user:            the username
+        :param str password:        password for the username
+        :param str api_key:         the API key - NOTE: username and password are ignored if specified
+        :param int max_concurrency: the maximum number of requests in flight at once; this
+                                    also sizes the connection pool
+        :param bool use_https:      talk to the helpdesk over HTTPS (the default)
+        :param timeout:             seconds to wait for the server, as a single number or a
+                                    (connect, read) tuple. None waits forever.
+        :param json_codec:          the JSON library to use (see freshdesk.codec)
+
+        Use as an async context manager, or call close() when done.
+
+        Instances:
+          .tickets:   the Ticket API
+          .contacts:  the Contacts API
+          .topics:    the Topics API
+          .solutions: the Solutions API
+        """
+
+        self._api_prefix = '{}://{}/'.format('https' if use_https else 'http', domain.rstrip('/'))
+        if api_key:
+            credentials = '{}:unused_with_api_key'.format(api_key)
+        else:
+            credentials = '{}:{}'.format(user or '', password or '')
+        self._headers = {
+            'Content-Type': 'application/json',
+            'Authorization': 'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii'),
+        }
+        self._max_concurrency = max_concurrency
+        self._codec = get_codec(json_codec)
+        if isinstance(timeout, tuple):
+            self._timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        else:
+            self._timeout = aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+        self._session = None
+        self._semaphore = None
+
+        self.tickets = AsyncTicketAPI(self)
+        self.contacts = AsyncContactAPI(self)
+        self.topics = AsyncTopicAPI(self)
+        self.solutions = AsyncSolutionAPI(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Close the underlying connection pool"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        """Internal: The session must be created inside a running event loop,
+        so it is created on first use."""
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._max_concurrency)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self._headers, timeout=self._timeout)
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._session
+
+    def _create_post(self, post_type="", **kwargs):
+        """Internal: Create a post body
+        :param str post_type: The type of post to create e.g. 'topic'"""
+        return self._codec.dumps({post_type: kwargs})
+
+    async def _handle_response(self, response):
+        """Internal: Handle any errors. Raises the same HTTPError as the
+        blocking API so callers can share error handling."""
+        if response.status >= 400:
+            raise HTTPError('{} {} for url: {}'.format(response.status, response.reason, response.url))
+        if 'Retry-After' in response.headers:
+            raise HTTPError('403 Forbidden: API rate-limit has been reached until {}.' \
+                    'See http://freshdesk.com/api#ratelimit'.format(response.headers['Retry-After']))
+        body = await response.read()
+        if not body.strip():
+            return {}
+        try:
+            j = self._codec.loads(body)
+        except ValueError as e:
+            raise HTTPError('Malformed JSON in response from {}: {}'.format(response.url, e))
+        if isinstance(j, dict) and 'require_login' in j:
+            raise HTTPError('403 Forbidden: API key is incorrect for this domain')
+        return j
+
+    async def _request(self, method, url, **kwargs):
+        """Internal: Perform a request through the pooled session, bounded by max_concurrency"""
+        session = self._get_session()
+        async with self._semaphore:
+            async with session.request(method, self._api_prefix + url, **kwargs) as response:
+                return await self._handle_response(response)
+
+    async def _iter_download(self, url, chunk_size=CHUNK_SIZE):
+        """Internal: GET url and yield its body in chunks as they are received.
+        Redirects to file storage are followed without the API credentials."""
+        session = self._get_session()
+        async with self._semaphore:
+            async with session.get(self._api_prefix + url) as response:
+                if response.status >= 400:
+                    raise HTTPError('{} {} for url: {}'.format(response.status, response.reason, response.url))
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    yield chunk
+
+    async def _get(self, url, params={}):
+        """Internal: Asynchronous request.get() using the API prefix. Returns a JSON response."""
+        return await self._request('GET', url, params=params)
+
+    async def _put(self, url, data={}):
+        """Internal: Asynchronous request.put() using the API prefix. Returns a JSON response."""
+        return await self._request('PUT', url, data=data)
+
+    async def _post(self, url, data={}):
+        """Internal: Asynchronous request.post() using the API prefix. Returns a JSON response."""
+        return await self._request('POST', url, data=data)
+
+    async def _delete(self, url):
+        """Internal: Asynchronous request.delete() using the API prefix. Returns a JSON response."""
+        return await self._request('DELETE', url)
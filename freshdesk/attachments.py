@@ -0,0 +1,263 @@
+"""
+Attachment transfers.
+
+Downloads are streamed to a path or file object chunk by chunk, so files of
+any size are never held in memory. Many attachments can be downloaded in
+parallel with TicketAPI.download_attachments(); with dedup=True they are kept
+in an AttachmentStore, which stores identical files once and never downloads
+the same attachment twice.
+
+Uploads are sent as a multipart/form-data MultipartBody, which reads the
+files while the request is being sent rather than building the whole body
+first.
+
+>>> ticket = a.tickets.create_ticket('Logs', 'See attached', email='a@example.com',
+...                                  attachments=['/var/log/app.log'])
+>>> ticket.attachments[0].download('/tmp/app.log')
+"""
+
+import hashlib
+import mimetypes
+import os
+import os.path
+import sqlite3
+import tempfile
+import threading
+import uuid
+
+CHUNK_SIZE = 65536
+
+
+def form_fields(prefix, fields):
+    """Flatten fields into (name, value) pairs in Rails' nested form style,
+    e.g. ('helpdesk_ticket', {'custom_field': {'a': 1}}) ->
+    [('helpdesk_ticket[custom_field][a]', '1')]. None values are left out."""
+    pairs = []
+    if isinstance(fields, dict):
+        for key, value in fields.items():
+            pairs.extend(form_fields('{}[{}]'.format(prefix, key), value))
+    elif isinstance(fields, (list, tuple)):
+        for value in fields:
+            pairs.extend(form_fields(prefix + '[]', value))
+    elif isinstance(fields, bool):
+        pairs.append((prefix, 'true' if fields else 'false'))
+    elif fields is not None:
+        pairs.append((prefix, u'{}'.format(fields)))
+    return pairs
+
+
+def safe_filename(name, default='attachment'):
+    """A file name from the API, reduced to its last path component"""
+    name = os.path.basename((name or '').replace('\\', '/')).strip()
+    return name if name not in ('', '.', '..') else default
+
+
+class _File(object):
+    """A file to upload: where it starts, how long it is, and whether this
+    module opened it (and so has to close it)"""
+    def __init__(self, source):
+        filename = content_type = None
+        if isinstance(source, tuple):
+            filename, source, content_type = (source + (None,))[:3]
+        self.owned = isinstance(source, str)
+        if self.owned:
+            self.fileobj = open(source, 'rb')
+            filename = filename or source
+        elif isinstance(source, bytes):
+            self.fileobj = _BytesReader(source)
+        else:
+            self.fileobj = source
+            filename = filename or getattr(source, 'name', None)
+            if not isinstance(filename, str):
+                filename = None
+        self.filename = safe_filename(filename)
+        self.content_type = (content_type or mimetypes.guess_type(self.filename)[0] or
+                             'application/octet-stream')
+        self.start = self.fileobj.tell()
+        self.fileobj.seek(0, os.SEEK_END)
+        self.size = self.fileobj.tell() - self.start
+        self.fileobj.seek(self.start)
+
+
+class _BytesReader(object):
+    """The minimal seekable file interface over bytes, without copying them"""
+    def __init__(self, data):
+        self._data = memoryview(data)
+        self._pos = 0
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        self._pos = len(self._data) + pos if whence == os.SEEK_END else pos
+
+    def read(self, size=-1):
+        end = len(self._data) if size < 0 else self._pos + size
+        data = self._data[self._pos:end].tobytes()
+        self._pos += len(data)
+        return data
+
+
+class MultipartBody(object):
+    """A multipart/form-data request body that streams its files.
+
+    Its length is known up front, so it is sent with a Content-Length rather
+    than chunked. Files are given as paths, seekable binary file objects,
+    bytes, or (filename, file[, content_type]) tuples, and are attached
+    under file_field. rewind() resets the body so a request can be retried.
+
+    :param list fields: (name, value) pairs, see form_fields()
+    """
+    def __init__(self, fields, files, file_field):
+        self.boundary = uuid.uuid4().hex
+        self._files = []
+        self._parts = []
+        try:
+            for name, value in fields:
+                self._parts.append(self._header(name) + value.encode('utf-8') + b'\r\n')
+            for source in files:
+                f = _File(source)
+                self._files.append(f)
+                self._parts.append(self._header(file_field, f.filename, f.content_type))
+                self._parts.append(f)
+                self._parts.append(b'\r\n')
+        except Exception:
+            self.close()
+            raise
+        self._parts.append('--{}--\r\n'.format(self.boundary).encode('ascii'))
+        self._length = sum(part.size if isinstance(part, _File) else len(part) for part in self._parts)
+        self.rewind()
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary={}'.format(self.boundary)
+
+    def _header(self, name, filename=None, content_type=None):
+        disposition = u'form-data; name="{}"'.format(name.replace('"', '%22'))
+        lines = [u'--{}'.format(self.boundary)]
+        if filename is None:
+            lines.append(u'Content-Disposition: {}'.format(disposition))
+        else:
+            lines.append(u'Content-Disposition: {}; filename="{}"'.format(disposition, filename.replace('"', '%22')))
+            lines.append(u'Content-Type: {}'.format(content_type))
+        return (u'\r\n'.join(lines) + u'\r\n\r\n').encode('utf-8')
+
+    def __len__(self):
+        return self._length
+
+    def rewind(self):
+        """Start reading the body from the beginning again"""
+        for f in self._files:
+            f.fileobj.seek(f.start)
+        self._index = 0
+        self._offset = 0
+
+    def read(self, size=-1):
+        """Read up to size bytes (everything that is left if size < 0)"""
+        chunks = []
+        while self._index < len(self._parts) and size != 0:
+            part = self._parts[self._index]
+            if isinstance(part, _File):
+                left = part.size - self._offset
+                data = part.fileobj.read(left if size < 0 else min(size, left))
+                if not data and left:
+                    raise IOError('{} was truncated while being uploaded'.format(part.filename))
+            else:
+                end = len(part) if size < 0 else self._offset + size
+                data = part[self._offset:end]
+            chunks.append(data)
+            self._offset += len(data)
+            if size > 0:
+                size -= len(data)
+            if self._offset >= (part.size if isinstance(part, _File) else len(part)):
+                self._index += 1
+                self._offset = 0
+        return b''.join(chunks)
+
+    def close(self):
+        """Close the files that were given as paths"""
+        for f in self._files:
+            if f.owned:
+                f.fileobj.close()
+
+
+def write_chunks(chunks, dest):
+    """Write an iterable of bytes to dest, a path or a binary file object.
+    Returns the number of bytes written."""
+    if isinstance(dest, str):
+        try:
+            with open(dest, 'wb') as f:
+                return write_chunks(chunks, f)
+        except BaseException:
+            # Don't leave a partial file behind
+            if os.path.exists(dest):
+                os.remove(dest)
+            raise
+    written = 0
+    for chunk in chunks:
+        dest.write(chunk)
+        written += len(chunk)
+    return written
+
+
+class AttachmentStore(object):
+    """A content-addressed directory of downloaded attachments.
+
+    Each distinct file is kept once, named after its SHA-256 digest, however
+    many attachments share it. An index in the directory maps attachment ids
+    to their digests, so attachments that have been stored before are not
+    downloaded again, even by a later run. Safe to share between threads."""
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, 'index.sqlite3'), check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS attachments ('
+                             'id INTEGER PRIMARY KEY, digest TEXT, filename TEXT, size INTEGER)')
+
+    def path_for(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def path(self, attachment_id):
+        """The path of a stored attachment, or None if it hasn't been stored"""
+        with self._lock:
+            row = self._db.execute('SELECT digest FROM attachments WHERE id = ?', (attachment_id,)).fetchone()
+        return self.path_for(row[0]) if row is not None else None
+
+    def __contains__(self, attachment_id):
+        return self.path(attachment_id) is not None
+
+    def put(self, attachment_id, chunks, filename=None):
+        """Store the contents of an attachment, given as an iterable of bytes,
+        and return its path. Contents already in the store are not kept twice."""
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    sha256.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            digest = sha256.hexdigest()
+            path = self.path_for(digest)
+            with self._lock:
+                if os.path.exists(path):
+                    os.remove(tmp_path)
+                else:
+                    if not os.path.isdir(os.path.dirname(path)):
+                        os.makedirs(os.path.dirname(path))
+                    os.replace(tmp_path, path)
+                with self._db:
+                    self._db.execute('INSERT OR REPLACE INTO attachments VALUES (?, ?, ?, ?)',
+                                     (attachment_id, digest, filename, size))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,144 @@
+"""
+Bulk writes for large imports and migrations.
+
+Operations run through a bounded pool of worker threads sharing the API's
+session, so they also share its rate limiting. One item failing does not
+abort the batch: every item gets an ItemResult holding either its result or
+the exception it raised. A Checkpoint records completed items so an
+interrupted job can be re-run and pick up where it left off.
+
+>>> results = a.bulk.create_contacts(({'name': n, 'email': e} for n, e in rows),
+...                                  max_workers=8, checkpoint=Checkpoint('contacts.ckpt'))
+>>> len(results.succeeded), [(r.key, r.error) for r in results.failed]
+"""
+
+import json
+import os.path
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class ItemResult(namedtuple('ItemResult', 'key result error')):
+    """The outcome of one item of a batch. key identifies the item (its
+    position in the input for bulk writes); error is None on success."""
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class BulkResult(object):
+    """The outcome of a bulk operation, as ItemResults in input order.
+    Items skipped because a checkpoint recorded them as done are counted in
+    .skipped but have no ItemResult."""
+    def __init__(self, results, skipped=0):
+        self.results = sorted(results, key=lambda r: r.key)
+        self.skipped = skipped
+
+    @property
+    def succeeded(self):
+        return [r for r in self.results if r.ok]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.ok]
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        return '<BulkResult {} succeeded, {} failed, {} skipped>'.format(
+            len(self.succeeded), len(self.failed), self.skipped)
+
+
+class Checkpoint(object):
+    """Remembers which items of a bulk job succeeded, in an append-only file.
+    Re-running the job with the same input and checkpoint skips them."""
+    def __init__(self, path):
+        self.path = path
+        self._done = set()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self._done.update(json.loads(line) for line in f if line.strip())
+        self._file = open(path, 'a')
+
+    def __contains__(self, key):
+        return key in self._done
+
+    def record(self, key):
+        self._done.add(key)
+        self._file.write(json.dumps(key) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class BulkAPI(object):
+    """Provides bulk create/update operations on a Freshdesk instance"""
+    def __init__(self, api):
+        self._api = api
+
+    def run(self, func, items, max_workers=8, checkpoint=None):
+        """Call func(item) for every item of an iterable, with at most
+        max_workers calls in flight, and return a BulkResult.
+
+        Items are consumed lazily, so arbitrarily large iterables can be used.
+        :param Checkpoint checkpoint: skip items recorded as done and record
+                                      those that succeed"""
+        self._api._ensure_pool(max_workers)
+        results = []
+        skipped = 0
+
+        def collect(futures):
+            for future in futures:
+                key = pending.pop(future)
+                error = future.exception()
+                results.append(ItemResult(key, None if error else future.result(), error))
+                if error is None and checkpoint is not None:
+                    checkpoint.record(key)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = {}
+            for key, item in enumerate(items):
+                if checkpoint is not None and key in checkpoint:
+                    skipped += 1
+                    continue
+                pending[pool.submit(func, item)] = key
+                if len(pending) >= max_workers * 2:
+                    collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            collect(list(pending))
+        return BulkResult(results, skipped)
+
+    # Each item is a dict of keyword arguments for the corresponding single-item call
+
+    def create_contacts(self, contacts, **kwargs):
+        """Create contacts from dicts of ContactAPI.create_contact() arguments"""
+        return self.run(lambda c: self._api.contacts.create_contact(**c), contacts, **kwargs)
+
+    def create_tickets(self, tickets, **kwargs):
+        """Create tickets from dicts of TicketAPI.create_ticket() arguments"""
+        return self.run(lambda t: self._api.tickets.create_ticket(**t), tickets, **kwargs)
+
+    def update_tickets(self, tickets, **kwargs):
+        """Update tickets from dicts of TicketAPI.update_ticket() arguments"""
+        return self.run(lambda t: self._api.tickets.update_ticket(**t), tickets, **kwargs)
+
+    def create_topics(self, topics, **kwargs):
+        """Create topics from dicts of TopicAPI.create_topic() arguments"""
+        return self.run(lambda t: self._api.topics.create_topic(**t), topics, **kwargs)
+
+    def create_folders(self, folders, **kwargs):
+        """Create solution folders from dicts of SolutionAPI.create_folder() arguments"""
+        return self.run(lambda f: self._api.solutions.create_folder(**f), folders, **kwargs)
+
+    def create_articles(self, articles, **kwargs):
+        """Create solution articles from dicts of SolutionAPI.create_article() arguments"""
+        return self.run(lambda a: self._api.solutions.create_article(**a), articles, **kwargs)
+
+    def update_articles(self, articles, **kwargs):
+        """Update solution articles from dicts of SolutionAPI.update_article() arguments"""
+        return self.run(lambda a: self._api.solutions.update_article(**a), articles, **kwargs)
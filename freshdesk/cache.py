@@ -0,0 +1,323 @@
+"""
+Response caching for API._get.
+
+A ResponseCache stores decoded-on-demand response bodies in a pluggable
+backend, with per-endpoint TTLs. Once an entry expires it is revalidated with
+If-None-Match/If-Modified-Since, so unchanged resources cost a 304 rather than
+a full body. Writes made through the same API invalidate the affected entries.
+
+>>> cache = ResponseCache(MemoryCache(maxsize=500), ttl=60,
+...                       ttls={'solution/*': 3600, 'helpdesk/tickets/filter/*': 0})
+>>> a = API('company.freshdesk.com', api_key='...', cache=cache)
+"""
+
+import fnmatch
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from urllib.parse import urlencode
+
+
+class CacheEntry(namedtuple('CacheEntry', 'body etag last_modified expires')):
+    """A cached response body (as text) along with its validators"""
+
+    def validators(self):
+        """Request headers to revalidate this entry with"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class MemoryCache(object):
+    """An in-process, thread-safe LRU cache holding at most maxsize entries.
+
+    Keys are also indexed by the resource path of their URL, so that
+    delete_paths() only visits the entries it drops."""
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._index = {}    # (kind, path) -> keys, see _tags()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _tags(key):
+        """The index entries of a key: ('=', its path), ('/', its path and
+        each of its ancestors), and ('*', each ancestor the key is listed
+        under, i.e. whose next segment is not an id)"""
+        path = _resource_path(key)
+        segments = path.split('/')
+        tags = [('=', path)]
+        for i in range(1, len(segments) + 1):
+            prefix = '/'.join(segments[:i])
+            tags.append(('/', prefix))
+            if i < len(segments) and not _is_id(segments[i]):
+                tags.append(('*', prefix))
+        return tags
+
+    def _add(self, key, entry):
+        if key not in self._entries:
+            for tag in self._tags(key):
+                self._index.setdefault(tag, set()).add(key)
+        else:
+            del self._entries[key]
+        self._entries[key] = entry
+
+    def _remove(self, key):
+        if self._entries.pop(key, None) is not None:
+            for tag in self._tags(key):
+                keys = self._index[tag]
+                keys.discard(key)
+                if not keys:
+                    del self._index[tag]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._add(key, entry)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def delete_paths(self, exact, subtrees, listings):
+        """Drop the entries whose resource path is in exact, is or is below
+        one of subtrees, or is listed under one of listings (see
+        ResponseCache.invalidate())"""
+        tags = [('=', p) for p in exact] + [('/', p) for p in subtrees] + [('*', p) for p in listings]
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys.update(self._index.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache(object):
+    """An on-disk LRU cache, so that entries survive between processes.
+    Safe to share between threads; use one file per process."""
+    def __init__(self, path, maxsize=10000):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            columns = [row[1] for row in self._db.execute('PRAGMA table_info(responses)')]
+            if columns and 'path' not in columns:
+                # Written by a version without the path index; it is only a cache
+                self._db.execute('DROP TABLE responses')
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                             'key TEXT PRIMARY KEY, body TEXT, etag TEXT, last_modified TEXT, '
+                             'expires REAL, accessed INTEGER, path TEXT)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_path ON responses (path)')
+        self._counter = self._db.execute('SELECT COALESCE(MAX(accessed), 0) FROM responses').fetchone()[0]
+
+    def _tick(self):
+        self._counter += 1
+        return self._counter
+
+    def get(self, key):
+        with self._lock, self._db:
+            row = self._db.execute('SELECT body, etag, last_modified, expires FROM responses WHERE key = ?',
+                                   (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (self._tick(), key))
+            return CacheEntry(*row)
+
+    def set(self, key, entry):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (key, entry.body, entry.etag, entry.last_modified, entry.expires, self._tick(),
+                              _resource_path(key)))
+            self._db.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses '
+                             'ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.maxsize,))
+
+    def delete(self, key):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+
+    def delete_paths(self, exact, subtrees, listings):
+        """Drop the entries whose resource path is in exact, is or is below
+        one of subtrees, or is listed under one of listings (see
+        ResponseCache.invalidate()), in one statement over the path index"""
+        clauses = []
+        args = []
+        if exact:
+            clauses.append('path IN ({})'.format(', '.join('?' * len(exact))))
+            args.extend(exact)
+        for path in subtrees:
+            # '0' sorts right after '/', so this is every path starting with path + '/'
+            clauses.append('path = ? OR (path >= ? AND path < ?)')
+            args.extend([path, path + '/', path + '0'])
+        for path in listings:
+            # The same, leaving out the paths whose next segment starts with a digit (':' sorts after '9')
+            clauses.append('(path >= ? AND path < ?) OR (path >= ? AND path < ?)')
+            args.extend([path + '/', path + '/0', path + '/:', path + '0'])
+        if not clauses:
+            return
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM responses WHERE ' + ' OR '.join(clauses), args)
+
+    def keys(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT key FROM responses')]
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM responses')
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+def _resource_path(url):
+    """'/solution/categories/3.json?page=2' -> 'solution/categories/3'"""
+    path = url.split('?', 1)[0].strip('/')
+    if path.endswith('.json'):
+        path = path[:-len('.json')]
+    return path
+
+
+def _is_id(segment):
+    """Whether a path segment names a member of a collection, e.g. '42'"""
+    return segment[:1].isdigit()
+
+
+def _invalidated_paths(url, descendants):
+    """What a write to url invalidates, as (exact, subtrees, listings): the
+    resource paths to drop, the paths to drop along with everything below
+    them, and the collections whose listings to drop"""
+    path = _resource_path(url)
+    segments = path.split('/')
+    exact = ['/'.join(segments[:i]) for i in range(1, len(segments) + 1)]
+    # The paths before each id, and url itself when it is a collection (POST)
+    listings = ['/'.join(segments[:i]) for i in range(1, len(segments)) if _is_id(segments[i])]
+    listings.append(path)
+    return exact, [path] if descendants else [], listings
+
+
+def _is_invalidated(other, exact, subtrees, listings):
+    """Whether the resource path other is dropped by _invalidated_paths()"""
+    if other in exact or any(other == p or other.startswith(p + '/') for p in subtrees):
+        return True
+    return any(other.startswith(p + '/') and not _is_id(other[len(p) + 1:]) for p in listings)
+
+
+class ResponseCache(object):
+    """Caches GET responses for an API.
+
+    :param backend:    a MemoryCache, SQLiteCache or anything with the same
+                       get/set/delete/keys methods (defaults to a MemoryCache).
+                       Backends without delete_paths() are scanned on every write.
+    :param float ttl:  seconds a response is served without revalidation
+    :param dict ttls:  per-endpoint TTLs, as {glob pattern: seconds}. The first
+                       pattern matching the URL wins; a TTL of 0 disables caching
+                       for that endpoint.
+    """
+    def __init__(self, backend=None, ttl=300, ttls=None, clock=time.time):
+        self.backend = backend if backend is not None else MemoryCache()
+        self.ttl = ttl
+        self.ttls = list((ttls or {}).items())
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        # Bumped by every invalidation; see store()
+        self.generation = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def ttl_for(self, url):
+        for pattern, ttl in self.ttls:
+            if fnmatch.fnmatch(url, pattern):
+                return ttl
+        return self.ttl
+
+    def key(self, url, params=None):
+        url = url.lstrip('/')
+        if params:
+            url += ('&' if '?' in url else '?') + urlencode(sorted(params.items()))
+        return url
+
+    def lookup(self, key):
+        """Return (entry, fresh) for a cache key. entry is None on a miss."""
+        entry = self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, False
+        fresh = entry.expires > self._clock()
+        if fresh:
+            self.hits += 1
+        return entry, fresh
+
+    def store(self, key, url, response, generation=None):
+        """Cache a successful response, unless its endpoint is not cacheable.
+        generation is the value of .generation when the request was sent: if
+        a write has invalidated entries since, the response may predate it,
+        and is not stored."""
+        ttl = self.ttl_for(url)
+        if ttl <= 0 or 'no-store' in response.headers.get('Cache-Control', ''):
+            return
+        entry = CacheEntry(response.text, response.headers.get('ETag'),
+                           response.headers.get('Last-Modified'), self._clock() + ttl)
+        with self._lock:
+            if generation is None or generation == self.generation:
+                self.backend.set(key, entry)
+
+    def refresh(self, key, url, entry, generation=None):
+        """The server confirmed entry is unchanged (304): extend its lifetime.
+        As with store(), nothing is kept if a write happened since generation."""
+        self.revalidated += 1
+        with self._lock:
+            if generation is None or generation == self.generation:
+                self.backend.set(key, entry._replace(expires=self._clock() + self.ttl_for(url)))
+
+    def invalidate(self, url, descendants=True):
+        """Drop every entry for the resource at url and its parents, e.g. a
+        change to a folder also invalidates its category and the category list.
+        With descendants=True, entries nested below url are dropped too.
+
+        Listings of the collections the resource belongs to are dropped as
+        well, including views such as helpdesk/tickets/filter/all_tickets,
+        since the write may add to or change what they list. Other members of
+        those collections (e.g. helpdesk/tickets/7) are kept."""
+        paths = _invalidated_paths(url, descendants)
+        with self._lock:
+            self.generation += 1
+            delete_paths = getattr(self.backend, 'delete_paths', None)
+            if delete_paths is not None:
+                delete_paths(*paths)
+                return
+            for key in self.backend.keys():
+                if _is_invalidated(_resource_path(key), *paths):
+                    self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
@@ -0,0 +1,310 @@
+"""
+Streaming export of tickets and their comments.
+
+export_tickets() pages through a ticket filter oldest first, fetches every
+ticket in full (summaries carry no notes) on a pool of worker threads, and
+hands them to a writer strictly in display_id order, holding only a bounded
+window of tickets in memory. Each page is checked to continue that order
+before any of its tickets is written, since checkpoints rely on it. Writers are provided for NDJSON, CSV and, when
+pyarrow is installed, Parquet.
+
+The NDJSON and CSV writers checkpoint the last display_id written next to
+their output. Opened with resume=True, they drop anything written after the
+checkpoint and the export picks up where it stopped; resuming a finished
+export appends the tickets created since.
+
+>>> with NDJSONWriter('tickets.ndjson', resume=True) as writer:
+...     export_tickets(a, writer, max_workers=8)
+
+From the command line:
+
+    $ python -m freshdesk.export company.freshdesk.com tickets.csv --api-key ... --resume
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import os.path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from freshdesk.api import API
+from freshdesk.codec import get_codec
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+TICKET_COLUMNS = ('display_id', 'id', 'subject', 'status', 'priority', 'source', 'ticket_type', 'requester_id',
+                  'responder_id', 'group_id', 'created_at', 'updated_at', 'due_by', 'description')
+COMMENT_COLUMNS = ('ticket_display_id', 'id', 'user_id', 'private', 'incoming', 'source', 'created_at',
+                   'updated_at', 'body')
+
+
+def ticket_row(payload):
+    """The TICKET_COLUMNS of a ticket payload, as a list"""
+    return [payload.get(column) for column in TICKET_COLUMNS]
+
+
+def comment_rows(payload):
+    """The COMMENT_COLUMNS of each note of a ticket payload, as lists"""
+    for note in payload.get('notes') or []:
+        note = note.get('note', note)
+        yield [payload['display_id']] + [note.get(column) for column in COMMENT_COLUMNS[1:]]
+
+
+class ExportWriter(object):
+    """Base class for export writers. Subclasses implement write(payload),
+    which receives each ticket as its JSON payload, and may override commit()
+    and close()."""
+    last_display_id = None
+
+    def write(self, payload):
+        raise NotImplementedError
+
+    def commit(self, display_id):
+        """Called periodically with the display_id of the last ticket written"""
+        self.last_display_id = display_id
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _CheckpointedWriter(ExportWriter):
+    """Writes to binary files whose lengths are recorded on every commit, in
+    a JSON checkpoint next to the first file"""
+    def __init__(self, paths, resume=False):
+        self.checkpoint_path = paths[0] + '.checkpoint'
+        state = None
+        if resume and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r') as f:
+                state = json.load(f)
+        self.resumed = state is not None
+        self._files = []
+        for i, path in enumerate(paths):
+            if state is None:
+                f = open(path, 'wb')
+            else:
+                f = open(path, 'r+b')
+                f.truncate(state['offsets'][i])
+                f.seek(0, os.SEEK_END)
+            self._files.append(f)
+        if state is not None:
+            self.last_display_id = state['display_id']
+
+    def _flush(self):
+        for f in self._files:
+            f.flush()
+
+    def commit(self, display_id):
+        self._flush()
+        state = {'display_id': display_id, 'offsets': [f.tell() for f in self._files]}
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.checkpoint_path)
+        self.last_display_id = display_id
+
+    def close(self):
+        for f in self._files:
+            f.close()
+
+
+class NDJSONWriter(_CheckpointedWriter):
+    """Writes one JSON object per line for each ticket, with its comments
+    nested under 'notes' as in the API"""
+    def __init__(self, path, resume=False):
+        super(NDJSONWriter, self).__init__([path], resume)
+        self._codec = get_codec()
+
+    def write(self, payload):
+        self._files[0].write(self._codec.dumps(payload) + b'\n')
+
+
+def _comments_path(path):
+    """'tickets.csv' -> 'tickets_comments.csv'"""
+    root, ext = os.path.splitext(path)
+    return root + '_comments' + ext
+
+
+class CSVWriter(_CheckpointedWriter):
+    """Writes the TICKET_COLUMNS of each ticket to path, and the
+    COMMENT_COLUMNS of its comments to comments_path (by default path with
+    '_comments' added to its name)"""
+    def __init__(self, path, comments_path=None, resume=False):
+        super(CSVWriter, self).__init__([path, comments_path or _comments_path(path)], resume)
+        self._text = [io.TextIOWrapper(f, encoding='utf-8', newline='') for f in self._files]
+        self._tickets, self._comments = [csv.writer(f) for f in self._text]
+        if not self.resumed:
+            self._tickets.writerow(TICKET_COLUMNS)
+            self._comments.writerow(COMMENT_COLUMNS)
+
+    def write(self, payload):
+        self._tickets.writerow(ticket_row(payload))
+        self._comments.writerows(comment_rows(payload))
+
+    def _flush(self):
+        for f in self._text:
+            f.flush()
+
+    def close(self):
+        for f in self._text:
+            f.close()
+
+
+_INT, _BOOL = 'int64', 'bool_'
+_TYPES = {'display_id': _INT, 'id': _INT, 'status': _INT, 'priority': _INT, 'source': _INT, 'requester_id': _INT,
+          'responder_id': _INT, 'group_id': _INT, 'ticket_display_id': _INT, 'user_id': _INT,
+          'private': _BOOL, 'incoming': _BOOL}
+
+
+def _schema(columns):
+    return pyarrow.schema([(c, getattr(pyarrow, _TYPES.get(c, 'string'))()) for c in columns])
+
+
+class ParquetWriter(ExportWriter):
+    """Writes the same tables as CSVWriter as Parquet files, in row groups of
+    batch_size rows. Requires pyarrow. A Parquet file can't be appended to,
+    so an interrupted export has to be resumed into new files with after=."""
+    def __init__(self, path, comments_path=None, batch_size=1000):
+        if pyarrow is None:
+            raise ImportError('Parquet export requires the pyarrow package')
+        self.batch_size = batch_size
+        self._tables = []
+        for columns, table_path in ((TICKET_COLUMNS, path), (COMMENT_COLUMNS, comments_path or _comments_path(path))):
+            schema = _schema(columns)
+            self._tables.append((columns, schema, pyarrow.parquet.ParquetWriter(table_path, schema), []))
+
+    def _write_batch(self, columns, schema, writer, rows):
+        if rows:
+            writer.write_table(pyarrow.Table.from_pylist([dict(zip(columns, row)) for row in rows], schema=schema))
+            del rows[:]
+
+    def write(self, payload):
+        for table, rows in zip(self._tables, ([ticket_row(payload)], comment_rows(payload))):
+            table[3].extend(rows)
+            if len(table[3]) >= self.batch_size:
+                self._write_batch(*table)
+
+    def close(self):
+        for table in self._tables:
+            self._write_batch(*table)
+            table[2].close()
+
+
+def _oldest_first(api, filter_name, after):
+    """Yield the summaries of a filter's tickets after display_id after, in
+    increasing display_id order. Raises ValueError, before yielding any ticket
+    of the offending page, if the server doesn't list them that way."""
+    last = None
+    for page in api.tickets.iter_ticket_pages(filter_name, order_by='created_at', order_type='asc'):
+        ids = [t.display_id for t in page]
+        ordered = ids if last is None else [last] + ids
+        if any(a >= b for a, b in zip(ordered, ordered[1:])):
+            raise ValueError('The tickets of {} were not listed oldest first (display_ids {} after {}), so they '
+                             'cannot be exported in order'.format(filter_name, ids, last))
+        for ticket in page:
+            if after is None or ticket.display_id > after:
+                yield ticket
+        last = ids[-1]
+
+
+def _fetch_in_order(api, summaries, max_workers):
+    """Fetch the full ticket for each summary using up to max_workers
+    threads, yielding them in input order with at most 2 * max_workers in
+    flight"""
+    api._ensure_pool(max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        window = deque()
+        for summary in summaries:
+            window.append(pool.submit(api.tickets.get_ticket, summary.display_id))
+            if len(window) >= max_workers * 2:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+
+def export_tickets(api, writer, filter_name='all_tickets', comments=True, after=None, max_workers=8,
+                   checkpoint_every=100):
+    """Write every ticket of a filter to writer, oldest first, and return how
+    many were written.
+
+    :param bool comments:        fetch each ticket in full to include its
+                                 comments; otherwise only summaries are written
+    :param int after:            skip tickets up to this display_id; defaults to
+                                 the writer's checkpoint
+    :param int checkpoint_every: commit the writer after this many tickets
+
+    Raises ValueError if Freshdesk doesn't list the tickets oldest first.
+    """
+    if after is None:
+        after = writer.last_display_id
+    summaries = _oldest_first(api, filter_name, after)
+    tickets = _fetch_in_order(api, summaries, max_workers) if comments else summaries
+    count = 0
+    last = None
+    for ticket in tickets:
+        writer.write(ticket._payload())
+        count += 1
+        last = ticket.display_id
+        if count % checkpoint_every == 0:
+            writer.commit(last)
+    if last is not None:
+        writer.commit(last)
+    return count
+
+
+FORMATS = {'.ndjson': 'ndjson', '.jsonl': 'ndjson', '.csv': 'csv', '.parquet': 'parquet'}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m freshdesk.export',
+                                     description='Export Freshdesk tickets and their comments.')
+    parser.add_argument('domain', help='the Freshdesk domain, e.g. company.freshdesk.com')
+    parser.add_argument('output', help='the file to write tickets to')
+    parser.add_argument('--api-key', default=os.environ.get('FRESHDESK_API_KEY'),
+                        help='defaults to $FRESHDESK_API_KEY')
+    parser.add_argument('--format', choices=sorted(set(FORMATS.values())),
+                        help='defaults to the extension of output')
+    parser.add_argument('--comments-output', help='the file to write comments to (CSV and Parquet)')
+    parser.add_argument('--filter', default='all_tickets', help='the ticket filter to export')
+    parser.add_argument('--no-comments', action='store_true', help='only export ticket summaries')
+    parser.add_argument('--max-workers', type=int, default=8, help='concurrent requests')
+    parser.add_argument('--resume', action='store_true', help='continue from the last checkpoint')
+    parser.add_argument('--after', type=int, help='only export tickets after this display_id')
+    parser.add_argument('--http', action='store_true', help='use plain HTTP instead of HTTPS')
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error('an API key is required, with --api-key or FRESHDESK_API_KEY')
+    output_format = args.format or FORMATS.get(os.path.splitext(args.output)[1])
+    if output_format is None:
+        parser.error('cannot tell the format of {}, use --format'.format(args.output))
+    if output_format == 'ndjson':
+        writer = NDJSONWriter(args.output, resume=args.resume)
+    elif output_format == 'csv':
+        writer = CSVWriter(args.output, args.comments_output, resume=args.resume)
+    else:
+        if args.resume:
+            parser.error('Parquet exports cannot be resumed; use --after with a new output file')
+        writer = ParquetWriter(args.output, args.comments_output)
+
+    api = API(args.domain, api_key=args.api_key, use_https=not args.http)
+    with writer:
+        count = export_tickets(api, writer, args.filter, comments=not args.no_comments, after=args.after,
+                               max_workers=args.max_workers)
+    print('Exported {} tickets to {}'.format(count, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+Request instrumentation.
+
+Hooks registered with API.add_hook() are called with a RequestEvent after
+every request sent to Freshdesk, describing its endpoint, status, latency,
+size, retries and the rate-limit headers of the response. When no hooks are
+registered, requests are sent exactly as before.
+
+Two hooks are provided: HistogramCollector aggregates events in-process and
+can render them for Prometheus, and StatsDHook forwards them to StatsD.
+
+>>> metrics = HistogramCollector()
+>>> a.add_hook(metrics)
+>>> a.tickets.list_open_tickets()
+>>> metrics.summary()
+{('GET', 'helpdesk/tickets/filter/new_my_open'): {'count': 1, 'p50': 0.25, ...}}
+"""
+
+import re
+import socket
+import threading
+from collections import namedtuple
+
+_numeric_segment = re.compile(r'(?<=/)\d+(?=[/.]|$)')
+
+
+def endpoint_template(url):
+    """'/helpdesk/tickets/42.json?page=2' -> 'helpdesk/tickets/%d.json'"""
+    return _numeric_segment.sub('%d', '/' + url.split('?', 1)[0].lstrip('/'))[1:]
+
+
+def rate_limit_headers(headers):
+    """The rate-limit related headers of a response, as a dict"""
+    return dict((k, v) for k, v in headers.items()
+                if k.lower().startswith('x-ratelimit') or k.lower() == 'retry-after')
+
+
+class RequestEvent(namedtuple('RequestEvent', 'method endpoint url status latency size retries rate_limit error')):
+    """One request sent to the API.
+
+    endpoint:   the URL with ids replaced by %d and without the query string
+    status:     the final status code, None if no response was received
+    latency:    wall-clock seconds including retries and throttling waits
+    size:       bytes of the response body as sent (i.e. compressed)
+    retries:    how often the request was retried
+    rate_limit: the X-RateLimit-* and Retry-After headers of the response
+    error:      the exception raised while sending, if any
+    """
+
+    @property
+    def ok(self):
+        return self.error is None and self.status is not None and self.status < 400
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class EndpointStats(object):
+    """Aggregated events of one method and endpoint. Latencies are counted in
+    buckets (the upper bounds in seconds) rather than stored individually."""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.latency_sum = 0.0
+
+    def add(self, event):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if event.latency <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.errors += not event.ok
+        self.retries += event.retries
+        self.bytes += event.size
+        self.latency_sum += event.latency
+
+    def percentile(self, q):
+        """The upper bound of the bucket holding the q-th quantile (0 < q <= 1),
+        or infinity if it falls beyond the largest bucket"""
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'retries': self.retries,
+            'bytes': self.bytes,
+            'mean': self.latency_sum / self.count if self.count else 0.0,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+        }
+
+
+class HistogramCollector(object):
+    """A hook aggregating latency histograms, sizes, retries and errors per
+    (method, endpoint), and remembering the last rate-limit headers seen"""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.endpoints = {}
+        self.rate_limit = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            key = (event.method, event.endpoint)
+            stats = self.endpoints.get(key)
+            if stats is None:
+                stats = self.endpoints[key] = EndpointStats(self.buckets)
+            stats.add(event)
+            if event.rate_limit:
+                self.rate_limit = event.rate_limit
+
+    def summary(self):
+        """Returns {(method, endpoint): {'count', 'errors', 'retries', 'bytes',
+        'mean', 'p50', 'p95', 'p99'}}"""
+        with self._lock:
+            return dict((key, stats.as_dict()) for key, stats in self.endpoints.items())
+
+    def reset(self):
+        with self._lock:
+            self.endpoints.clear()
+            self.rate_limit = {}
+
+    def prometheus(self, prefix='freshdesk'):
+        """Render the collected metrics in the Prometheus text exposition format"""
+        lines = [
+            '# TYPE {}_request_duration_seconds histogram'.format(prefix),
+        ]
+        totals = []
+        with self._lock:
+            for (method, endpoint), stats in sorted(self.endpoints.items()):
+                labels = 'method="{}",endpoint="{}"'.format(method, endpoint)
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), stats.counts):
+                    cumulative += count
+                    lines.append('{}_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(
+                        prefix, labels, bound, cumulative))
+                lines.append('{}_request_duration_seconds_sum{{{}}} {}'.format(prefix, labels, stats.latency_sum))
+                lines.append('{}_request_duration_seconds_count{{{}}} {}'.format(prefix, labels, stats.count))
+                totals.append((labels, stats))
+            for name, attribute in (('errors', 'errors'), ('retries', 'retries'), ('response_bytes', 'bytes')):
+                lines.append('# TYPE {}_request_{}_total counter'.format(prefix, name))
+                for labels, stats in totals:
+                    lines.append('{}_request_{}_total{{{}}} {}'.format(prefix, name, labels, getattr(stats, attribute)))
+            remaining = dict((k.lower(), v) for k, v in self.rate_limit.items()).get('x-ratelimit-remaining')
+        if remaining is not None:
+            lines.append('# TYPE {}_ratelimit_remaining gauge'.format(prefix))
+            lines.append('{}_ratelimit_remaining {}'.format(prefix, remaining))
+        return '\n'.join(lines) + '\n'
+
+
+def _metric_name(endpoint):
+    """'helpdesk/tickets/%d.json' -> 'helpdesk.tickets.id'"""
+    name = endpoint.replace('%d', 'id')
+    if name.endswith('.json'):
+        name = name[:-len('.json')]
+    return re.sub(r'[^A-Za-z0-9_.]', '_', name.replace('/', '.'))
+
+
+class StatsDHook(object):
+    """A hook sending a counter, a timer and the response size of every
+    request to a StatsD server over UDP, e.g.
+
+        freshdesk.GET.helpdesk.tickets.id.requests:1|c
+        freshdesk.GET.helpdesk.tickets.id.latency:182.4|ms
+
+    Sending is fire-and-forget: a StatsD server that is down is ignored."""
+    def __init__(self, host='localhost', port=8125, prefix='freshdesk'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _lines(self, event):
+        name = '{}.{}.{}'.format(self.prefix, event.method, _metric_name(event.endpoint))
+        lines = [
+            '{}.requests:1|c'.format(name),
+            '{}.latency:{:.1f}|ms'.format(name, event.latency * 1000),
+            '{}.bytes:{}|c'.format(name, event.size),
+        ]
+        if event.retries:
+            lines.append('{}.retries:{}|c'.format(name, event.retries))
+        if not event.ok:
+            lines.append('{}.errors:1|c'.format(name))
+        return lines
+
+    def __call__(self, event):
+        try:
+            self._socket.sendto('\n'.join(self._lines(event)).encode('ascii'), self.address)
+        except (OSError, UnicodeError):
+            pass
+
+    def close(self):
+        self._socket.close()
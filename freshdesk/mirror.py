@@ -0,0 +1,155 @@
+"""
+A local mirror of tickets and contacts.
+
+A Mirror keeps tickets (keyed by display_id) and contacts in a SQLite file,
+indexed on the fields dashboards and triage bots filter by. It is filled from
+the API, incrementally with sync(), and answers queries with the usual
+Ticket/Contact models in milliseconds instead of paging through a filter.
+
+>>> mirror = Mirror(a, 'helpdesk.db')
+>>> mirror.sync()
+>>> mirror.tickets(status='open', priority='urgent', requester_id=5004272351)
+[<Ticket 'This is a sample ticket'>]
+"""
+
+import datetime
+import json
+import sqlite3
+import threading
+
+from freshdesk.models import Contact, Ticket, parse_timestamp
+from freshdesk.sync import SyncState, TicketSync
+
+STATUSES = {'open': 2, 'pending': 3, 'resolved': 4, 'closed': 5}
+PRIORITIES = {'low': 1, 'medium': 2, 'high': 3, 'urgent': 4}
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def _sortable(timestamp):
+    """A timestamp as ISO-8601 text in UTC, so that it sorts correctly"""
+    timestamp = parse_timestamp(timestamp)
+    if timestamp is None:
+        return None
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc)
+    return timestamp.isoformat()
+
+
+class Mirror(object):
+    """Tickets and contacts of a Freshdesk instance, stored in the SQLite
+    database at path. Safe to share between threads.
+
+    :param api:  the API to fill the mirror from, and to give the models
+    :param path: the database file; ':memory:' for a throwaway mirror
+    """
+    def __init__(self, api, path):
+        self._api = api
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS tickets ('
+                             'display_id INTEGER PRIMARY KEY, status INTEGER, priority INTEGER, '
+                             'requester_id INTEGER, updated_at TEXT, payload TEXT)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS contacts ('
+                             'id INTEGER PRIMARY KEY, email TEXT, updated_at TEXT, payload TEXT)')
+            for column in ('status', 'priority', 'requester_id', 'updated_at'):
+                self._db.execute('CREATE INDEX IF NOT EXISTS tickets_{0} ON tickets ({0})'.format(column))
+            self._db.execute('CREATE INDEX IF NOT EXISTS contacts_email ON contacts (email)')
+
+    def store_tickets(self, tickets):
+        """Insert or replace tickets, e.g. from TicketAPI.iter_tickets()"""
+        rows = ((t.display_id, getattr(t, '_status', None), getattr(t, '_priority', None),
+                 getattr(t, 'requester_id', None), _sortable(getattr(t, 'updated_at', None)),
+                 json.dumps(t._payload(), default=_encode)) for t in tickets)
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO tickets VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def store_contacts(self, contacts):
+        """Insert or replace contacts"""
+        rows = ((c.id, getattr(c, 'email', None), _sortable(getattr(c, 'updated_at', None)),
+                 json.dumps(c._payload(), default=_encode)) for c in contacts)
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO contacts VALUES (?, ?, ?, ?)', rows)
+
+    def sync(self, state=None, filter_name='all_tickets'):
+        """Store the tickets changed since the last sync, and return how many
+        there were. The high-water mark is kept in a SyncState next to the
+        database unless another one is given."""
+        if state is None:
+            state = SyncState(self.path + '.sync')
+        changed = [change.ticket for change in TicketSync(self._api, state, filter_name).changes()]
+        self.store_tickets(changed)
+        return len(changed)
+
+    def _where(self, **filters):
+        """Build the WHERE clause of a ticket query. Each filter is a single
+        value or a list of accepted values; statuses and priorities may be
+        given by name."""
+        clauses, params = [], []
+        for column, names in (('status', STATUSES), ('priority', PRIORITIES), ('requester_id', {})):
+            values = filters[column]
+            if values is None:
+                continue
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            values = [names.get(v, v) for v in values]
+            clauses.append('{} IN ({})'.format(column, ', '.join('?' * len(values))))
+            params.extend(values)
+        if filters['updated_since'] is not None:
+            clauses.append('updated_at >= ?')
+            params.append(_sortable(filters['updated_since']))
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def tickets(self, status=None, priority=None, requester_id=None, updated_since=None, limit=None):
+        """Returns the matching tickets, most recently updated first"""
+        where, params = self._where(status=status, priority=priority, requester_id=requester_id,
+                                    updated_since=updated_since)
+        query = 'SELECT payload FROM tickets' + where + ' ORDER BY updated_at DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [Ticket(self._api, **json.loads(row[0])) for row in rows]
+
+    def count_tickets(self, status=None, priority=None, requester_id=None, updated_since=None):
+        """Returns the number of tickets matching the same filters as tickets()"""
+        where, params = self._where(status=status, priority=priority, requester_id=requester_id,
+                                    updated_since=updated_since)
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM tickets' + where, params).fetchone()[0]
+
+    def ticket(self, display_id):
+        """Returns a stored ticket, or raises KeyError"""
+        with self._lock:
+            row = self._db.execute('SELECT payload FROM tickets WHERE display_id = ?', (display_id,)).fetchone()
+        if row is None:
+            raise KeyError(display_id)
+        return Ticket(self._api, **json.loads(row[0]))
+
+    def contacts(self, email=None):
+        """Returns the stored contacts, or only those with the given email address"""
+        query, params = 'SELECT payload FROM contacts', []
+        if email is not None:
+            query += ' WHERE email = ?'
+            params.append(email)
+        with self._lock:
+            rows = self._db.execute(query + ' ORDER BY id', params).fetchall()
+        return [Contact(self._api, **json.loads(row[0])) for row in rows]
+
+    def contact(self, contact_id):
+        """Returns a stored contact, or raises KeyError"""
+        with self._lock:
+            row = self._db.execute('SELECT payload FROM contacts WHERE id = ?', (int(contact_id),)).fetchone()
+        if row is None:
+            raise KeyError(contact_id)
+        return Contact(self._api, **json.loads(row[0]))
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,289 @@
+"""
+A local stand-in for a Freshdesk helpdesk.
+
+Serves the fixtures in sample_json_data over real HTTP so that clients can be
+exercised without network access. It can also stand in for a large helpdesk,
+multiplying the sample ticket into thousands of pages, with artificial latency
+and rate limiting, for benchmarks (see benchmarks/bench_api.py):
+
+>>> from freshdesk.api import API
+>>> server = MockFreshdeskServer().start()
+>>> api = API(server.domain, 'any_api_key', use_https=False)
+>>> api.tickets.get_ticket(1)
+<Ticket 'This is a sample ticket'>
+>>> server.stop()
+"""
+
+import copy
+import datetime
+import email.parser
+import gzip
+import json
+import os.path
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+
+def read_fixture(filename):
+    """Return the decoded contents of a sample_json_data fixture"""
+    path = os.path.join(os.path.dirname(__file__), 'sample_json_data', filename)
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+PAGE_SIZE = 30
+
+
+class MockFreshdeskServer(object):
+    """Serves a fake helpdesk on a local port.
+
+    Every request is recorded in .requests as a (method, path) tuple.
+    Tickets and notes can be created with multipart/form-data attachments,
+    which are kept in .attachments and served from helpdesk/attachments/<id>
+    through a redirect, like Freshdesk does.
+
+    :param int tickets:        how many tickets the helpdesk holds. They are
+                               copies of the sample ticket with display_ids 1 to
+                               tickets, listed newest first (or oldest first with
+                               order_type=asc), PAGE_SIZE to a page.
+    :param float latency:      seconds to wait before answering each request
+    :param int rate_limit:     requests allowed per hour, reported in
+                               X-RateLimit-* headers; once used up, requests are
+                               refused with a 429 and Retry-After
+    :param int throttle_every: also answer every n-th request with a 429 and
+                               Retry-After: 0, to exercise retries
+    """
+    def __init__(self, host='127.0.0.1', port=0, tickets=1, latency=0.0, rate_limit=None, throttle_every=None):
+        self.requests = []
+        self.tickets = tickets
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.throttle_every = throttle_every
+        self._window_start = time.time()
+        self._used = 0
+        self.attachments = {}
+        self._lock = threading.Lock()
+        self._ticket = read_fixture('ticket_1.json')['helpdesk_ticket']
+        self._summary = read_fixture('all_tickets.json')[0]
+        self._contact = read_fixture('contact.json')['user']
+        self._routes = [
+            ('GET', re.compile(r'^/helpdesk/tickets/filter/(\w+)$'), self.list_tickets),
+            ('GET', re.compile(r'^/helpdesk/tickets/(\d+)\.json$'), self.get_ticket),
+            ('POST', re.compile(r'^/helpdesk/tickets\.json$'), self.create_ticket),
+            ('POST', re.compile(r'^/helpdesk/tickets/(\d+)/conversations/note\.json$'), self.add_note),
+            ('GET', re.compile(r'^/helpdesk/attachments/(\d+)$'), self.get_attachment),
+            ('GET', re.compile(r'^/files/(\d+)$'), self.get_file),
+            ('GET', re.compile(r'^/contacts/(\d+)\.json$'), self.get_contact),
+            ('POST', re.compile(r'^/contacts\.json$'), self.create_contact),
+        ]
+        self._server = _ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def domain(self):
+        """The host:port to pass to API() as the Freshdesk domain"""
+        return '%s:%d' % self._server.server_address[:2]
+
+    def start(self):
+        """Start serving on a background thread and return self"""
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and release the port"""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _copy(self, ticket, display_id):
+        """A copy of a sample ticket as ticket number display_id; later
+        tickets were created and updated a minute after the one before"""
+        offset = datetime.timedelta(minutes=display_id - ticket['display_id'])
+        return dict(ticket, display_id=display_id, id=ticket['id'] + display_id - ticket['display_id'],
+                    created_at=(datetime.datetime.fromisoformat(ticket['created_at']) + offset).isoformat(),
+                    updated_at=(datetime.datetime.fromisoformat(ticket['updated_at']) + offset).isoformat())
+
+    # Handlers return a (status, payload) or (status, payload, headers) tuple;
+    # bytes payloads are sent as they are
+
+    def list_tickets(self, query, body, filter_name):
+        page = int(query.get('page', ['1'])[0])
+        if filter_name not in ('all_tickets', 'new_my_open') or page < 1:
+            return 200, []
+        if query.get('order_type') == ['asc']:
+            first = (page - 1) * PAGE_SIZE + 1
+            return 200, [self._copy(self._summary, i) for i in range(first, min(self.tickets, first + PAGE_SIZE - 1) + 1)]
+        newest = self.tickets - (page - 1) * PAGE_SIZE
+        return 200, [self._copy(self._summary, i) for i in range(newest, max(0, newest - PAGE_SIZE), -1)]
+
+    def get_ticket(self, query, body, ticket_id):
+        if not 1 <= int(ticket_id) <= self.tickets:
+            return 404, {'errors': {'error': 'Record Not Found'}}
+        return 200, {'helpdesk_ticket': self._copy(self._ticket, int(ticket_id))}
+
+    def create_ticket(self, query, body, *args):
+        with self._lock:
+            self.tickets += 1
+            display_id = self.tickets
+        ticket = self._copy(self._ticket, display_id)
+        ticket.update(json.loads(body)['helpdesk_ticket'], notes=[])
+        return 200, {'helpdesk_ticket': ticket}
+
+    def add_note(self, query, body, ticket_id):
+        if not 1 <= int(ticket_id) <= self.tickets:
+            return 404, {'errors': {'error': 'Record Not Found'}}
+        note = dict(self._ticket['notes'][0]['note'], attachments=[])
+        note.update(json.loads(body)['helpdesk_note'])
+        return 200, {'note': note}
+
+    def get_attachment(self, query, body, attachment_id):
+        if int(attachment_id) not in self.attachments:
+            return 404, {'errors': {'error': 'Record Not Found'}}
+        # Freshdesk redirects to a temporary link on its file storage
+        return 302, b'', {'Location': '/files/%s' % attachment_id}
+
+    def get_file(self, query, body, attachment_id):
+        return 200, self.attachments[int(attachment_id)]['data']
+
+    def _store_attachment(self, filename, content_type, data):
+        with self._lock:
+            attachment_id = len(self.attachments) + 1
+            self.attachments[attachment_id] = {'filename': filename, 'content_type': content_type, 'data': data}
+        now = datetime.datetime.now().replace(microsecond=0).isoformat()
+        return {'id': attachment_id, 'content_file_name': filename, 'content_content_type': content_type,
+                'content_file_size': len(data), 'attachment_url': 'http://%s/files/%d' % (self.domain, attachment_id),
+                'created_at': now, 'updated_at': now}
+
+    def _decode_form(self, body, content_type):
+        """Decode a multipart/form-data body with Rails-style field names
+        (helpdesk_ticket[custom_field][a]) into the equivalent JSON body,
+        storing its files as attachments"""
+        message = email.parser.BytesParser().parsebytes(
+            b'Content-Type: ' + content_type.encode('ascii') + b'\r\n\r\n' + body)
+        result = {}
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            keys = [name.split('[', 1)[0]] + re.findall(r'\[([^\]]*)\]', name)
+            value = part.get_payload(decode=True)
+            if part.get_filename() is not None:
+                keys = keys[:keys.index('attachments') + 2]
+                value = self._store_attachment(part.get_filename(), part.get_content_type(), value)
+            else:
+                value = value.decode('utf-8')
+            target = result
+            for key, next_key in zip(keys, keys[1:]):
+                target = target.setdefault(key, [] if next_key == '' else {})
+            if keys[-1] == '':
+                target.append(value)
+            else:
+                target[keys[-1]] = value
+        return json.dumps(result).encode('utf-8')
+
+    def get_contact(self, query, body, contact_id):
+        if int(contact_id) != self._contact['id']:
+            return 404, {'errors': {'error': 'Record Not Found'}}
+        return 200, {'user': self._contact}
+
+    def create_contact(self, query, body, *args):
+        contact = copy.deepcopy(self._contact)
+        contact.update(json.loads(body)['user'])
+        return 200, {'user': contact}
+
+    def _throttle(self, method, path):
+        """Record a request and count it against the rate limit. Returns the
+        rate-limit headers to send, and whether to refuse the request."""
+        with self._lock:
+            self.requests.append((method, path))
+            count = len(self.requests)
+            if self.throttle_every and count % self.throttle_every == 0:
+                return {'Retry-After': '0'}, True
+            if self.rate_limit is None:
+                return {}, False
+            elapsed = time.time() - self._window_start
+            if elapsed >= 3600:
+                self._window_start += elapsed // 3600 * 3600
+                self._used = 0
+            self._used += 1
+            headers = {'X-RateLimit-Total': str(self.rate_limit),
+                       'X-RateLimit-Remaining': str(max(0, self.rate_limit - self._used)),
+                       'X-RateLimit-Used-CurrentRequest': '1'}
+            if self._used > self.rate_limit:
+                headers['Retry-After'] = str(int(self._window_start + 3600 - time.time()) + 1)
+                return headers, True
+            return headers, False
+
+    def _dispatch(self, method, path, query, body, content_type=None):
+        """Returns the (status, payload, headers) of the response to a request"""
+        if self.latency:
+            time.sleep(self.latency)
+        headers, refused = self._throttle(method, path)
+        if refused:
+            return 429, {'errors': {'error': 'Rate limit exceeded'}}, headers
+        if content_type and content_type.startswith('multipart/form-data'):
+            body = self._decode_form(body, content_type)
+        for route_method, pattern, handler in self._routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                result = handler(query, body, *match.groups())
+                if len(result) > 2:
+                    headers.update(result[2])
+                return result[0], result[1], headers
+        return 404, {'errors': {'error': 'Record Not Found'}}, headers
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Send headers and body in one segment rather than waiting on delayed ACKs
+            disable_nagle_algorithm = True
+            wbufsize = -1
+
+            def _handle(self):
+                url = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                status, payload, headers = server._dispatch(self.command, url.path, parse_qs(url.query), body,
+                                                            self.headers.get('Content-Type'))
+                self.send_response(status)
+                if isinstance(payload, bytes):
+                    data = payload
+                    self.send_header('Content-Type', 'application/octet-stream')
+                else:
+                    data = json.dumps(payload).encode('utf-8')
+                    self.send_header('Content-Type', 'application/json; charset=utf-8')
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    data = gzip.compress(data)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(data)))
+                if self.close_connection:
+                    self.send_header('Connection', 'close')
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
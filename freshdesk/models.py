@@ -1,36 +1,381 @@
-﻿from dateutil.parser import parser as datetime_parser
+﻿from datetime import datetime
+from dateutil.parser import parse as dateutil_parse
 import sys
 import inspect
+from collections.abc import Sequence
+
+from freshdesk.attachments import CHUNK_SIZE
+
+def parse_timestamp(timestamp_str):
+    """Converts a timestamp string as returned by the API to a native
+    datetime object. Freshdesk's ISO-8601 format takes the fast path;
+    anything else is left to dateutil."""
+    if timestamp_str is None or isinstance(timestamp_str, datetime):
+        return timestamp_str
+    try:
+        return datetime.fromisoformat(timestamp_str)
+    except (AttributeError, ValueError):
+        return dateutil_parse(timestamp_str)
+
+class LazyTimestamp(object):
+    """A timestamp field that is parsed on first access and then memoized.
+    The raw string is kept under the field name prefixed with '_'."""
+    def __init__(self, name):
+        self.name = name
+        self.raw_name = '_' + name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            raw = instance.__dict__[self.raw_name]
+        except KeyError:
+            raise AttributeError(self.name)
+        except AttributeError:
+            return self._get_slotted(instance)
+        value = instance.__dict__[self.name] = parse_timestamp(raw)
+        return value
+
+    def _get_slotted(self, instance):
+        """Compact models have no __dict__, so the parsed value is memoized in
+        their _timestamps dict instead, leaving the raw string in its slot"""
+        try:
+            raw = getattr(instance, self.raw_name)
+        except AttributeError:
+            raise AttributeError(self.name)
+        parsed = instance._timestamps
+        if parsed is None:
+            parsed = instance._timestamps = {}
+        try:
+            return parsed[self.name]
+        except KeyError:
+            value = parsed[self.name] = parse_timestamp(raw)
+            return value
+
+class LazyModelList(Sequence):
+    """A read-only list of child models. Each model is only built from its
+    raw payload the first time it is accessed, and then kept."""
+    def __init__(self, build, payloads):
+        self._build = build
+        self._payloads = payloads
+        self._models = [None] * len(payloads)
+
+    def __len__(self):
+        return len(self._payloads)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        model = self._models[index]
+        if model is None:
+            model = self._models[index] = self._build(self._payloads[index])
+        return model
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return repr(list(self))
+
+class child_collection(object):
+    """Decorator for properties that build a collection of child models from
+    the parent's payload. The collection is built once and memoized on the
+    parent until invalidate() is called on it."""
+    def __init__(self, build):
+        self._build = build
+        self.name = build.__name__
+        self.__doc__ = build.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        children = getattr(instance, '_children', None)
+        if children is None:
+            children = instance._children = {}
+        try:
+            return children[self.name]
+        except KeyError:
+            collection = children[self.name] = self._build(instance)
+            return collection
+
+class _ModelType(type):
+    """Metaclass of the models, under which instances of a model's compact
+    variant (see FreshdeskModel.compact()) are also instances of the model"""
+    def __instancecheck__(cls, instance):
+        return type.__instancecheck__(cls, instance) or cls.__subclasscheck__(type(instance))
+
+    def __subclasscheck__(cls, subclass):
+        if type.__subclasscheck__(cls, subclass):
+            return True
+        return issubclass(subclass, CompactModel) and type.__subclasscheck__(cls, subclass._model)
 
-class FreshdeskModel(object):
+class FreshdeskModel(object, metaclass=_ModelType):
     """Base class for Freshdesk objects.
     Maps the JSON response from the web API to instance variables
-    Convenience variables and methods are defined at a higher level"""
-    _keys = set()
+    Convenience variables and methods are defined at a higher level
+
+    The names of the attributes that were loaded are kept in ._keys, a
+    frozenset shared by the instances loaded with the same fields"""
+    created_at = LazyTimestamp('created_at')
+    updated_at = LazyTimestamp('updated_at')
+    # False for lazy references (see lazy()) that have not been fetched yet
+    _loaded = True
 
     def __init__(self, api, **kwargs):
         self._api = api
+        names = self._attribute_names()
+        attrs = {}
         for k, v in kwargs.items():
-            # prevent clobbering with our properties below
-            if hasattr(Topic, k):
-                k = '_' + k
-            if hasattr(Ticket, k):
-                k = '_' + k
-            if hasattr(SolutionFolder, k):
-                k = '_' + k
-            if hasattr(Solution, k):
-                k = '_' + k
-            if hasattr(SolutionCategory, k):
-                k = '_' + k
-            setattr(self, k, v)
-            self._keys.add(k)
-        self.created_at = self._to_timestamp(self.created_at)
-        self.updated_at = self._to_timestamp(self.updated_at)
+            try:
+                attrs[names[k]] = v
+            except KeyError:
+                attrs[self._attribute_name(k)] = v
+        self.__dict__.update(attrs)
+        self._keys = self._key_set(tuple(attrs))
+
+    @classmethod
+    def _attribute_names(cls):
+        """Returns this class's table of JSON key -> attribute name, which is
+        filled in as new keys are seen"""
+        try:
+            return cls.__dict__['_names']
+        except KeyError:
+            cls._names = {}
+            return cls._names
+
+    @classmethod
+    def _key_set(cls, names):
+        """Returns the frozenset of the given attribute names. Sets are cached
+        per class, so instances loaded with the same fields share one."""
+        try:
+            key_sets = cls.__dict__['_key_sets']
+        except KeyError:
+            key_sets = cls._key_sets = {}
+        try:
+            return key_sets[names]
+        except KeyError:
+            keys = frozenset(names)
+            # Payloads of one kind rarely vary; don't grow without bound if they do
+            if len(key_sets) < 1024:
+                key_sets[names] = keys
+            return keys
+
+    @classmethod
+    def _attribute_name(cls, key):
+        """Returns the attribute name to store a JSON key under. Keys that would
+        clobber a property or method of this class are prefixed with '_'."""
+        name = '_' + key if hasattr(cls, key) else key
+        cls._attribute_names()[key] = name
+        return name
+
+    def invalidate(self):
+        """Forget memoized child collections (comments, posts, ...), so they
+        are rebuilt from the current payload on next access"""
+        self._children = None
+
+    def _changes(self, **fields):
+        """Internal: Returns the given fields that are set and differ from
+        this model's current values, i.e. the body of a partial update"""
+        changes = {}
+        for key, value in fields.items():
+            # A lazy reference doesn't know its current values, and isn't fetched to find out
+            if value is not None and (not self._loaded or getattr(self, self._attribute_name(key), None) != value):
+                changes[key] = value
+        return changes
+
+    def _apply(self, changes):
+        """Internal: Apply a successful partial update to this model"""
+        for key, value in changes.items():
+            name = self._attribute_name(key)
+            setattr(self, name, value)
+            if name not in self._keys:
+                self._keys = self._keys | {name}
+            if isinstance(getattr(type(self), key, None), LazyTimestamp):
+                # Forget the value parsed from the previous timestamp
+                self.__dict__.pop(key, None)
+        self.invalidate()
+
+    def _then(self, result, callback):
+        """Internal: Returns callback(result). Under an AsyncAPI, API calls
+        return coroutines, so this instead returns a coroutine that awaits
+        result first; it does so even when result is a plain value, so that
+        model methods can always be awaited."""
+        if not getattr(self._api, '_is_async', False):
+            return callback(result)
+
+        async def finish():
+            return callback(await result if inspect.isawaitable(result) else result)
+        return finish()
+
+    def _reload(self, fresh):
+        """Internal: Replace this model's fields with those of a freshly
+        fetched instance of the same model"""
+        self.__dict__.clear()
+        self.__dict__.update(fresh.__dict__)
+        self.invalidate()
+        return self
+
+    def _payload(self):
+        """Internal: Returns the fields this model was loaded with, keyed by
+        their JSON names, e.g. to store it and rebuild it later"""
+        keys = dict((name, key) for key, name in self._attribute_names().items())
+        return dict((keys.get(name, name), self.__dict__[name]) for name in self._keys)
 
     def _to_timestamp(self, timestamp_str):
         """Converts a timestamp string as returned by the API to
         a native datetime object and return it."""
-        return datetime_parser(timestamp_str)
+        return parse_timestamp(timestamp_str)
+
+    @classmethod
+    def lazy(cls, api, loader, **identity):
+        """Returns a reference to a model known only by its identifying fields
+        (e.g. display_id), which is an instance of this class. Reading any
+        other attribute fetches the model by calling loader(), which returns a
+        regular instance. Updates through a reference that has not been
+        fetched send every given field, without reading the model first."""
+        try:
+            lazy_class = _lazy_classes[cls]
+        except KeyError:
+            # Shares the model's table of attribute names, so a loaded
+            # reference maps its fields back to the same JSON keys
+            lazy_class = _lazy_classes[cls] = type('Lazy' + cls.__name__, (LazyModel, cls),
+                                                   {'_names': cls._attribute_names()})
+        ref = lazy_class(api, **identity)
+        ref._loader = loader
+        ref._loaded = False
+        return ref
+
+    @classmethod
+    def compact(cls, fields):
+        """Returns a compact variant of this model class for the given JSON
+        fields. Instances store those fields in __slots__ rather than an
+        instance __dict__, which greatly reduces memory for bulk exports.
+        Properties and methods behave as on the regular class; any keys outside
+        the schema are kept in an overflow dict.
+
+        Classes are cached, so models sharing a schema share a class."""
+        fields = tuple(sorted(fields))
+        try:
+            return _compact_classes[cls, fields]
+        except KeyError:
+            pass
+        namespace = {}
+        for klass in reversed(cls.__mro__[:-1]):
+            namespace.update(vars(klass))
+        for name in ('__init__', '__dict__', '__weakref__', '_names', '_key_sets', '_payload', '_apply', '_reload',
+                     'lazy'):
+            namespace.pop(name, None)
+        schema = dict((f, cls._attribute_name(f)) for f in fields)
+        namespace.update(__slots__=tuple(schema.values()), _schema=schema, _model=cls)
+        compact_class = type('Compact' + cls.__name__, (CompactModel,), namespace)
+        _compact_classes[cls, fields] = compact_class
+        return compact_class
+
+_compact_classes = {}
+_lazy_classes = {}
+
+class LazyModel(object):
+    """Mixin for the reference classes built by FreshdeskModel.lazy()"""
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set (yet)
+        if name.startswith('__') or self._loaded:
+            raise AttributeError(name)
+        self.load()
+        return getattr(self, name)
+
+    def load(self):
+        """Fetch the model now unless it already has been, and return self.
+        See API.resolve() to fetch many references at once."""
+        loader = self.__dict__.get('_loader')
+        if loader is not None:
+            fresh = loader()
+            # Fill in the fields before marking the reference as loaded, so
+            # other threads never see it empty
+            self.__dict__.update(fresh.__dict__)
+            self.__dict__.pop('_loaded', None)
+            self.__dict__.pop('_loader', None)
+            self.invalidate()
+        return self
+
+    def __repr__(self):
+        if self._loaded:
+            return super(LazyModel, self).__repr__()
+        identity = ', '.join('{}={!r}'.format(k.lstrip('_'), self.__dict__[k]) for k in sorted(self._keys))
+        return '<{} {}>'.format(type(self).__name__, identity)
+
+class CompactModel(object):
+    """Base class for the __slots__ classes built by FreshdeskModel.compact()"""
+    __slots__ = ('_api', '_extra', '_children', '_timestamps')
+
+    def __init__(self, api, **kwargs):
+        self._api = api
+        self._extra = None
+        self._children = None
+        self._timestamps = None
+        schema = self._schema
+        for k, v in kwargs.items():
+            try:
+                setattr(self, schema[k], v)
+            except KeyError:
+                if self._extra is None:
+                    self._extra = {}
+                self._extra[self._model._attribute_name(k)] = v
+
+    def __getattr__(self, name):
+        # Only called for unset slots and names outside the schema
+        extra = object.__getattribute__(self, '_extra')
+        if extra is not None and name in extra:
+            return extra[name]
+        raise AttributeError(name)
+
+    def _apply(self, changes):
+        for key, value in changes.items():
+            name = self._model._attribute_name(key)
+            if name in self.__slots__:
+                setattr(self, name, value)
+            else:
+                if self._extra is None:
+                    self._extra = {}
+                self._extra[name] = value
+        self._timestamps = None
+        self.invalidate()
+
+    def _reload(self, fresh):
+        """Replace this model's fields with those of a freshly fetched
+        regular instance of its model"""
+        fields = fresh.__dict__
+        for name in self.__slots__:
+            if name in fields:
+                setattr(self, name, fields[name])
+            elif hasattr(self, name):
+                delattr(self, name)
+        extra = dict((name, fields[name]) for name in fresh._keys if name not in self.__slots__)
+        self._extra = extra or None
+        self._timestamps = None
+        self.invalidate()
+        return self
+
+    def _payload(self):
+        keys = dict((name, key) for key, name in self._schema.items())
+        payload = dict((keys[name], getattr(self, name)) for name in self.__slots__ if hasattr(self, name))
+        if self._extra:
+            keys = dict((name, key) for key, name in self._model._attribute_names().items())
+            payload.update((keys.get(name, name), value) for name, value in self._extra.items())
+        return payload
+
+    @property
+    def _keys(self):
+        keys = set(name for name in self.__slots__ if hasattr(self, name))
+        if self._extra:
+            keys.update(self._extra)
+        return keys
 
 # Topic models
 
@@ -51,7 +396,11 @@ class Post(FreshdeskModel):
         url = 'discussions/topics/%d/posts/%d.json' % (self.topic_id, self.id)
         data = self._api._create_post("post",
                                       body_html=body_html or self.body_html)
-        return self._api._put(url, data)
+
+        def done(response):
+            self.topic.invalidate()
+            return response
+        return self._then(self._api._put(url, data), done)
 
 
 class Topic(FreshdeskModel):
@@ -77,33 +426,80 @@ class Topic(FreshdeskModel):
         _s = {1: 'planned', 2:'implemented', 3: 'not taken', 4: 'in progress', 5: 'deferred', 6: 'answered', 7: 'unanswered', 8: 'solved', 9: 'unsolved'}
         return _s[self._stamp_type]
 
-    @property
+    @child_collection
     def posts(self):
         """Returns a list of Post instances"""
-        return [Post(api=self._api, topic=self, **p) for p in self._posts]
-
-    def update(self, title, body_html, sticky=None, locked=None):
-        """Update the topic body"""
+        return LazyModelList(lambda p: Post(api=self._api, topic=self, **p), self._posts)
+
+    def refresh(self):
+        """Re-fetch this topic from the API"""
+        return self._then(self._api.topics.get_topic(self.id), self._reload)
+
+    def update(self, title=None, body_html=None, sticky=None, locked=None):
+        """Update the topic, sending only the fields that are given and differ
+        from this instance. Returns the JSON response, or None if nothing changed."""
+        changes = self._changes(title=title, body_html=body_html, sticky=sticky, locked=locked)
+        if not changes:
+            return self._then(None, lambda response: None)
         url = 'discussions/topics/%d.json' % self.id
-        data = self._api._create_post("topic",
-                                      title=title or self.title,
-                                      body_html=body_html or self.posts[0].body_html,
-                                      sticky=sticky or self.sticky,
-                                      locked=locked or self.locked)
-        return self._api._put(url, data)
+
+        def done(response):
+            changes.pop('body_html', None)
+            self._apply(changes)
+            return response
+        return self._then(self._api._put(url, self._api._create_post("topic", **changes)), done)
 
 # Ticket models
 
+class Attachment(FreshdeskModel):
+    """A file attached to a ticket or a comment
+    Interesting things:
+    .content_file_name: The file name
+    .content_content_type: The MIME type
+    .content_file_size: The size in bytes
+    .attachment_url: A temporary link to the file"""
+    def __str__(self):
+        return self.content_file_name
+
+    def __repr__(self):
+        return '<Attachment \'{}\'>'.format(self.content_file_name)
+
+    def download(self, dest, chunk_size=CHUNK_SIZE):
+        """Stream the file to dest, a path or a binary file object. Returns
+        the number of bytes written. See TicketAPI.download_attachment()."""
+        return self._then(self._api.tickets.download_attachment(self, dest, chunk_size), lambda written: written)
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        """Yield the contents of the file in chunks as they are received.
+        Under an AsyncAPI, this is an async iterator."""
+        return self._api.tickets.iter_attachment(self, chunk_size)
+
+def _attachments(model):
+    """The attachments of a ticket or comment, unwrapped if need be"""
+    return LazyModelList(lambda a: Attachment(api=model._api, **a.get('attachment', a)), model._attachments)
+
 class Ticket(FreshdeskModel):
+    due_by = LazyTimestamp('due_by')
+    frDueBy = LazyTimestamp('frDueBy')
+
     def __str__(self):
         return self.subject
 
     def __repr__(self):
         return '<Ticket \'{}\'>'.format(self.subject)
 
-    @property
+    @child_collection
     def comments(self):
-        return [Comment(api=self._api, ticket=self, **c['note']) for c in self.notes]
+        return LazyModelList(lambda c: Comment(api=self._api, ticket=self, **c['note']), self.notes)
+
+    @child_collection
+    def attachments(self):
+        """Returns a list of Attachment instances"""
+        return _attachments(self)
+
+    def refresh(self):
+        """Re-fetch this ticket from the API"""
+        return self._then(self._api.tickets.get_ticket(self.display_id), self._reload)
 
     @property
     def priority(self):
@@ -130,6 +526,11 @@ class Comment(FreshdeskModel):
     def __repr__(self):
         return '<Comment for {}>'.format(repr(self.ticket))
 
+    @child_collection
+    def attachments(self):
+        """Returns a list of Attachment instances"""
+        return _attachments(self)
+
 # Contact models
 
 class Contact(FreshdeskModel):
@@ -153,9 +554,13 @@ class SolutionCategory(FreshdeskModel):
     def __repr__(self):
         return 'Solution category \'{}\'>'.format(self.name)
 
-    @property
+    @child_collection
     def folders(self):
-        return [SolutionFolder(api=self._api, **f) for f in self._folders]
+        return LazyModelList(lambda f: SolutionFolder(api=self._api, **f), self._folders)
+
+    def refresh(self):
+        """Re-fetch this category from the API"""
+        return self._then(self._api.solutions.get_category(self.id), self._reload)
 
 class SolutionFolder(FreshdeskModel):
     """A freshdesk solution folder
@@ -180,9 +585,25 @@ class SolutionFolder(FreshdeskModel):
         _v = {1: 'All', 2: 'Logged in Users', 3: 'Agents Only', 4: 'Company Specific Users'}
         return _v[self._visibility]
 
-    @property
+    @child_collection
     def articles(self):
-        return [Solution(api=self._api, **a) for a in self._articles]
+        return LazyModelList(lambda a: Solution(api=self._api, **dict(a, category_id=self.category_id)), self._articles)
+
+    def refresh(self):
+        """Re-fetch this folder from the API"""
+        return self._then(self._api.solutions.get_folder(self.category_id, self.id), self._reload)
+
+    def update(self, name=None, visibility=None, description=None):
+        """Update the folder, sending only the fields that are given and
+        differ from this instance, without fetching it first. Returns self."""
+        changes = self._changes(name=name, visibility=visibility, description=description)
+        if not changes:
+            return self._then(None, lambda response: self)
+
+        def done(response):
+            self._apply(changes)
+            return self
+        return self._then(self._api.solutions.update_folder(self.category_id, self.id, **changes), done)
 
 class Solution(FreshdeskModel):
     """A freshdesk solution article
@@ -202,6 +623,25 @@ class Solution(FreshdeskModel):
     def tags(self):
         return [tag['name'] for tag in self._tags]
 
+    def update(self, title=None, description=None, tags=None):
+        """Update the article, sending only the fields that are given and
+        differ from this instance, without fetching it first. Returns self.
+        Articles must have been loaded through their category, e.g. with
+        SolutionAPI.get_article() or SolutionFolder.articles."""
+        changes = self._changes(title=title, description=description)
+        if tags is not None and (not self._loaded or list(tags) != self.tags):
+            changes['tags'] = tags
+        if not changes:
+            return self._then(None, lambda response: self)
+
+        def done(response):
+            if 'tags' in changes:
+                changes['tags'] = [{'name': tag} for tag in changes['tags']]
+            self._apply(changes)
+            return self
+        return self._then(self._api.solutions.update_article(self.category_id, self.folder_id, self.id, **changes),
+                          done)
+
     @property
     def article_type(self):
         _t = {1: 'permanent', 2: 'workaround'}
@@ -0,0 +1,168 @@
+"""
+Many Freshdesk domains in one process.
+
+An APIPool hands out an API per helpdesk domain, building it on first use
+and keeping the most recently used ones. All of them send requests through a
+single HTTPAdapter, whose connection pools are keyed by host, so tenants
+share the transport without sharing credentials or connections. Each domain
+keeps its own rate limit, while a semaphore caps the requests in flight
+across every tenant.
+
+>>> pool = APIPool(max_tenants=500, max_concurrency=64, rate_limit=3000)
+>>> pool.register('acme.freshdesk.com', api_key='...')
+>>> pool.get('acme.freshdesk.com').tickets.get_ticket(42)
+
+Credentials can also be looked up when a domain is first used:
+
+>>> pool = APIPool(credentials=lambda domain: {'api_key': keys[domain]})
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+
+from freshdesk.api import API
+from freshdesk.codec import get_codec
+from freshdesk.ratelimit import RequestScheduler
+
+
+class APIPool(object):
+    """A registry of API instances, one per domain.
+
+    :param credentials:         called with a domain that was not registered;
+                                returns the API() keyword arguments for it
+                                (api_key, rate_limit, ...), or None if unknown
+    :param int max_tenants:     how many API instances to keep; the least
+                                recently used one is evicted beyond that
+    :param float idle_timeout:  also evict instances unused for this many seconds
+    :param int max_concurrency: requests in flight at once, over all domains.
+                                None leaves them uncapped.
+    :param int pool_maxsize:    keep-alive connections kept per domain
+
+    Any other keyword arguments are defaults for every API (e.g. rate_limit,
+    timeout). A cache, whose keys don't include the domain, can only be given
+    per domain, with register().
+
+    Evicted instances stay usable by whoever still holds them. Their rate
+    limiters are kept, so rebuilding an evicted tenant doesn't reset its budget.
+    """
+    def __init__(self, credentials=None, max_tenants=256, idle_timeout=None, max_concurrency=None,
+                 pool_maxsize=DEFAULT_POOLSIZE, clock=time.time, **api_options):
+        if 'cache' in api_options:
+            raise ValueError('A cache cannot be shared between domains; register() one per domain instead')
+        self.credentials = credentials
+        self.max_tenants = max_tenants
+        self.idle_timeout = idle_timeout
+        self.created = 0
+        self.evicted = 0
+        self._api_options = api_options
+        self._api_options['json_codec'] = get_codec(api_options.get('json_codec'))
+        self._concurrency = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        # urllib3 keeps one connection pool per host, discarding the least recently used
+        self._adapter = HTTPAdapter(pool_connections=max_tenants, pool_maxsize=pool_maxsize)
+        self._registered = {}
+        self._schedulers = {}
+        self._tenants = OrderedDict()   # domain -> (API, last used)
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(domain):
+        return domain.rstrip('/').lower()
+
+    def register(self, domain, **options):
+        """Set the API() keyword arguments of a domain, e.g. its api_key and
+        rate_limit. An instance already built for it is replaced on next use."""
+        key = self._key(domain)
+        with self._lock:
+            self._registered[key] = options
+            self._tenants.pop(key, None)
+            self._schedulers.pop(key, None)
+
+    def get(self, domain):
+        """Return the API for a domain, building it if need be. Raises KeyError
+        for a domain that is neither registered nor known to credentials."""
+        key = self._key(domain)
+        now = self._clock()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._tenants.get(key)
+            if entry is not None:
+                self._tenants[key] = (entry[0], now)
+                self._tenants.move_to_end(key)
+                return entry[0]
+            options = self._registered.get(key)
+        if options is None and self.credentials is not None:
+            options = self.credentials(domain)
+        if options is None:
+            raise KeyError(domain)
+        with self._lock:
+            # Another thread may have built it meanwhile
+            entry = self._tenants.get(key)
+            if entry is None:
+                entry = (self._build(key, options), now)
+                self._tenants[key] = entry
+                self.created += 1
+                while len(self._tenants) > self.max_tenants:
+                    self._tenants.popitem(last=False)
+                    self.evicted += 1
+            self._tenants.move_to_end(key)
+            return entry[0]
+
+    __getitem__ = get
+
+    def _build(self, key, options):
+        options = dict(self._api_options, **options)
+        scheduler = self._schedulers.get(key)
+        if scheduler is None:
+            scheduler = self._schedulers[key] = RequestScheduler(
+                options.pop('rate_limit', None), options.pop('max_retries', 5), options.pop('backoff_factor', 0.5),
+                concurrency=self._concurrency)
+        for name in ('rate_limit', 'max_retries', 'backoff_factor', 'pool_connections', 'pool_maxsize'):
+            options.pop(name, None)
+        return API(key, adapter=self._adapter, scheduler=scheduler, **options)
+
+    def _evict_idle(self, now):
+        if self.idle_timeout is None:
+            return
+        while self._tenants:
+            key, (api, last_used) = next(iter(self._tenants.items()))
+            if now - last_used < self.idle_timeout:
+                break
+            del self._tenants[key]
+            self.evicted += 1
+
+    def evict(self, domain):
+        """Drop the API instance of a domain, if one is kept"""
+        with self._lock:
+            if self._tenants.pop(self._key(domain), None) is not None:
+                self.evicted += 1
+
+    def __contains__(self, domain):
+        """Whether an API instance is kept for the domain"""
+        return self._key(domain) in self._tenants
+
+    def __len__(self):
+        return len(self._tenants)
+
+    def domains(self):
+        """The domains with an API instance, least recently used first"""
+        with self._lock:
+            return list(self._tenants)
+
+    def close(self):
+        """Drop every instance and close all pooled connections"""
+        with self._lock:
+            self._tenants.clear()
+        self._adapter.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return '<APIPool {} tenants, {} created, {} evicted>'.format(len(self), self.created, self.evicted)
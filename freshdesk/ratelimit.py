@@ -0,0 +1,189 @@
+"""
+Client-side rate limiting for the Freshdesk API.
+
+Freshdesk allows a fixed number of requests per hour per account. The
+RequestScheduler spaces requests out with a token bucket sized to that limit,
+honours Retry-After when the server throttles anyway, and retries throttled
+(429) responses and, for idempotent methods, failed (5xx) ones with jittered
+exponential backoff.
+"""
+
+import email.utils
+import random
+import threading
+import time
+
+
+# Methods that can be re-sent after a server error without repeating a side
+# effect; a POST that failed with a 5xx may still have created something
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+
+class TokenBucket(object):
+    """A thread-safe token bucket holding up to `capacity` tokens, refilled
+    continuously at `rate` tokens per `per` seconds."""
+    def __init__(self, rate, per=3600.0, capacity=None, clock=time.time):
+        self.capacity = float(capacity or rate)
+        self.fill_rate = float(rate) / per
+        self._tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.fill_rate)
+        self._updated = now
+
+    def reserve(self):
+        """Take a token and return how many seconds the caller must wait
+        before using it (0 if one was available)."""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.fill_rate
+
+    def sync(self, remaining):
+        """Never believe there are more tokens left than the server reports"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, float(remaining))
+
+
+class ThrottleStats(object):
+    """Counters describing how much a scheduler has been throttled.
+    All times are in seconds."""
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.bucket_wait_time = 0.0
+        self.retry_after_time = 0.0
+        self.backoff_time = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def throttled_time(self):
+        """Total time spent waiting, for whatever reason"""
+        return self.bucket_wait_time + self.retry_after_time + self.backoff_time
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'throttled': self.throttled,
+            'bucket_wait_time': self.bucket_wait_time,
+            'retry_after_time': self.retry_after_time,
+            'backoff_time': self.backoff_time,
+            'throttled_time': self.throttled_time,
+        }
+
+    def __repr__(self):
+        return '<ThrottleStats {}>'.format(self.as_dict())
+
+
+def parse_retry_after(value, now=None):
+    """Return the number of seconds a Retry-After header asks us to wait.
+    The header is either a number of seconds or an HTTP date."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = email.utils.mktime_tz(email.utils.parsedate_tz(value))
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when - (now if now is not None else time.time()))
+
+
+class RequestScheduler(object):
+    """Sends requests on behalf of API, throttling and retrying as needed.
+
+    :param int rate_limit:       requests allowed per hour, or None to only
+                                 throttle when the server asks us to
+    :param int max_retries:      how often to retry a throttled or failed request
+    :param float backoff_factor: base delay for exponential backoff
+    :param float max_backoff:    upper bound for a single backoff delay
+    :param concurrency:          a semaphore, possibly shared between schedulers,
+                                 held while each request is sent; it caps the
+                                 requests in flight without counting waits
+    """
+    def __init__(self, rate_limit=None, max_retries=5, backoff_factor=0.5, max_backoff=60.0,
+                 sleep=time.sleep, clock=time.time, concurrency=None):
+        self.bucket = TokenBucket(rate_limit, clock=clock) if rate_limit else None
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.stats = ThrottleStats()
+        self._sleep = sleep
+        self._clock = clock
+        self._blocked_until = 0.0
+
+    def _is_retryable(self, response, method):
+        """Throttled requests are retried whatever their method, as they were
+        not processed; failed ones only if re-sending them is harmless"""
+        if response.status_code == 429:
+            return True
+        # Freshdesk v1 signals rate limiting with a 403 and Retry-After
+        if 'Retry-After' in response.headers:
+            return True
+        return response.status_code >= 500 and method.upper() in IDEMPOTENT_METHODS
+
+    def _wait_for_turn(self):
+        """Sleep until the server-imposed pause is over and a token is free"""
+        blocked = self._blocked_until - self._clock()
+        if blocked > 0:
+            self.stats.add(retry_after_time=blocked)
+            self._sleep(blocked)
+        if self.bucket is not None:
+            wait = self.bucket.reserve()
+            if wait > 0:
+                self.stats.add(bucket_wait_time=wait)
+                self._sleep(wait)
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+
+    def send(self, send_request, method='GET'):
+        """Call send_request(), which sends a request with the given HTTP
+        method, until it returns a response that should not be retried, or
+        retries run out. Returns the last response."""
+        attempt = 0
+        while True:
+            self._wait_for_turn()
+            if self.concurrency is None:
+                response = send_request()
+            else:
+                with self.concurrency:
+                    response = send_request()
+            self.stats.add(requests=1)
+            remaining = response.headers.get('X-RateLimit-Remaining')
+            if self.bucket is not None and remaining is not None and remaining.isdigit():
+                self.bucket.sync(int(remaining))
+            if not self._is_retryable(response, method) or attempt >= self.max_retries:
+                return response
+            # Release the connection of a streamed response that won't be read
+            response.close()
+
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                # Hold back every thread sharing this scheduler, not just this one
+                self.stats.add(throttled=1)
+                self._blocked_until = max(self._blocked_until, self._clock() + retry_after)
+            else:
+                if response.status_code == 429:
+                    self.stats.add(throttled=1)
+                delay = self._backoff(attempt)
+                self.stats.add(backoff_time=delay)
+                self._sleep(delay)
+            self.stats.add(retries=1)
+            attempt += 1
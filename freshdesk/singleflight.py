@@ -0,0 +1,68 @@
+"""
+Coalescing of concurrent identical requests.
+
+When several threads ask for the same resource at once (e.g. a burst of
+webhooks all calling get_ticket(42)), only the first sends a request; the
+others wait for it and get a copy of its decoded response. Nothing is
+cached: once the request completes, the next call for the key sends a new one.
+"""
+
+import threading
+
+
+class _Call(object):
+    """A call in flight, and its outcome once done is set"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Runs at most one call per key at a time.
+
+    .executed counts the calls that were actually made, .coalesced the calls
+    that were answered by another thread's call."""
+    def __init__(self):
+        self.executed = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, copy=None):
+        """Return func(), unless a call for key is already in flight, in which
+        case wait for it and return its result (or raise its exception).
+        If given, copy is applied to the result for each caller that waited,
+        so that they don't share it with the caller that made the call."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result if copy is None else copy(call.result)
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def as_dict(self):
+        return {'executed': self.executed, 'coalesced': self.coalesced}
+
+    def __repr__(self):
+        return '<SingleFlight {}>'.format(self.as_dict())
@@ -0,0 +1,130 @@
+"""
+Incremental parsing of JSON arrays.
+
+Filter pages are JSON arrays of tickets that can run to megabytes. Rather
+than buffering a whole response and decoding it at once, a JSONArrayParser is
+fed the body chunk by chunk as it arrives and returns each item as soon as it
+is complete, so only the item being received is held in memory and decoding
+overlaps the transfer. Each item is decoded with the API's JSON codec.
+
+>>> parser = JSONArrayParser(json.loads)
+>>> parser.feed(b'[{"display_id": 1}, {"displ')
+[{'display_id': 1}]
+>>> parser.feed(b'ay_id": 2}]')
+[{'display_id': 2}]
+>>> parser.close()
+"""
+
+import re
+
+# Item boundaries are found by scanning the UTF-8 body for the ASCII
+# characters that open and close strings and containers; bytes of multi-byte
+# characters never match them.
+_STRUCTURAL = re.compile(br'["\[\]{},]')
+_STRING_END = re.compile(br'["\\]')
+_WHITESPACE = b' \t\r\n'
+
+
+class JSONArrayParser(object):
+    """Splits a JSON array arriving in chunks into its decoded items.
+
+    :param loads: decodes the bytes of one item, e.g. a codec's loads
+    """
+    def __init__(self, loads):
+        self._loads = loads
+        self._buffer = b''
+        self._pos = 0           # where scanning resumes
+        self._item_start = 0    # where the item being scanned begins
+        self._depth = 0         # 1 inside the top-level array
+        self._in_string = False
+        self.started = False    # the opening bracket has been seen
+        self.done = False
+
+    def feed(self, chunk):
+        """Add the next chunk of the body and return the items it completed"""
+        if self.done:
+            if chunk.strip(_WHITESPACE):
+                raise ValueError('Extra data after the end of the JSON array')
+            return []
+        self._buffer += chunk
+        items = []
+        if self._depth == 0 and not self._start():
+            return items
+        self._scan(items)
+        # Drop everything before the item in progress
+        if self._item_start:
+            self._buffer = self._buffer[self._item_start:]
+            self._pos -= self._item_start
+            self._item_start = 0
+        return items
+
+    def close(self):
+        """Check that the whole array was received"""
+        if not self.done:
+            raise ValueError('Truncated JSON array')
+
+    def _start(self):
+        """Skip to the opening bracket. Returns False until it has arrived."""
+        body = self._buffer.lstrip(_WHITESPACE)
+        if not body:
+            self._buffer = b''
+            return False
+        if not body.startswith(b'['):
+            raise ValueError('Expected a JSON array, got {!r}'.format(body[:20]))
+        self._buffer = body
+        self._pos = self._item_start = 1
+        self._depth = 1
+        self.started = True
+        return True
+
+    def _emit(self, end, items):
+        item = self._buffer[self._item_start:end].strip(_WHITESPACE)
+        if item:
+            items.append(self._loads(item))
+
+    def _scan(self, items):
+        buffer = self._buffer
+        pos = self._pos
+        depth = self._depth
+        in_string = self._in_string
+        while True:
+            if in_string:
+                match = _STRING_END.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                if match.group() == b'\\':
+                    if match.end() == len(buffer):
+                        # The escaped character hasn't arrived yet
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                in_string = False
+                pos = match.end()
+                continue
+            match = _STRUCTURAL.search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+            char = match.group()
+            pos = match.end()
+            if char == b'"':
+                in_string = True
+            elif char in b'[{':
+                depth += 1
+            elif char in b']}':
+                depth -= 1
+                if depth == 0:
+                    self._emit(match.start(), items)
+                    self.done = True
+                    self._item_start = pos
+                    if buffer[pos:].strip(_WHITESPACE):
+                        raise ValueError('Extra data after the end of the JSON array')
+                    break
+            elif depth == 1:
+                self._emit(match.start(), items)
+                self._item_start = pos
+        self._pos = pos
+        self._depth = depth
+        self._in_string = in_string
@@ -8,14 +8,40 @@ http://pythonfreshdesk.freshdesk.com/
 DOMAIN = 'pythonfreshdesk.freshdesk.com'
 API_KEY = 'MX4CEAw4FogInimEdRW2'
 
-import dateutil
+import collections
+import datetime
+import dateutil.tz
 import json
 import re
 import os.path
+import threading
+import time
+import unittest
 from unittest import TestCase
 
+from collections.abc import Sequence
+
+import requests
+from requests.exceptions import HTTPError
+from requests.structures import CaseInsensitiveDict
+
 from freshdesk.api import API
-from freshdesk.models import Ticket, Comment, Contact
+from freshdesk.attachments import AttachmentStore, MultipartBody, form_fields
+from freshdesk.bulk import Checkpoint
+from freshdesk.cache import MemoryCache, ResponseCache, SQLiteCache
+from freshdesk.mirror import Mirror
+from freshdesk.mockserver import MockFreshdeskServer, read_fixture
+from freshdesk.pool import APIPool
+from freshdesk.models import (Attachment, Ticket, Comment, Contact, FreshdeskModel, SolutionCategory, SolutionFolder,
+                              Solution, Topic)
+from freshdesk.ratelimit import RequestScheduler, TokenBucket, parse_retry_after
+from freshdesk.streaming import JSONArrayParser
+from freshdesk.sync import SyncState, TicketSync
+
+try:
+    from freshdesk.async_api import AsyncAPI
+except ImportError:
+    AsyncAPI = None
 
 class MockedAPI(API):
     def __init__(self, *args):
@@ -27,14 +53,22 @@ class MockedAPI(API):
             re.compile(r'helpdesk/tickets/1.json'): self.read_test_file('ticket_1.json'),
             re.compile(r'.*&page=2'): [],
             re.compile(r'contacts/5004272351.json'): self.read_test_file('contact.json'),
+            re.compile(r'solution/categories.json'): self.read_test_file('solution_categories.json'),
+            re.compile(r'solution/categories/1.json'): self.read_test_file('solution_category_1.json'),
+            re.compile(r'solution/categories/1/folders/2.json'): self.read_test_file('solution_folder_2.json'),
         }
+        self.requested = []
+        self.requested_params = []
+        self.written = []
         super(MockedAPI, self).__init__(*args)
 
     def read_test_file(self, filename):
         path = os.path.join(os.path.dirname(__file__), 'sample_json_data', filename)
         return json.loads(open(path, 'r').read())
 
-    def _get(self, url, *args, **kwargs):
+    def _get(self, url, params={}):
+        self.requested.append(url)
+        self.requested_params.append(params)
         for pattern, json in self.resolver.items():
             if pattern.match(url):
                 return json
@@ -43,13 +77,104 @@ class MockedAPI(API):
         from requests.exceptions import HTTPError
         raise HTTPError('404: mocked_api_get() has no pattern for \'{}\''.format(url))
 
+    def _put(self, url, data={}):
+        self.written.append(('PUT', url, json.loads(data)))
+        return collections.defaultdict(dict)
+
+    def _post(self, url, data={}):
+        # Echo the posted object back, as Freshdesk does
+        body = json.loads(data)
+        self.written.append(('POST', url, body))
+        if 'fail' in json.dumps(body):
+            from requests.exceptions import HTTPError
+            raise HTTPError('400: mocked_api_post() refused \'{}\''.format(url))
+        return collections.defaultdict(dict, body)
+
+if AsyncAPI is not None:
+    class MockedAsyncAPI(AsyncAPI):
+        """An AsyncAPI answering from the same fixtures as MockedAPI"""
+        def __init__(self, *args):
+            super(MockedAsyncAPI, self).__init__(*args)
+            self.blocking = MockedAPI(*args)
+
+        async def _get(self, url, params={}):
+            return self.blocking._get(url, params)
+
+        async def _put(self, url, data={}):
+            return self.blocking._put(url, data)
+
+def make_response(status_code=200, body=b'{}', headers=None):
+    """Build a requests.Response without touching the network"""
+    response = requests.models.Response()
+    response.status_code = status_code
+    response.headers = CaseInsensitiveDict(headers or {})
+    response._content = body
+    response._content_consumed = True
+    response.url = 'http://{}/'.format(DOMAIN)
+    return response
+
+class FakeSession(requests.Session):
+    """A session that replays canned responses instead of sending requests"""
+    def __init__(self, *responses):
+        super(FakeSession, self).__init__()
+        self.responses = list(responses)
+        self.sent = []
+
+    def request(self, method, url, **kwargs):
+        self.sent.append((method, url, kwargs))
+        return self.responses.pop(0)
+
 class TestAPIClass(TestCase):
     def test_api_prefix(self):
         api = API('test_domain', 'test_key')
-        self.assertEqual(api._api_prefix, 'http://test_domain/')
+        self.assertEqual(api._api_prefix, 'https://test_domain/')
         api = API('test_domain/', 'test_key')
+        self.assertEqual(api._api_prefix, 'https://test_domain/')
+        api = API('test_domain', 'test_key', use_https=False)
         self.assertEqual(api._api_prefix, 'http://test_domain/')
 
+    def test_transport_options(self):
+        api = API('test_domain', api_key='test_key', pool_connections=2, pool_maxsize=20, timeout=(1, 2))
+        adapter = api._session.get_adapter('https://test_domain/')
+        self.assertEqual((adapter._pool_connections, adapter._pool_maxsize), (2, 20))
+        self.assertIn('gzip', api._session.headers['Accept-Encoding'])
+        api._session = FakeSession(make_response())
+        api._get('contacts/1.json')
+        self.assertEqual(api._session.sent[0][2]['timeout'], (1, 2))
+
+    def test_compressed_responses(self):
+        with MockFreshdeskServer() as server:
+            api = API(server.domain, api_key='test_key', use_https=False)
+            response = api._send('GET', 'helpdesk/tickets/1.json')
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(response.json()['helpdesk_ticket']['display_id'], 1)
+            api = API(server.domain, api_key='test_key', use_https=False, compress=False)
+            self.assertNotIn('Content-Encoding', api._send('GET', 'helpdesk/tickets/1.json').headers)
+
+    def test_json_codecs(self):
+        from freshdesk.codec import JSONCodec, get_codec
+        for name in ('json', 'orjson', 'ujson'):
+            try:
+                api = API('test_domain', api_key='test_key', json_codec=name)
+            except ImportError:
+                continue
+            self.assertEqual(api._codec.name, name)
+            body = api._create_post('user', name=u'Zo\xeb')
+            self.assertIsInstance(body, bytes)
+            self.assertEqual(json.loads(body.decode('utf-8')), {'user': {'name': u'Zo\xeb'}})
+        self.assertIsInstance(API('test_domain', api_key='test_key', json_codec=JSONCodec())._codec, JSONCodec)
+        self.assertRaises(ValueError, get_codec, 'yaml')
+
+    def test_response_decoding(self):
+        api = API('test_domain', api_key='test_key')
+        api._session = FakeSession(make_response(200, b'[{"display_id": 1}]'), make_response(200, b''),
+                                   make_response(200, b'<html>Oops</html>'),
+                                   make_response(200, b'{"require_login": true}'))
+        self.assertEqual(api._get('helpdesk/tickets/filter/all_tickets'), [{'display_id': 1}])
+        self.assertEqual(api._delete('helpdesk/tickets/1.json'), {})
+        self.assertRaises(HTTPError, api._get, 'helpdesk/tickets/1.json')
+        self.assertRaises(HTTPError, api._get, 'helpdesk/tickets/1.json')
+
     def test_403_error(self):
         api = API(DOMAIN, 'invalid_api_key')
         from requests.exceptions import HTTPError
@@ -92,9 +217,33 @@ class TestTicket(TestCase):
         self.assertEqual(self.ticket._source, 2)
         self.assertEqual(self.ticket.source, 'portal')
 
+    def test_ticket_keys(self):
+        self.assertIn('_status', self.ticket._keys)
+        self.assertIn('subject', self.ticket._keys)
+        contact = self.api.contacts.get_contact('5004272351')
+        self.assertNotIn('subject', contact._keys)
+        self.assertNotIn('email', self.ticket._keys)
+
+    def test_attribute_names_are_per_class(self):
+        # 'posts' only clashes with Topic.posts, so other models keep the name
+        ticket = Ticket(self.api, created_at=None, updated_at=None, posts=[], articles=[])
+        self.assertEqual(ticket.posts, [])
+        self.assertEqual(ticket.articles, [])
+
     def test_ticket_datetime(self):
-        self.assertIsInstance(self.ticket.created_at, dateutil.parser.parser)
-        self.assertIsInstance(self.ticket.updated_at, dateutil.parser.parser)
+        self.assertIsInstance(self.ticket.created_at, datetime.datetime)
+        self.assertIsInstance(self.ticket.updated_at, datetime.datetime)
+        self.assertEqual(self.ticket.created_at, datetime.datetime(2014, 12, 31, 12, 27, 9, tzinfo=dateutil.tz.tzoffset(None, 36000)))
+        self.assertEqual(self.ticket.due_by, datetime.datetime(2015, 1, 5, 12, 27, 9, tzinfo=dateutil.tz.tzoffset(None, 36000)))
+        self.assertIsInstance(self.ticket.frDueBy, datetime.datetime)
+
+    def test_lazy_datetime(self):
+        ticket = Ticket(self.api, created_at='2015-01-01T10:58:39+10:00', updated_at='Thu, 01 Jan 2015 10:58:39 +1000')
+        self.assertNotIn('created_at', ticket.__dict__)
+        self.assertIs(ticket.created_at, ticket.created_at)
+        self.assertEqual(ticket.created_at, ticket.updated_at)
+        self.assertEqual(ticket._created_at, '2015-01-01T10:58:39+10:00')
+        self.assertFalse(hasattr(ticket, 'due_by'))
 
     def test_all_tickets(self):
         tickets = self.api.tickets.list_all_tickets()
@@ -124,6 +273,832 @@ class TestTicket(TestCase):
         self.assertEqual(len(tickets), 1)
         self.assertEqual(tickets[0].display_id, self.ticket.display_id)
 
+    def test_list_tickets_from_summaries(self):
+        del self.api.requested[:]
+        tickets = self.api.tickets.list_tickets()
+        self.assertEqual(len(self.api.requested), 2)
+        self.assertIsInstance(tickets[0], Ticket)
+        self.assertEqual(tickets[0].subject, self.ticket.subject)
+        self.assertEqual(tickets[0].status, 'open')
+        self.assertFalse(hasattr(tickets[0], 'notes'))
+
+    def test_list_tickets_hydrated(self):
+        del self.api.requested[:]
+        tickets = self.api.tickets.list_tickets(hydrate=True, max_workers=4)
+        self.assertEqual(len(self.api.requested), 3)
+        self.assertEqual(len(tickets), 1)
+        self.assertEqual(len(tickets[0].comments), 1)
+
+    def test_iter_tickets(self):
+        del self.api.requested[:]
+        tickets = self.api.tickets.iter_tickets('new_my_open')
+        self.assertNotIsInstance(tickets, list)
+        first = next(tickets)
+        self.assertEqual(first.display_id, self.ticket.display_id)
+        self.assertEqual(list(tickets), [])
+        self.assertEqual(len(self.api.requested), 2)
+
+class TestRateLimiting(TestCase):
+    def setUp(self):
+        self.api = API(DOMAIN, api_key=API_KEY, max_retries=2)
+        self.sleeps = []
+        self.api._scheduler._sleep = self.sleeps.append
+
+    def test_retry_after_is_honoured(self):
+        self.api._session = FakeSession(
+            make_response(429, headers={'Retry-After': '30'}),
+            make_response(200, b'{"user": {}}'))
+        self.assertEqual(self.api._get('contacts/1.json'), {'user': {}})
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertAlmostEqual(self.sleeps[0], 30, places=0)
+        self.assertEqual(self.api.throttle_stats.throttled, 1)
+        self.assertEqual(self.api.throttle_stats.retries, 1)
+        self.assertEqual(self.api.throttle_stats.requests, 2)
+        self.assertGreater(self.api.throttle_stats.throttled_time, 29)
+
+    def test_backoff_on_server_error(self):
+        self.api._session = FakeSession(make_response(503), make_response(500), make_response(200))
+        self.assertEqual(self.api._get('contacts/1.json'), {})
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertTrue(0 <= self.sleeps[0] <= 0.5)
+        self.assertTrue(0 <= self.sleeps[1] <= 1.0)
+        self.assertEqual(self.api.throttle_stats.throttled, 0)
+
+    def test_posts_are_not_retried_after_server_errors(self):
+        self.api._session = FakeSession(make_response(502), make_response(200))
+        with self.assertRaises(HTTPError):
+            self.api.contacts.create_contact('Sam', 'sam@example.com')
+        self.assertEqual([sent[0] for sent in self.api._session.sent], ['POST'])
+        self.api._session = FakeSession(make_response(429, headers={'Retry-After': '1'}),
+                                        make_response(200, b'{"user": {"name": "Sam"}}'))
+        self.assertEqual(self.api.contacts.create_contact('Sam', 'sam@example.com').name, 'Sam')
+        self.assertEqual([sent[0] for sent in self.api._session.sent], ['POST', 'POST'])
+
+    def test_gives_up_after_max_retries(self):
+        self.api._session = FakeSession(*[make_response(403, headers={'Retry-After': '1'})] * 3)
+        with self.assertRaises(HTTPError):
+            self.api._get('contacts/1.json')
+        self.assertEqual(len(self.api._session.sent), 3)
+
+    def test_client_errors_are_not_retried(self):
+        self.api._session = FakeSession(make_response(404))
+        with self.assertRaises(HTTPError):
+            self.api._get('contacts/1.json')
+        self.assertEqual(self.sleeps, [])
+
+    def test_token_bucket(self):
+        now = [0.0]
+        bucket = TokenBucket(3600, capacity=2, clock=lambda: now[0])
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 1.0)
+        now[0] += 3
+        self.assertEqual(bucket.reserve(), 0)
+        bucket.sync(0)
+        self.assertAlmostEqual(bucket.reserve(), 1.0)
+
+    def test_rate_limit_spaces_requests(self):
+        api = API(DOMAIN, api_key=API_KEY, rate_limit=1)
+        api._scheduler._sleep = self.sleeps.append
+        api._session = FakeSession(make_response(200), make_response(200))
+        api._get('contacts/1.json')
+        api._get('contacts/1.json')
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertGreater(self.sleeps[0], 3500)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('120'), 120)
+        self.assertEqual(parse_retry_after('Thu, 01 Jan 2015 00:01:00 GMT', now=1420070400), 60)
+        self.assertIsNone(parse_retry_after('soon'))
+
+class TestAPIPool(TestCase):
+    def test_instances_are_kept_and_share_transport(self):
+        pool = APIPool(max_tenants=10, rate_limit=100)
+        pool.register('a.freshdesk.com', api_key='key_a')
+        pool.register('b.freshdesk.com', api_key='key_b', rate_limit=50)
+        a, b = pool.get('a.freshdesk.com'), pool['B.freshdesk.com/']
+        self.assertIs(pool.get('a.freshdesk.com'), a)
+        self.assertEqual(a._session.auth[0], 'key_a')
+        self.assertEqual(b._session.auth[0], 'key_b')
+        self.assertIs(a._session.get_adapter('https://a.freshdesk.com/'), pool._adapter)
+        self.assertIs(b._session.get_adapter('https://b.freshdesk.com/'), pool._adapter)
+        a._ensure_pool(64)
+        self.assertIs(a._session.get_adapter('https://a.freshdesk.com/'), pool._adapter)
+        self.assertIs(a._codec, b._codec)
+        self.assertEqual(a._scheduler.bucket.capacity, 100)
+        self.assertEqual(b._scheduler.bucket.capacity, 50)
+        self.assertRaises(KeyError, pool.get, 'c.freshdesk.com')
+        self.assertRaises(ValueError, APIPool, cache=ResponseCache())
+
+    def test_credentials(self):
+        seen = []
+
+        def credentials(domain):
+            seen.append(domain)
+            return {'api_key': 'key'} if domain.startswith('known') else None
+        pool = APIPool(credentials=credentials)
+        pool.get('known.freshdesk.com')
+        pool.get('known.freshdesk.com')
+        self.assertRaises(KeyError, pool.get, 'unknown.freshdesk.com')
+        self.assertEqual(seen, ['known.freshdesk.com', 'unknown.freshdesk.com'])
+
+    def test_lru_eviction(self):
+        now = [0.0]
+        pool = APIPool(credentials=lambda domain: {'api_key': 'key'}, max_tenants=2, idle_timeout=60,
+                       clock=lambda: now[0])
+        a = pool.get('a')
+        pool.get('b')
+        pool.get('a')
+        pool.get('c')
+        self.assertEqual(pool.domains(), ['a', 'c'])
+        self.assertEqual((pool.created, pool.evicted), (3, 1))
+        now[0] += 30
+        pool.get('c')
+        now[0] += 45
+        pool.get('c')
+        # a was idle for 75 seconds
+        self.assertNotIn('a', pool)
+        rebuilt = pool.get('a')
+        self.assertIsNot(rebuilt, a)
+        self.assertIs(rebuilt._scheduler, a._scheduler)
+        self.assertEqual(repr(pool), '<APIPool 2 tenants, 4 created, 2 evicted>')
+
+    def test_concurrency_cap(self):
+        active = []
+        peak = [0]
+        lock = threading.Lock()
+
+        def send_request():
+            with lock:
+                active.append(None)
+                peak[0] = max(peak[0], len(active))
+            time.sleep(0.02)
+            with lock:
+                active.pop()
+            return make_response(200)
+        semaphore = threading.BoundedSemaphore(2)
+        schedulers = [RequestScheduler(concurrency=semaphore) for _ in range(3)]
+        threads = [threading.Thread(target=scheduler.send, args=(send_request,)) for scheduler in schedulers * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak[0], 2)
+
+    def test_tenants_over_http(self):
+        with MockFreshdeskServer(tickets=3) as server:
+            port = server.domain.split(':')[1]
+            with APIPool(credentials=lambda domain: {'api_key': domain, 'use_https': False},
+                         max_concurrency=2) as pool:
+                tickets = [pool.get('%s:%s' % (host, port)).tickets.get_ticket(i)
+                           for host in ('127.0.0.1', 'localhost') for i in (1, 2, 3)]
+                self.assertEqual([t.display_id for t in tickets], [1, 2, 3] * 2)
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.api = API(DOMAIN, api_key=API_KEY)
+        self.api._scheduler._sleep = lambda seconds: None
+        self.events = []
+        self.api.add_hook(self.events.append)
+
+    def test_endpoint_template(self):
+        from freshdesk.metrics import endpoint_template
+        self.assertEqual(endpoint_template('helpdesk/tickets/42.json'), 'helpdesk/tickets/%d.json')
+        self.assertEqual(endpoint_template('solution/categories/1/folders/2.json'),
+                         'solution/categories/%d/folders/%d.json')
+        self.assertEqual(endpoint_template('helpdesk/tickets/filter/all_tickets?format=json&page=2'),
+                         'helpdesk/tickets/filter/all_tickets')
+        self.assertEqual(endpoint_template('contacts.json'), 'contacts.json')
+
+    def test_events(self):
+        self.api._session = FakeSession(
+            make_response(429, headers={'Retry-After': '1', 'X-RateLimit-Remaining': '0'}),
+            make_response(200, b'{"user": {}}', headers={'X-RateLimit-Remaining': '99'}))
+        self.api._get('contacts/5004272351.json')
+        event, = self.events
+        self.assertEqual((event.method, event.endpoint, event.status), ('GET', 'contacts/%d.json', 200))
+        self.assertEqual((event.size, event.retries), (12, 1))
+        self.assertEqual(event.rate_limit, {'X-RateLimit-Remaining': '99'})
+        self.assertTrue(event.ok)
+        self.assertGreaterEqual(event.latency, 0)
+
+    def test_failed_requests_are_reported(self):
+        self.api._session = FakeSession()
+        self.assertRaises(IndexError, self.api._delete, 'helpdesk/tickets/1.json')
+        self.assertIsInstance(self.events[0].error, IndexError)
+        self.assertIsNone(self.events[0].status)
+        self.assertFalse(self.events[0].ok)
+
+    def test_remove_hook(self):
+        self.api.remove_hook(self.events.append)
+        self.assertEqual(self.api._hooks, ())
+        self.api._session = FakeSession(make_response())
+        self.api._get('contacts/1.json')
+        self.assertEqual(self.events, [])
+
+    def test_histogram_collector(self):
+        from freshdesk.metrics import HistogramCollector, RequestEvent
+        collector = HistogramCollector(buckets=(0.1, 1.0))
+        for latency, status in ((0.05, 200), (0.5, 200), (0.7, 404), (5.0, 200)):
+            collector(RequestEvent('GET', 'helpdesk/tickets/%d.json', '', status, latency, 100, 0,
+                                   {'X-RateLimit-Remaining': '10'}, None))
+        stats = collector.summary()[('GET', 'helpdesk/tickets/%d.json')]
+        self.assertEqual((stats['count'], stats['errors'], stats['bytes']), (4, 1, 400))
+        self.assertEqual((stats['p50'], stats['p95']), (1.0, float('inf')))
+        text = collector.prometheus()
+        self.assertIn('freshdesk_request_duration_seconds_bucket{method="GET",endpoint="helpdesk/tickets/%d.json",'
+                      'le="1.0"} 3', text)
+        self.assertIn('freshdesk_request_duration_seconds_count{method="GET",endpoint="helpdesk/tickets/%d.json"} 4',
+                      text)
+        self.assertIn('freshdesk_ratelimit_remaining 10', text)
+
+    def test_statsd_hook(self):
+        import socket
+        from freshdesk.metrics import RequestEvent, StatsDHook
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        hook = StatsDHook('127.0.0.1', server.getsockname()[1])
+        hook(RequestEvent('PUT', 'helpdesk/tickets/%d.json', '', 500, 0.25, 10, 2, {}, None))
+        lines = server.recv(4096).decode('ascii').split('\n')
+        hook.close()
+        server.close()
+        self.assertEqual(lines, ['freshdesk.PUT.helpdesk.tickets.id.requests:1|c',
+                                 'freshdesk.PUT.helpdesk.tickets.id.latency:250.0|ms',
+                                 'freshdesk.PUT.helpdesk.tickets.id.bytes:10|c',
+                                 'freshdesk.PUT.helpdesk.tickets.id.retries:2|c',
+                                 'freshdesk.PUT.helpdesk.tickets.id.errors:1|c'])
+
+class BlockingSession(FakeSession):
+    """A FakeSession whose requests wait until release is set"""
+    def __init__(self, *responses):
+        super(BlockingSession, self).__init__(*responses)
+        self.release = threading.Event()
+
+    def request(self, method, url, **kwargs):
+        self.release.wait(5)
+        return super(BlockingSession, self).request(method, url, **kwargs)
+
+class StalledSession(FakeSession):
+    """A FakeSession whose first request waits until release is set"""
+    def __init__(self, *responses):
+        super(StalledSession, self).__init__(*responses)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def request(self, method, url, **kwargs):
+        response = super(StalledSession, self).request(method, url, **kwargs)
+        if len(self.sent) == 1:
+            self.started.set()
+            self.release.wait(5)
+        return response
+
+class TestCoalescing(TestCase):
+    def setUp(self):
+        self.api = API(DOMAIN, api_key=API_KEY, max_retries=0)
+
+    def get_concurrently(self, count, *calls):
+        """Run each call on count threads at once, returning their results or errors"""
+        results = []
+
+        def run(call):
+            try:
+                results.append(call())
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=run, args=(call,)) for call in calls for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        deadline = time.time() + 5
+        while self.api.coalesce_stats.coalesced < (count - 1) * len(calls) and time.time() < deadline:
+            time.sleep(0.001)
+        self.api._session.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_identical_gets_share_a_request(self):
+        body = json.dumps(read_fixture('ticket_1.json')).encode('utf-8')
+        self.api._session = BlockingSession(make_response(200, body))
+        tickets = self.get_concurrently(5, lambda: self.api.tickets.get_ticket(1))
+        self.assertEqual(len(self.api._session.sent), 1)
+        self.assertEqual([t.display_id for t in tickets], [1] * 5)
+        self.assertEqual(len(set(map(id, tickets))), 5)
+        self.assertEqual(self.api.coalesce_stats.as_dict(), {'executed': 1, 'coalesced': 4})
+
+    def test_callers_get_their_own_payload(self):
+        body = json.dumps(read_fixture('ticket_1.json')).encode('utf-8')
+        self.api._session = BlockingSession(make_response(200, body))
+        results = self.get_concurrently(3, lambda: self.api._get('helpdesk/tickets/1.json'))
+        self.assertEqual(results[0], results[1])
+        notes = [r['helpdesk_ticket']['notes'] for r in results]
+        self.assertEqual(len(set(map(id, notes))), 3)
+
+    def test_gets_after_a_write_are_not_coalesced_with_earlier_ones(self):
+        old = json.dumps({'helpdesk_ticket': {'subject': 'old'}}).encode('utf-8')
+        new = json.dumps({'helpdesk_ticket': {'subject': 'new'}}).encode('utf-8')
+        self.api._session = StalledSession(make_response(200, old), make_response(200), make_response(200, new))
+        slow = threading.Thread(target=self.api._get, args=('helpdesk/tickets/1.json',))
+        slow.start()
+        self.api._session.started.wait(5)
+        self.api._put('helpdesk/tickets/1.json', {'helpdesk_ticket': {'subject': 'new'}})
+        self.assertEqual(self.api._get('helpdesk/tickets/1.json')['helpdesk_ticket']['subject'], 'new')
+        self.api._session.release.set()
+        slow.join()
+        self.assertEqual(self.api.coalesce_stats.as_dict(), {'executed': 2, 'coalesced': 0})
+
+    def test_errors_are_shared(self):
+        self.api._session = BlockingSession(make_response(500))
+        errors = self.get_concurrently(3, lambda: self.api._get('contacts/1.json'))
+        self.assertEqual(len(self.api._session.sent), 1)
+        self.assertTrue(all(isinstance(e, HTTPError) for e in errors))
+
+    def test_different_params_are_not_coalesced(self):
+        self.api._session = BlockingSession(make_response(200, b'[]'), make_response(200, b'[]'))
+        self.get_concurrently(1, lambda: self.api._get('helpdesk/tickets/filter/all_tickets', {'page': 1}),
+                              lambda: self.api._get('helpdesk/tickets/filter/all_tickets', {'page': 2}))
+        self.assertEqual(len(self.api._session.sent), 2)
+        self.assertEqual(self.api.coalesce_stats.coalesced, 0)
+
+    def test_coalescing_can_be_disabled(self):
+        api = API(DOMAIN, api_key=API_KEY, coalesce=False)
+        self.assertEqual(api.coalesce_stats.as_dict(), {'executed': 0, 'coalesced': 0})
+
+class TestResponseCache(TestCase):
+    def setUp(self):
+        self.now = [1000.0]
+        self.cache = ResponseCache(MemoryCache(maxsize=2), ttl=60,
+                                   ttls={'helpdesk/tickets/filter/*': 0}, clock=lambda: self.now[0])
+        self.api = API(DOMAIN, api_key=API_KEY, cache=self.cache)
+
+    def category(self, name, etag='"v1"'):
+        body = json.dumps({'category': {'id': 3, 'name': name}}).encode('utf-8')
+        return make_response(200, body, {'ETag': etag})
+
+    def test_fresh_hits_skip_the_network(self):
+        self.api._session = FakeSession(self.category('FAQ'))
+        for _ in range(3):
+            self.assertEqual(self.api._get('solution/categories/3.json')['category']['name'], 'FAQ')
+        self.assertEqual(len(self.api._session.sent), 1)
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_expired_entries_are_revalidated(self):
+        self.api._session = FakeSession(self.category('FAQ'), make_response(304, b''), self.category('News', '"v2"'))
+        self.api._get('solution/categories/3.json')
+        self.now[0] += 61
+        self.assertEqual(self.api._get('solution/categories/3.json')['category']['name'], 'FAQ')
+        self.assertEqual(self.api._session.sent[1][2]['headers'], {'If-None-Match': '"v1"'})
+        self.assertEqual(self.cache.revalidated, 1)
+        self.now[0] += 61
+        self.assertEqual(self.api._get('solution/categories/3.json')['category']['name'], 'News')
+
+    def test_writes_invalidate_resource_and_parents(self):
+        self.api._session = FakeSession(self.category('FAQ'), make_response(200, b'[]'),
+                                        make_response(200), self.category('News'))
+        self.api._get('solution/categories/3.json')
+        self.api._get('solution/categories.json')
+        self.api._put('solution/categories/3/folders/5.json')
+        self.assertEqual(len(self.cache.backend), 0)
+        self.assertEqual(self.api._get('solution/categories/3.json')['category']['name'], 'News')
+
+    def test_writes_invalidate_listings(self):
+        import shutil
+        import tempfile
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        class ScannedCache(MemoryCache):
+            delete_paths = None
+
+        listing = 'helpdesk/tickets/filter/all_tickets?format=json&page=1'
+        self.cache.ttls = []
+        sqlite = SQLiteCache(os.path.join(directory, 'cache.sqlite'))
+        self.addCleanup(sqlite.close)
+        for backend in (MemoryCache(), sqlite, ScannedCache()):
+            self.cache.backend = backend
+            self.api._session = FakeSession(make_response(200, b'[]'), make_response(200, b'{"helpdesk_ticket": {}}'),
+                                            make_response(200, b'[]'), make_response(200, b'[]'), make_response(200),
+                                            make_response(200, b'[]'), make_response(200))
+            self.api._get(listing)
+            self.api._get('helpdesk/tickets/7.json')
+            self.api._get('helpdesk/tickets/5/notes.json')
+            self.api._get('contacts.json')
+            self.api._put('helpdesk/tickets/5.json')
+            self.assertEqual(sorted(backend.keys()), ['contacts.json', 'helpdesk/tickets/7.json'])
+            self.api._get(listing)
+            self.api._post('helpdesk/tickets.json')
+            self.assertEqual(sorted(backend.keys()), ['contacts.json', 'helpdesk/tickets/7.json'])
+            self.assertEqual(len(backend), 2)
+
+    def test_responses_predating_a_write_are_not_stored(self):
+        self.api._session = StalledSession(self.category('FAQ'), make_response(200))
+        slow = threading.Thread(target=self.api._get, args=('solution/categories/3.json',))
+        slow.start()
+        self.api._session.started.wait(5)
+        self.api._put('solution/categories/3.json', {'solution_category': {'name': 'News'}})
+        self.api._session.release.set()
+        slow.join()
+        self.assertEqual(self.cache.backend.keys(), [])
+
+    def test_per_endpoint_ttl(self):
+        self.api._session = FakeSession(make_response(200, b'[]'), make_response(200, b'[]'))
+        self.api._get('helpdesk/tickets/filter/all_tickets?format=json&page=1')
+        self.api._get('helpdesk/tickets/filter/all_tickets?format=json&page=1')
+        self.assertEqual(len(self.api._session.sent), 2)
+
+    def test_lru_eviction(self):
+        backend = MemoryCache(maxsize=2)
+        for key in ('a', 'b', 'a', 'c'):
+            backend.set(key, key)
+        self.assertEqual(backend.keys(), ['a', 'c'])
+
+    def test_sqlite_backend(self):
+        import tempfile
+        with tempfile.NamedTemporaryFile(suffix='.sqlite') as f:
+            backend = SQLiteCache(f.name, maxsize=2)
+            self.cache.backend = backend
+            self.api._session = FakeSession(self.category('FAQ'))
+            self.api._get('solution/categories/3.json')
+            self.assertEqual(self.api._get('solution/categories/3.json')['category']['name'], 'FAQ')
+            backend.close()
+            backend = SQLiteCache(f.name, maxsize=2)
+            self.assertEqual(len(backend), 1)
+            backend.get('solution/categories/3.json')
+            backend.set('b', backend.get('solution/categories/3.json'))
+            backend.set('c', backend.get('b'))
+            self.assertEqual(sorted(backend.keys()), ['b', 'c'])
+            backend.close()
+
+class TestCompactModels(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.api = MockedAPI(DOMAIN, API_KEY)
+        cls.payload = cls.api.read_test_file('all_tickets.json')[0]
+
+    def test_compact_ticket(self):
+        ticket = Ticket.compact(self.payload)(self.api, **self.payload)
+        self.assertFalse(hasattr(ticket, '__dict__'))
+        self.assertEqual(ticket.subject, 'This is a sample ticket')
+        self.assertEqual(ticket.priority, 'low')
+        self.assertEqual(ticket.status, 'open')
+        self.assertEqual(ticket.source, 'portal')
+        self.assertEqual(repr(ticket), '<Ticket \'This is a sample ticket\'>')
+        self.assertIsInstance(ticket.created_at, datetime.datetime)
+        self.assertIs(ticket.created_at, ticket.created_at)
+        self.assertEqual(ticket._keys, Ticket(self.api, **self.payload)._keys)
+
+    def test_parsed_timestamps_keep_payload(self):
+        ticket = Ticket.compact(self.payload)(self.api, **self.payload)
+        self.assertIsInstance(ticket.created_at, datetime.datetime)
+        self.assertEqual(ticket._payload()['created_at'], self.payload['created_at'])
+        json.dumps(ticket._payload())
+        ticket._apply({'created_at': '2015-01-01T00:00:00+00:00'})
+        self.assertEqual(ticket.created_at.year, 2015)
+
+        ticket = Ticket(self.api, **self.payload)
+        self.assertIsInstance(ticket.created_at, datetime.datetime)
+        json.dumps(ticket._payload())
+        ticket._apply({'created_at': '2015-01-01T00:00:00+00:00'})
+        self.assertEqual(ticket.created_at.year, 2015)
+
+    def test_isinstance(self):
+        ticket = Ticket.compact(self.payload)(self.api, **self.payload)
+        self.assertIsInstance(ticket, Ticket)
+        self.assertIsInstance(ticket, FreshdeskModel)
+        self.assertNotIsInstance(ticket, Contact)
+        self.assertTrue(issubclass(type(ticket), Ticket))
+        self.assertNotIsInstance(Contact(self.api), Ticket)
+
+    def test_schema_is_shared(self):
+        self.assertIs(Ticket.compact(self.payload), Ticket.compact(list(self.payload)))
+        self.assertIsNot(Ticket.compact(self.payload), Contact.compact(self.payload))
+
+    def test_keys_outside_schema(self):
+        ticket = Ticket.compact(['subject'])(self.api, subject='Hi', status=2, notes=[])
+        self.assertEqual(ticket.status, 'open')
+        self.assertEqual(ticket.notes, [])
+        self.assertFalse(hasattr(ticket, 'missing'))
+
+    def test_list_compact_tickets(self):
+        tickets = self.api.tickets.list_tickets(compact=True)
+        self.assertEqual(type(tickets[0]).__name__, 'CompactTicket')
+        self.assertEqual(tickets[0].display_id, 1)
+
+    def test_refresh_and_apply(self):
+        ticket = self.api.tickets.list_tickets(compact=True)[0]
+        self.assertIs(ticket.refresh(), ticket)
+        self.assertEqual(ticket.display_id, 1)
+        self.assertEqual(len(ticket.comments), 1)
+        self.assertEqual(ticket._payload(), Ticket(self.api, **self.api.read_test_file('ticket_1.json')['helpdesk_ticket'])._payload())
+        ticket._apply({'subject': 'Changed', 'brand_new': 1})
+        self.assertEqual((ticket.subject, ticket.brand_new), ('Changed', 1))
+
+class TestSolutions(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.api = MockedAPI(DOMAIN, API_KEY)
+
+    def setUp(self):
+        del self.api.requested[:]
+
+    def test_list_categories(self):
+        categories = self.api.solutions.list_categories()
+        self.assertEqual(self.api.requested, ['solution/categories.json'])
+        self.assertIsInstance(categories[0], SolutionCategory)
+        self.assertEqual(categories[0].name, 'General')
+        self.assertEqual(categories[0].folders[0].name, 'FAQ')
+
+    def test_list_categories_deep(self):
+        categories = self.api.solutions.list_categories(deep=True, max_workers=4)
+        self.assertEqual(len(self.api.requested), 2)
+        self.assertEqual(categories[0].id, 1)
+
+    def test_list_folders(self):
+        folders = self.api.solutions.list_folders(1)
+        self.assertEqual(self.api.requested, ['solution/categories/1.json'])
+        self.assertIsInstance(folders[0], SolutionFolder)
+        self.assertEqual(folders[0].category_id, 1)
+        self.assertEqual(folders[0].visibility, 'All')
+
+    def test_list_folders_deep(self):
+        folders = self.api.solutions.list_folders(1, deep=True)
+        self.assertEqual(len(self.api.requested), 2)
+        self.assertEqual(folders[0].articles[0].title, 'How do I install it?')
+
+    def test_walk(self):
+        tree = list(self.api.solutions.walk())
+        self.assertEqual(self.api.requested, ['solution/categories.json', 'solution/categories/1/folders/2.json'])
+        self.assertEqual(len(tree), 1)
+        category, folder, articles = tree[0]
+        self.assertEqual((category.name, folder.name), ('General', 'FAQ'))
+        self.assertIsInstance(articles[0], Solution)
+        self.assertEqual(articles[0].tags, ['install'])
+        self.assertEqual(articles[0].status, 'published')
+
+class TestPartialUpdates(TestCase):
+    def setUp(self):
+        self.api = MockedAPI(DOMAIN, API_KEY)
+        self.folder = self.api.solutions.get_folder(1, 2)
+        del self.api.requested[:]
+
+    def test_update_folder_without_fetching(self):
+        self.api.solutions.update_folder(1, 2, description='New')
+        self.assertEqual(self.api.requested, [])
+        self.assertEqual(self.api.written, [('PUT', 'solution/categories/1/folders/2.json',
+                                             {'solution_folder': {'description': 'New'}})])
+
+    def test_folder_update_sends_changed_fields(self):
+        self.folder.update(name='FAQ', visibility=3, description='Frequently asked questions')
+        self.assertEqual(self.api.written[0][2], {'solution_folder': {'visibility': 3}})
+        self.assertEqual(self.folder.visibility, 'Agents Only')
+        self.folder.update(visibility=3)
+        self.assertEqual(len(self.api.written), 1)
+
+    def test_article_update(self):
+        article = self.folder.articles[0]
+        article.update(title='How do I install it?', tags=['install', 'pip'])
+        self.assertEqual(self.api.requested, [])
+        self.assertEqual(self.api.written, [('PUT', 'solution/categories/1/folders/2/articles/3.json',
+                                             {'solution_article': {'tags': ['install', 'pip']}})])
+        self.assertEqual(article.tags, ['install', 'pip'])
+
+    def test_topic_update(self):
+        topic = Topic(self.api, id=7, title='Old', sticky=1, locked=0, posts=[])
+        topic.update(title='New', sticky=False)
+        self.assertEqual(self.api.written[0][2], {'topic': {'title': 'New', 'sticky': False}})
+        self.assertEqual(topic.title, 'New')
+        self.assertFalse(topic.sticky)
+
+class TestLazyRefs(TestCase):
+    def setUp(self):
+        self.api = MockedAPI(DOMAIN, API_KEY)
+
+    def test_ticket_ref(self):
+        ticket = self.api.tickets.ref(1)
+        self.assertIsInstance(ticket, Ticket)
+        self.assertEqual(ticket.display_id, 1)
+        self.assertEqual(repr(ticket), '<LazyTicket display_id=1>')
+        self.assertEqual(self.api.requested, [])
+        self.assertEqual(ticket.subject, 'This is a sample ticket')
+        self.assertEqual(ticket.status, 'open')
+        self.assertIsInstance(ticket.created_at, datetime.datetime)
+        self.assertEqual(len(ticket.comments), 1)
+        self.assertEqual(repr(ticket), '<Ticket \'This is a sample ticket\'>')
+        self.assertEqual(self.api.requested, ['helpdesk/tickets/1.json'])
+
+    def test_loaded_ref_payload(self):
+        ticket = self.api.tickets.ref(1).load()
+        payload = ticket._payload()
+        self.assertEqual(payload, self.api.tickets.get_ticket(1)._payload())
+        self.assertEqual(payload['status'], 2)
+        self.assertIn('created_at', payload)
+        self.assertNotIn('_status', payload)
+
+    def test_missing_attributes(self):
+        ticket = self.api.tickets.ref(1)
+        self.assertRaises(AttributeError, getattr, ticket, 'no_such_field')
+        self.assertTrue(ticket._loaded)
+        self.assertRaises(HTTPError, getattr, self.api.tickets.ref(2), 'subject')
+
+    def test_updates_do_not_fetch(self):
+        folder = self.api.solutions.folder_ref(1, 2)
+        folder.update(name='Renamed', visibility=1)
+        self.assertEqual(self.api.written, [('PUT', 'solution/categories/1/folders/2.json',
+                                             {'solution_folder': {'name': 'Renamed', 'visibility': 1}})])
+        self.assertEqual(folder.name, 'Renamed')
+        self.api.solutions.article_ref(1, 2, 3).update(title='New title', tags=['faq'])
+        self.assertEqual(self.api.written[-1][2], {'solution_article': {'title': 'New title', 'tags': ['faq']}})
+        self.assertEqual(self.api.requested, [])
+
+    def test_resolve(self):
+        refs = [self.api.tickets.ref(1), self.api.contacts.ref('5004272351'), self.api.solutions.folder_ref(1, 2)]
+        self.assertIs(self.api.resolve(refs, max_workers=3)[0], refs[0])
+        self.assertEqual(sorted(self.api.requested), ['contacts/5004272351.json', 'helpdesk/tickets/1.json',
+                                                      'solution/categories/1/folders/2.json'])
+        self.assertEqual([r._loaded for r in refs], [True] * 3)
+        self.assertEqual(refs[1].name, 'Rachel')
+        self.api.resolve(refs)
+        self.assertEqual(len(self.api.requested), 3)
+
+class TestBulk(TestCase):
+    def setUp(self):
+        self.api = MockedAPI(DOMAIN, API_KEY)
+
+    def contacts(self, count):
+        return ({'name': 'Contact %d' % i, 'email': 'fail' if i == 3 else 'c%d@example.com' % i} for i in range(count))
+
+    def test_create_contacts(self):
+        results = self.api.bulk.create_contacts(self.contacts(10), max_workers=4)
+        self.assertEqual(len(results), 10)
+        self.assertEqual([r.key for r in results], list(range(10)))
+        self.assertEqual(len(results.succeeded), 9)
+        self.assertIsInstance(results.succeeded[0].result, Contact)
+        self.assertEqual(results.succeeded[0].result.name, 'Contact 0')
+        self.assertEqual([r.key for r in results.failed], [3])
+        self.assertIsInstance(results.failed[0].error, HTTPError)
+
+    def test_resume_from_checkpoint(self):
+        import shutil
+        import tempfile
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'contacts.ckpt')
+        checkpoint = Checkpoint(path)
+        self.api.bulk.create_contacts(self.contacts(10), checkpoint=checkpoint)
+        checkpoint.close()
+        del self.api.written[:]
+        checkpoint = Checkpoint(path)
+        results = self.api.bulk.create_contacts(self.contacts(10), checkpoint=checkpoint)
+        checkpoint.close()
+        self.assertEqual(results.skipped, 9)
+        self.assertEqual(len(self.api.written), 1)
+        self.assertEqual([r.key for r in results.failed], [3])
+
+    def test_create_tickets(self):
+        results = self.api.bulk.create_tickets([{'subject': 'Help', 'description': 'Please', 'email': 'a@example.com'}])
+        ticket = results.succeeded[0].result
+        self.assertIsInstance(ticket, Ticket)
+        self.assertEqual(ticket.priority, 'low')
+        self.assertEqual(self.api.written[0][1], 'helpdesk/tickets.json')
+
+    def test_pool_grows_with_workers(self):
+        self.api.bulk.run(lambda i: i, range(3), max_workers=32)
+        self.assertEqual(self.api._session.get_adapter('https://x/')._pool_maxsize, 32)
+
+class TestBatchGet(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.api = MockedAPI(DOMAIN, API_KEY)
+
+    def test_get_tickets_in_order(self):
+        results = self.api.tickets.get_tickets([1, 2, 1], max_workers=3)
+        self.assertEqual([r.key for r in results], [1, 2, 1])
+        self.assertEqual(results[0].result.subject, 'This is a sample ticket')
+        self.assertIsNone(results[0].error)
+        self.assertIsNone(results[1].result)
+        self.assertIsInstance(results[1].error, HTTPError)
+        self.assertTrue(results[2].ok)
+
+    def test_get_tickets_as_completed(self):
+        results = self.api.tickets.get_tickets([1, 2, 1], max_workers=3, as_completed=True)
+        self.assertNotIsInstance(results, list)
+        self.assertEqual(sorted(r.key for r in results), [1, 1, 2])
+
+    def test_get_contacts(self):
+        results = self.api.contacts.get_contacts(['5004272351'], max_workers=16)
+        self.assertEqual(results[0].result.name, 'Rachel')
+        self.assertEqual(self.api._session.get_adapter('http://x/')._pool_maxsize, 16)
+
+class TestTicketSync(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.api = MockedAPI(DOMAIN, API_KEY)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'tickets.sync')
+
+    def serve(self, *tickets):
+        """Serve the given (display_id, created_at, updated_at) tickets from the all_tickets filter"""
+        page = [{'display_id': i, 'subject': 'Ticket %d' % i, 'created_at': c, 'updated_at': u} for i, c, u in tickets]
+        self.api.resolver[re.compile(r'helpdesk/tickets/filter/all_tickets\?format=json&page=1')] = page
+
+    def sync(self):
+        return [(c.kind, c.ticket.display_id) for c in TicketSync(self.api, SyncState(self.path)).changes()]
+
+    def test_first_sync_inserts_everything(self):
+        self.serve((2, '2015-01-02T00:00:00+10:00', '2015-01-03T00:00:00+10:00'),
+                   (1, '2015-01-01T00:00:00+10:00', '2015-01-02T00:00:00+10:00'))
+        self.assertEqual(self.sync(), [('insert', 2), ('insert', 1)])
+        state = SyncState(self.path)
+        self.assertEqual(state.updated_at.isoformat(), '2015-01-03T00:00:00+10:00')
+        self.assertEqual(state.ids, set([2]))
+
+    def test_incremental_sync(self):
+        self.serve((1, '2015-01-01T00:00:00+10:00', '2015-01-02T00:00:00+10:00'))
+        self.sync()
+        self.serve((3, '2015-01-04T00:00:00+10:00', '2015-01-04T00:00:00+10:00'),
+                   (1, '2015-01-01T00:00:00+10:00', '2015-01-03T00:00:00+10:00'),
+                   (2, '2015-01-01T00:00:00+10:00', '2015-01-01T00:00:00+10:00'))
+        self.assertEqual(self.sync(), [('insert', 3), ('update', 1)])
+        self.assertEqual(self.api.requested_params[-1]['updated_since'], '2015-01-02T00:00:00+10:00')
+        self.assertEqual(self.sync(), [])
+
+    def test_unordered_pages_are_filtered(self):
+        self.serve((1, '2015-01-01T00:00:00+10:00', '2015-01-02T00:00:00+10:00'))
+        self.sync()
+        self.serve((1, '2015-01-01T00:00:00+10:00', '2015-01-02T00:00:00+10:00'),
+                   (2, '2015-01-01T00:00:00+10:00', '2015-01-01T00:00:00+10:00'),
+                   (3, '2015-01-01T00:00:00+10:00', '2015-01-05T00:00:00+10:00'))
+        self.assertEqual(self.sync(), [('update', 3)])
+
+class TestMirror(TestCase):
+    def setUp(self):
+        self.api = MockedAPI(DOMAIN, API_KEY)
+        self.mirror = Mirror(self.api, ':memory:')
+        ticket = self.api.tickets.get_ticket(1)
+        tickets = [ticket]
+        for display_id, status, priority, updated_at in ((2, 3, 4, '2015-01-02T00:00:00+00:00'),
+                                                         (3, 2, 4, '2015-01-03T00:00:00-05:00')):
+            tickets.append(Ticket(self.api, **dict(ticket._payload(), display_id=display_id, status=status,
+                                                   priority=priority, updated_at=updated_at)))
+        self.mirror.store_tickets(tickets)
+        self.mirror.store_contacts([self.api.contacts.get_contact('5004272351')])
+
+    def tearDown(self):
+        self.mirror.close()
+
+    def test_ticket_round_trip(self):
+        ticket = self.mirror.ticket(1)
+        self.assertIsInstance(ticket, Ticket)
+        self.assertEqual(ticket.subject, 'This is a sample ticket')
+        self.assertEqual(ticket.status, 'open')
+        self.assertEqual(ticket.updated_at, self.api.tickets.get_ticket(1).updated_at)
+        self.assertEqual(len(ticket.comments), 1)
+        self.assertRaises(KeyError, self.mirror.ticket, 42)
+
+    def test_query_tickets(self):
+        ids = lambda tickets: [t.display_id for t in tickets]
+        self.assertEqual(ids(self.mirror.tickets()), [3, 2, 1])
+        self.assertEqual(ids(self.mirror.tickets(status='open')), [3, 1])
+        self.assertEqual(ids(self.mirror.tickets(status=['open', 'pending'], priority='urgent')), [3, 2])
+        self.assertEqual(ids(self.mirror.tickets(requester_id=5004272351, limit=1)), [3])
+        self.assertEqual(ids(self.mirror.tickets(updated_since='2015-01-02T00:00:00Z')), [3, 2])
+        self.assertEqual(self.mirror.count_tickets(priority=4), 2)
+
+    def test_store_replaces_tickets(self):
+        self.mirror.store_tickets([Ticket(self.api, display_id=2, subject='Updated', status=5, priority=1)])
+        self.assertEqual(self.mirror.ticket(2).subject, 'Updated')
+        self.assertEqual(self.mirror.count_tickets(), 3)
+        self.assertEqual(self.mirror.count_tickets(status='closed'), 1)
+
+    def test_compact_tickets_are_stored(self):
+        ticket = self.api.tickets.list_tickets(compact=True)[0]
+        ticket.updated_at
+        self.mirror.store_tickets([ticket])
+        self.assertEqual(self.mirror.ticket(1).updated_at, ticket.updated_at)
+
+    def test_contacts(self):
+        contact = self.mirror.contact('5004272351')
+        self.assertIsInstance(contact, Contact)
+        self.assertEqual(contact.name, 'Rachel')
+        self.assertEqual([c.name for c in self.mirror.contacts(email='rachel@freshdesk.com')], ['Rachel'])
+        self.assertEqual(self.mirror.contacts(email='nobody@example.com'), [])
+
+    def test_sync(self):
+        import shutil
+        import tempfile
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'helpdesk.db')
+        mirror = Mirror(self.api, path)
+        self.assertEqual(mirror.sync(), 1)
+        self.assertEqual(mirror.ticket(1).subject, 'This is a sample ticket')
+        self.assertTrue(os.path.exists(path + '.sync'))
+        self.assertEqual(mirror.sync(), 0)
+        mirror.close()
+
 class TestComment(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -131,7 +1106,7 @@ class TestComment(TestCase):
         cls.ticket = cls.api.tickets.get_ticket(1)
 
     def test_comments_list(self):
-        self.assertIsInstance(self.ticket.comments, list)
+        self.assertIsInstance(self.ticket.comments, Sequence)
         self.assertEqual(len(self.ticket.comments), 1)
         self.assertIsInstance(self.ticket.comments[0], Comment)
 
@@ -141,6 +1116,28 @@ class TestComment(TestCase):
     def test_comment_repr(self):
         self.assertEqual(repr(self.ticket.comments[0]), '<Comment for <Ticket \'This is a sample ticket\'>>')
 
+    def test_comments_are_memoized(self):
+        self.assertIs(self.ticket.comments, self.ticket.comments)
+        self.assertIs(self.ticket.comments[0], self.ticket.comments[0])
+
+    def test_comments_are_built_lazily(self):
+        ticket = self.api.tickets.get_ticket(1)
+        comments = ticket.comments
+        self.assertEqual(comments._models, [None])
+        comments[0]
+        self.assertIsInstance(comments._models[0], Comment)
+
+    def test_refresh_invalidates_comments(self):
+        ticket = self.api.tickets.get_ticket(1)
+        comments = ticket.comments
+        ticket.refresh()
+        self.assertIsNot(ticket.comments, comments)
+        self.assertEqual([c.body for c in ticket.comments], [c.body for c in comments])
+        ticket.notes = []
+        self.assertEqual(len(ticket.comments), 1)
+        ticket.invalidate()
+        self.assertEqual(ticket.comments, [])
+
 class TestContact(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -154,11 +1151,372 @@ class TestContact(TestCase):
         self.assertEqual(self.contact.helpdesk_agent, False)
 
     def test_contact_datetime(self):
-        self.assertIsInstance(self.contact.created_at, dateutil.parser.parser)
-        self.assertIsInstance(self.contact.updated_at, dateutil.parser.parser)
+        self.assertIsInstance(self.contact.created_at, datetime.datetime)
+        self.assertIsInstance(self.contact.updated_at, datetime.datetime)
 
     def test_contact_str(self):
         self.assertEqual(str(self.contact), 'Rachel')
 
     def test_contact_repr(self):
         self.assertEqual(repr(self.contact), '<Contact \'Rachel\'>')
+
+class TestMockServer(TestCase):
+    def test_paging(self):
+        with MockFreshdeskServer(tickets=65) as server:
+            api = API(server.domain, api_key='test_key', use_https=False)
+            pages = [[t.display_id for t in page] for page in api.tickets.iter_ticket_pages()]
+            self.assertEqual([len(page) for page in pages], [30, 30, 5])
+            self.assertEqual(pages[0][0], 65)
+            self.assertEqual(pages[2][-1], 1)
+            ticket = api.tickets.get_ticket(65)
+            self.assertEqual(ticket.display_id, 65)
+            self.assertGreater(ticket.updated_at, api.tickets.get_ticket(64).updated_at)
+            self.assertEqual(api.tickets.create_ticket('New', 'Body', email='a@example.com').display_id, 66)
+            self.assertRaises(HTTPError, api.tickets.get_ticket, 67)
+
+    def test_throttling(self):
+        with MockFreshdeskServer(throttle_every=2) as server:
+            api = API(server.domain, api_key='test_key', use_https=False)
+            api._scheduler._sleep = lambda seconds: None
+            for _ in range(3):
+                api.tickets.get_ticket(1)
+            # Requests 2 and 4 are throttled and retried
+            self.assertEqual(api.throttle_stats.retries, 2)
+            self.assertEqual(len(server.requests), 5)
+
+    def test_rate_limit(self):
+        with MockFreshdeskServer(rate_limit=2) as server:
+            api = API(server.domain, api_key='test_key', use_https=False, max_retries=0)
+            response = api._send('GET', 'helpdesk/tickets/1.json')
+            self.assertEqual(response.headers['X-RateLimit-Remaining'], '1')
+            api._send('GET', 'helpdesk/tickets/1.json')
+            response = api._send('GET', 'helpdesk/tickets/1.json')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers['X-RateLimit-Remaining'], '0')
+            self.assertGreater(int(response.headers['Retry-After']), 3500)
+
+class TestStreaming(TestCase):
+    body = json.dumps([{'subject': u'Brackets ] and } in "quotes" \\', 'tags': [[], {}]},
+                       {'subject': u'Caf\xe9 \u2615', 'n': [1, 2.5, None, True]}, [], 3]).encode('utf-8')
+
+    def parse(self, chunk_size):
+        parser = JSONArrayParser(json.loads)
+        items = []
+        for i in range(0, len(self.body), chunk_size):
+            items.extend(parser.feed(self.body[i:i + chunk_size]))
+        parser.close()
+        return items
+
+    def test_chunk_boundaries(self):
+        expected = json.loads(self.body.decode('utf-8'))
+        for chunk_size in (1, 2, 3, 7, len(self.body)):
+            self.assertEqual(self.parse(chunk_size), expected)
+
+    def test_incremental(self):
+        parser = JSONArrayParser(json.loads)
+        self.assertEqual(parser.feed(b' [{"a": 1}, {"b"'), [{'a': 1}])
+        self.assertEqual(parser.feed(b': 2}]\n'), [{'b': 2}])
+        self.assertTrue(parser.done)
+        self.assertEqual(JSONArrayParser(json.loads).feed(b'[]'), [])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, JSONArrayParser(json.loads).feed, b'{"require_login": true}')
+        self.assertRaises(ValueError, JSONArrayParser(json.loads).feed, b'[1] 2')
+        parser = JSONArrayParser(json.loads)
+        parser.feed(b'[{"a": 1}, {"b":')
+        self.assertRaises(ValueError, parser.close)
+
+    def test_stream_tickets(self):
+        with MockFreshdeskServer(tickets=65) as server:
+            api = API(server.domain, api_key='test_key', use_https=False)
+            streamed = list(api.tickets.iter_tickets(stream=True))
+            self.assertEqual([t.display_id for t in streamed], [t.display_id for t in api.tickets.iter_tickets()])
+            self.assertIsInstance(streamed[0], Ticket)
+            self.assertEqual(streamed[0].updated_at, api.tickets.get_ticket(65).updated_at)
+            compact = list(api.tickets.iter_tickets(stream=True, compact=True))
+            self.assertEqual(len(compact), 65)
+            self.assertFalse(hasattr(compact[0], '__dict__'))
+        self.assertRaises(ValueError, next, api.tickets.iter_tickets(stream=True, hydrate=True))
+
+    def test_stream_errors(self):
+        api = API('test_domain', api_key='test_key')
+        api._session = FakeSession(make_response(200, b'[{"display_id": 1}, {"displ'),
+                                   make_response(200, b'{"require_login": true}'),
+                                   make_response(404, b'Not found'),
+                                   make_response(200, b''))
+        tickets = api.tickets.iter_tickets(stream=True)
+        self.assertEqual(next(tickets).display_id, 1)
+        self.assertRaises(HTTPError, next, tickets)
+        for _ in range(2):
+            self.assertRaises(HTTPError, list, api.tickets.iter_tickets(stream=True))
+        self.assertEqual(list(api.tickets.iter_tickets(stream=True)), [])
+
+class TestAttachments(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_form_fields(self):
+        self.assertEqual(sorted(form_fields('helpdesk_ticket', {'subject': u'Caf\xe9', 'custom_field': {'a': 1},
+                                                                'tags': ['x', 'y'], 'urgent': True, 'cc': None})),
+                         [('helpdesk_ticket[custom_field][a]', '1'), ('helpdesk_ticket[subject]', u'Caf\xe9'),
+                          ('helpdesk_ticket[tags][]', 'x'), ('helpdesk_ticket[tags][]', 'y'),
+                          ('helpdesk_ticket[urgent]', 'true')])
+
+    def test_multipart_body(self):
+        import io
+        body = MultipartBody([('note[body]', 'Hi')], [('a.txt', io.BytesIO(b'abc' * 1000)), ('b.bin', b'')],
+                             'note[attachments][][resource]')
+        whole = body.read()
+        self.assertEqual(len(whole), len(body))
+        self.assertIn(b'filename="a.txt"\r\nContent-Type: text/plain\r\n\r\n' + b'abc' * 1000 + b'\r\n', whole)
+        self.assertTrue(whole.endswith(('--' + body.boundary + '--\r\n').encode('ascii')))
+        body.rewind()
+        chunks = iter(lambda: body.read(7), b'')
+        self.assertEqual(b''.join(chunks), whole)
+
+    def test_upload_and_download(self):
+        import io
+        path = os.path.join(self.directory, 'app.log')
+        with open(path, 'wb') as f:
+            f.write(b'log line\n' * 10000)
+        with MockFreshdeskServer(throttle_every=2) as server:
+            api = API(server.domain, api_key='test_key', use_https=False)
+            api._scheduler._sleep = lambda seconds: None
+            api.tickets.get_ticket(1)
+            # Throttled once, so the streamed body is sent twice
+            ticket = api.tickets.create_ticket('Logs', 'See attached', email='a@example.com', custom_field={'a': 1},
+                                               attachments=[path, ('image.png', io.BytesIO(b'\x89PNG'))])
+            self.assertEqual(api.throttle_stats.retries, 1)
+            server.throttle_every = None
+            self.assertEqual(ticket.custom_field, {'a': '1'})
+            self.assertEqual([a.content_file_name for a in ticket.attachments], ['app.log', 'image.png'])
+            self.assertIsInstance(ticket.attachments[0], Attachment)
+            self.assertEqual(server.attachments[2]['content_type'], 'image/png')
+
+            with open(path, 'rb') as f:
+                note = api.tickets.add_note(ticket.display_id, 'Another one', private=True,
+                                            attachments=[('copy.log', f)])
+            self.assertEqual(note.body, 'Another one')
+            self.assertEqual(note.ticket.display_id, ticket.display_id)
+            buffer = io.BytesIO()
+            self.assertEqual(note.attachments[0].download(buffer), 90000)
+            self.assertEqual(buffer.getvalue(), b'log line\n' * 10000)
+
+            results = api.tickets.download_attachments(list(ticket.attachments) + list(note.attachments),
+                                                       self.directory, max_workers=3)
+            self.assertEqual([os.path.basename(r.result) for r in results], ['1_app.log', '2_image.png', '3_copy.log'])
+            with open(results[1].result, 'rb') as f:
+                self.assertEqual(f.read(), b'\x89PNG')
+            self.assertRaises(HTTPError, api.tickets.download_attachment, 99, io.BytesIO())
+
+    def test_dedup(self):
+        with MockFreshdeskServer() as server:
+            api = API(server.domain, api_key='test_key', use_https=False)
+            ticket = api.tickets.create_ticket('Twice', 'Same file', email='a@example.com',
+                                               attachments=[('a.txt', b'same'), ('b.txt', b'same')])
+            store_path = os.path.join(self.directory, 'store')
+            results = api.tickets.download_attachments(ticket.attachments, store_path, dedup=True)
+            self.assertEqual(results[0].result, results[1].result)
+            requests_made = len(server.requests)
+            results = api.tickets.download_attachments(ticket.attachments, store_path, dedup=True)
+            self.assertEqual(len(server.requests), requests_made)
+            store = AttachmentStore(store_path)
+            self.assertIn(ticket.attachments[1].id, store)
+            with open(store.path(ticket.attachments[1].id), 'rb') as f:
+                self.assertEqual(f.read(), b'same')
+            store.close()
+
+class TestExport(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.server = MockFreshdeskServer(tickets=40).start()
+        self.api = API(self.server.domain, api_key='test_key', use_https=False)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def read_ndjson(self, path):
+        with open(path, 'rb') as f:
+            return [json.loads(line) for line in f]
+
+    def test_ndjson_export_and_resume(self):
+        from freshdesk.export import NDJSONWriter, export_tickets
+        path = os.path.join(self.dir, 'tickets.ndjson')
+        with NDJSONWriter(path) as writer:
+            self.assertEqual(export_tickets(self.api, writer, max_workers=4, checkpoint_every=7), 40)
+        tickets = self.read_ndjson(path)
+        self.assertEqual([t['display_id'] for t in tickets], list(range(1, 41)))
+        self.assertEqual(tickets[0]['notes'][0]['note']['body'], 'This is a reply.')
+
+        # Anything written after the last checkpoint is dropped on resume
+        with open(path, 'ab') as f:
+            f.write(b'{"display_id": 41, "subj')
+        self.server.tickets = 45
+        with NDJSONWriter(path, resume=True) as writer:
+            self.assertEqual(writer.last_display_id, 40)
+            self.assertEqual(export_tickets(self.api, writer), 5)
+        self.assertEqual([t['display_id'] for t in self.read_ndjson(path)], list(range(1, 46)))
+
+    def test_unsorted_listing_is_refused(self):
+        from freshdesk.export import NDJSONWriter, export_tickets
+        list_tickets = self.server.list_tickets
+
+        def ignore_sort(query, body, filter_name):
+            query.pop('order_type', None)
+            return list_tickets(query, body, filter_name)
+        # Route the listing through a handler that ignores order_type=asc
+        self.server._routes[0] = self.server._routes[0][:2] + (ignore_sort,)
+        path = os.path.join(self.dir, 'tickets.ndjson')
+        with NDJSONWriter(path, resume=True) as writer:
+            self.assertRaises(ValueError, export_tickets, self.api, writer, checkpoint_every=1)
+        self.assertEqual(self.read_ndjson(path), [])
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+    def test_csv_export(self):
+        import csv
+        from freshdesk.export import COMMENT_COLUMNS, TICKET_COLUMNS, CSVWriter, export_tickets
+        path = os.path.join(self.dir, 'tickets.csv')
+        with CSVWriter(path) as writer:
+            export_tickets(self.api, writer, after=30)
+        with open(path, newline='') as f:
+            tickets = list(csv.reader(f))
+        with open(os.path.join(self.dir, 'tickets_comments.csv'), newline='') as f:
+            comments = list(csv.reader(f))
+        self.assertEqual(tickets[0], list(TICKET_COLUMNS))
+        self.assertEqual([row[0] for row in tickets[1:]], [str(i) for i in range(31, 41)])
+        self.assertEqual(comments[0], list(COMMENT_COLUMNS))
+        self.assertEqual(len(comments), 11)
+        self.assertEqual(comments[1][-1], 'This is a reply.')
+
+    def test_summaries_only(self):
+        from freshdesk.export import NDJSONWriter, export_tickets
+        path = os.path.join(self.dir, 'tickets.ndjson')
+        with NDJSONWriter(path) as writer:
+            export_tickets(self.api, writer, comments=False)
+        self.assertNotIn('notes', self.read_ndjson(path)[0])
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_command_line(self):
+        import contextlib
+        import io
+        from freshdesk.export import main
+        path = os.path.join(self.dir, 'tickets.jsonl')
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main([self.server.domain, path, '--api-key', 'test_key', '--http'])
+            main([self.server.domain, path, '--api-key', 'test_key', '--http', '--resume'])
+        self.assertEqual(output.getvalue().splitlines(),
+                         ['Exported 40 tickets to ' + path, 'Exported 0 tickets to ' + path])
+        self.assertEqual(len(self.read_ndjson(path)), 40)
+
+@unittest.skipIf(AsyncAPI is None, 'aiohttp is not installed')
+class TestAsyncModels(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.api = MockedAsyncAPI(DOMAIN, API_KEY)
+        self.written = self.api.blocking.written
+
+    async def test_topic_update(self):
+        topic = Topic(self.api, id=3, title='Old', body_html='<p>Body</p>', sticky=0, locked=0)
+        pending = topic.update(title='New')
+        self.assertEqual(topic.title, 'Old')
+        self.assertEqual(self.written, [])
+        await pending
+        self.assertEqual(topic.title, 'New')
+        self.assertEqual(self.written, [('PUT', 'discussions/topics/3.json', {'topic': {'title': 'New'}})])
+        self.assertIsNone(await topic.update(title='New'))
+        self.assertEqual(len(self.written), 1)
+
+    async def test_folder_update(self):
+        folder = await self.api.solutions.get_folder(1, 2)
+        pending = folder.update(name='Renamed')
+        self.assertNotEqual(folder.name, 'Renamed')
+        self.assertIs(await pending, folder)
+        self.assertEqual(folder.name, 'Renamed')
+        self.assertEqual(self.written, [('PUT', 'solution/categories/1/folders/2.json',
+                                         {'solution_folder': {'name': 'Renamed'}})])
+        self.assertIs(await folder.update(name='Renamed'), folder)
+        self.assertEqual(len(self.written), 1)
+
+    async def test_refresh(self):
+        ticket = await self.api.tickets.get_ticket(1)
+        ticket.subject = 'Stale'
+        self.assertIs(await ticket.refresh(), ticket)
+        self.assertEqual(ticket.subject, 'This is a sample ticket')
+        category = await self.api.solutions.get_category(1)
+        self.assertIs(await category.refresh(), category)
+        folder = await self.api.solutions.get_folder(1, 2)
+        self.assertIs(await folder.refresh(), folder)
+
+    async def test_article_update(self):
+        folder = await self.api.solutions.get_folder(1, 2)
+        article = folder.articles[0]
+        pending = article.update(title='New title', tags=['a'])
+        self.assertNotEqual(article.title, 'New title')
+        self.assertIs(await pending, article)
+        self.assertEqual((article.title, article.tags), ('New title', ['a']))
+        self.assertEqual(self.written[0][2], {'solution_article': {'title': 'New title', 'tags': ['a']}})
+
+@unittest.skipIf(AsyncAPI is None, 'aiohttp is not installed')
+class TestAsyncAPI(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockFreshdeskServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    async def asyncSetUp(self):
+        self.api = AsyncAPI(self.server.domain, api_key=API_KEY, max_concurrency=4, use_https=False)
+
+    async def asyncTearDown(self):
+        await self.api.close()
+
+    async def test_get_ticket(self):
+        ticket = await self.api.tickets.get_ticket(1)
+        self.assertIsInstance(ticket, Ticket)
+        self.assertEqual(ticket.subject, 'This is a sample ticket')
+        self.assertEqual(ticket.status, 'open')
+        self.assertEqual(len(ticket.comments), 1)
+
+    async def test_list_tickets(self):
+        tickets = await self.api.tickets.list_all_tickets()
+        self.assertEqual([t.display_id for t in tickets], [1])
+        tickets = await self.api.tickets.list_tickets(filter_name='new_my_open', hydrate=True)
+        self.assertEqual(len(tickets[0].comments), 1)
+        self.assertEqual(await self.api.tickets.list_deleted_tickets(), [])
+
+    async def test_get_contact(self):
+        contact = await self.api.contacts.get_contact('5004272351')
+        self.assertIsInstance(contact, Contact)
+        self.assertEqual(contact.name, 'Rachel')
+
+    async def test_create_contact(self):
+        contact = await self.api.contacts.create_contact('Sam', 'sam@example.com')
+        self.assertEqual(contact.name, 'Sam')
+        self.assertEqual(contact.email, 'sam@example.com')
+
+    async def test_404_error(self):
+        from requests.exceptions import HTTPError
+        with self.assertRaises(HTTPError):
+            await self.api.tickets.get_ticket(2)
+
+    async def test_download_attachment(self):
+        import io
+        attachment_id = len(self.server.attachments) + 1
+        self.server.attachments[attachment_id] = {'filename': 'app.log', 'content_type': 'text/plain',
+                                                  'data': b'log line\n' * 10000}
+        attachment = Attachment(self.api, id=attachment_id, content_file_name='app.log')
+        buffer = io.BytesIO()
+        self.assertEqual(await attachment.download(buffer, chunk_size=1000), 90000)
+        self.assertEqual(buffer.getvalue(), b'log line\n' * 10000)
+        chunks = [chunk async for chunk in attachment.iter_content()]
+        self.assertEqual(b''.join(chunks), buffer.getvalue())
+        with self.assertRaises(HTTPError):
+            await self.api.tickets.download_attachment(attachment_id + 1, io.BytesIO())
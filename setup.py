@@ -8,8 +8,10 @@ setup(
     author_email='sam@sjkwi.com.au, asghar@asgharkhan.uk',
     description='A Python interface for the Freshdesk API. This is a fork of https://github.com/sjkingo/python-freshdesk',
     url='https://github.com/i-ghost/python-freshdesk',
+    python_requires='>=3.8',
     install_requires=['requests', 'python-dateutil'],
+    extras_require={'async': ['aiohttp'], 'fast': ['orjson'], 'parquet': ['pyarrow']},
     packages=['freshdesk'],
-    test_suite='nose.collector',
-    tests_require=['nose']
+    test_suite='freshdesk.test',
+    tests_require=['pytest']
 )
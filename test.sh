@@ -1,2 +1,2 @@
 #!/bin/sh
-nosetests --with-coverage --cover-package=freshdesk
+coverage run --source=freshdesk -m pytest freshdesk/test.py